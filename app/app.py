@@ -23,6 +23,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 # Используем относительные импорты вместо абсолютных
 from utils import config_manager
 from utils import image_utils
+from utils import image_catalog
+from utils import image_watcher
+from utils import index_snapshot
 from utils.config_manager import get_downloads_folder, ConfigManager
 # <<< ДОБАВЛЯЕМ ГЛОБАЛЬНЫЙ ИМПОРТ >>>
 from core.processor import process_excel_file, create_pdf_cards
@@ -364,6 +367,48 @@ def show_settings():
         
         # Ensure max_file_size_mb in session_state is always up-to-date
         st.session_state.max_file_size_mb = cm.get_setting('file_settings.max_size_mb', 100)
+
+        with st.expander("Сканирование папок", expanded=False):
+            st.markdown("Параметры обхода папок с изображениями (важно для сетевых папок).")
+            scan_inputs = [
+                ('scan_settings.max_workers', "Параллельных потоков чтения папок", 1, 64, 8, 1,
+                 "Сколько папок читается одновременно при построении индекса изображений"),
+                ('scan_settings.dir_timeout_sec', "Таймаут чтения папки (сек)", 1, 600, 30, 5,
+                 "Папки, чтение которых занимает больше указанного времени, пропускаются"),
+            ]
+            for setting_key, label, min_value, max_value, default_value, step, help_text in scan_inputs:
+                current_value = int(cm.get_setting(setting_key, default_value))
+                new_value = st.number_input(label, min_value=min_value, max_value=max_value,
+                                            value=current_value, step=step, help=help_text,
+                                            key=f"{setting_key}_input")
+                if new_value != current_value:
+                    cm.set_setting(setting_key, int(new_value))
+                    # Сканер читает настройки из глобального менеджера конфигурации
+                    config_manager.set_setting(setting_key, int(new_value))
+                    cm.save_settings()
+
+            current_snapshot_path = cm.get_setting('scan_settings.snapshot_path', '') or ''
+            new_snapshot_path = st.text_input(
+                "Снимок индекса изображений",
+                value=current_snapshot_path,
+                help="Файл снимка в общей папке. При запуске каталог загружается из него, "
+                     "и повторный обход сетевых папок не требуется",
+                key="scan_settings.snapshot_path_input"
+            )
+            if new_snapshot_path != current_snapshot_path:
+                cm.set_setting('scan_settings.snapshot_path', new_snapshot_path)
+                config_manager.set_setting('scan_settings.snapshot_path', new_snapshot_path)
+                cm.save_settings()
+
+            if new_snapshot_path and st.button("Сохранить снимок индекса", key="export_index_snapshot_button"):
+                try:
+                    with st.spinner("Обновление каталога и сохранение снимка..."):
+                        header = index_snapshot.export_snapshot(new_snapshot_path, image_catalog.get_image_catalog())
+                    st.success(f"Снимок сохранен: папок {len(header['roots'])}, "
+                               f"файлов {sum(entry['files'] for entry in header['roots'])}")
+                except Exception as e:
+                    log.error(f"Ошибка при сохранении снимка индекса: {e}", exc_info=True)
+                    st.error(f"Не удалось сохранить снимок индекса: {e}")
         
         # Кнопка сброса всех путей к папкам
         if st.button("Сбросить все пути к папкам", key="reset_paths_button"):
@@ -1142,6 +1187,11 @@ def process_files():
                     st.session_state.not_found_articles = not_found_articles
                     warning_msg = f"Не найдены изображения для {len(not_found_articles)} артикулов."
                     add_log_message(warning_msg, "WARNING")
+                    for item in not_found_articles:
+                        suggestions = item['product_suggestions'] + item['package_suggestions']
+                        if suggestions:
+                            suggestion_names = ', '.join(os.path.basename(path) for path in suggestions)
+                            add_log_message(f"Артикул {item['article']}: похожие изображения - {suggestion_names}", "INFO")
                 
                 log.info("===================== ОБРАБОТКА ЗАВЕРШЕНА УСПЕШНО =====================")
                 return True
@@ -1171,7 +1221,7 @@ def show_results(stats: Dict[str, Any]):
     """
     st.write("**Результаты обработки:**")
     st.write(f"**Создано карточек:** {stats['inserted_cards']}")
-    st.write(f"**Не найдены изображения для:** {', '.join(stats['not_found_articles'])}")
+    st.write(f"**Не найдены изображения для:** {', '.join(item['article'] for item in stats['not_found_articles'])}")
 
 def initialize_session_state():
     """Инициализирует переменные в session state, если их нет"""
@@ -1198,6 +1248,14 @@ def initialize_session_state():
         if key not in st.session_state:
             st.session_state[key] = value
 
+@st.cache_resource
+def start_image_index_warmup():
+    """
+    Один раз на процесс сервера Streamlit запускает построение индексов изображений
+    и фоновое наблюдение за папками
+    """
+    return image_watcher.warm_up_configured_indexes(image_catalog.get_image_catalog())
+
 def check_required_modules():
     """
     Заглушка для функции проверки модулей.
@@ -1221,6 +1279,9 @@ def main():
     # Проверяем наличие необходимых модулей
     check_required_modules()
 
+    # Запускаем подготовку индексов изображений в фоне
+    start_image_index_warmup()
+
     # Отображаем UI
     show_settings()
     file_uploader_section()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Бенчмарк параллельного вывода карточек PDF (utils/card_shards.py): последовательный вывод в один
+документ FPDF против вывода частями в пуле из разного количества процессов. Изображения
+подготовлены заранее, поэтому измеряется только разметка и вывод в PDF.
+
+Запуск:
+    python benchmarks/bench_card_shards.py [количество строк] [количество процессов ...]
+"""
+import io
+import os
+import sys
+import time
+import random
+import tempfile
+
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import card_layout
+from utils import card_shards
+from utils import pdf_stream
+
+DEFAULT_COUNT = 2000
+IMAGE_COUNT = 64
+IMAGE_SIZE_PX = 480
+FONT_FAMILY = "Helvetica"
+
+
+def make_images():
+    """JPEG с шумом; изображения повторяются, как у товаров одной серии"""
+    images = []
+    for seed in range(IMAGE_COUNT):
+        rng = random.Random(seed)
+        image = Image.effect_noise((IMAGE_SIZE_PX, IMAGE_SIZE_PX), 64).convert("RGB")
+        image = Image.blend(image, Image.new("RGB", image.size, tuple(rng.randrange(256) for _ in range(3))), 0.5)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=70)
+        images.append(buffer.getvalue())
+    return images
+
+
+def make_text_lines(index):
+    rng = random.Random(index)
+    words = "Item colour material size package barcode long name Made in Ukraine".split()
+    return [{"header": header, "value": " ".join(rng.choice(words) for _ in range(rng.randint(1, 40)))}
+            for header in ("Article", "Name", "Colour", "Material", "Size", "Barcode", "Description")]
+
+
+def card_images(images, index):
+    product, package = images[index % IMAGE_COUNT], images[(index * 7 + 3) % IMAGE_COUNT]
+    return {"product": lambda: product, "package": lambda: package}
+
+
+def render_sequential(rows, images, engine, output_path):
+    pdf = card_layout.create_card_pdf(card_layout.CARD_PAGE_GEOMETRY, FONT_FAMILY)
+    for index in range(rows):
+        pdf.add_page()
+        pdf.set_y(10)
+        layout = engine.layout_card(make_text_lines(index), {"product": "product", "package": "package"},
+                                    article=f"art{index}")
+        card_layout.render_card_layout(pdf, layout, FONT_FAMILY, card_images(images, index))
+    pdf.output(output_path)
+
+
+def render_sharded(rows, images, engine, output_path, workers):
+    writer = pdf_stream.StreamingPdfWriter(output_path)
+    renderer = card_shards.ShardedCardRenderer(
+        writer, card_shards.ShardContext(card_layout.CARD_PAGE_GEOMETRY, FONT_FAMILY, {}), workers,
+        pdf_stream.DEFAULT_CHUNK_CARDS, temp_dir=os.path.dirname(output_path))
+    for index in range(rows):
+        layout = engine.layout_card(make_text_lines(index), {"product": "product", "package": "package"},
+                                    article=f"art{index}")
+        renderer.add_card(layout, card_images(images, index))
+    renderer.finish()
+    writer.close()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+    worker_counts = [int(value) for value in sys.argv[2:]] or sorted({2, 4, os.cpu_count() or 1} - {0, 1})
+    images = make_images()
+    engine = card_layout.CardLayoutEngine(card_layout.CARD_PAGE_GEOMETRY, FONT_FAMILY, {})
+
+    print(f"Строк: {rows}, ядер: {os.cpu_count()}")
+    with tempfile.TemporaryDirectory() as folder:
+        output_path = os.path.join(folder, "cards.pdf")
+        start = time.perf_counter()
+        render_sequential(rows, images, engine, output_path)
+        sequential = time.perf_counter() - start
+        print(f"{'последовательно':<28} {sequential:8.2f} сек")
+        for workers in worker_counts:
+            start = time.perf_counter()
+            render_sharded(rows, images, engine, output_path, workers)
+            elapsed = time.perf_counter() - start
+            print(f"{f'частями, процессов {workers}':<28} {elapsed:8.2f} сек  x{sequential / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
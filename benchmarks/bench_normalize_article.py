@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Микро-бенчмарк нормализации артикулов: прежняя посимвольная реализация
+против пакетных normalize_articles / normalize_article_series.
+
+Запуск:
+    python benchmarks/bench_normalize_article.py [количество строк]
+"""
+import os
+import sys
+import time
+import random
+import string
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import image_utils
+
+DEFAULT_COUNT = 1_000_000
+
+
+def legacy_normalize_article(article, for_excel=False):
+    """Прежняя реализация normalize_article (посимвольная сборка строки) для сравнения"""
+    if article is None:
+        return ""
+    article_str = str(article).strip()
+    if not article_str:
+        return ""
+    normalized = ''
+    for char in article_str:
+        if char.isalnum() or char == ' ' or (not for_excel and char == '_'):
+            normalized += char
+        else:
+            normalized += '-'
+    return normalized.lower()
+
+
+def generate_articles(count, seed=42, ascii_only=False):
+    """Генерирует артикулы, похожие на реальные (латиница, кириллица, разделители)"""
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + ("" if ascii_only else "АБВГДежзиклмн") + "-_/. ()#"
+    return [" " * rng.randint(0, 1) + "".join(rng.choice(alphabet) for _ in range(rng.randint(4, 16)))
+            for _ in range(count)]
+
+
+def measure(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed:8.3f} сек")
+    return result, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+
+    for dataset, ascii_only in (("ASCII", True), ("с кириллицей", False)):
+        articles = generate_articles(count, ascii_only=ascii_only)
+        series = pd.Series(articles)
+        print(f"\nНормализация {count} строк ({dataset})")
+
+        for for_excel in (True, False):
+            mode = "Excel" if for_excel else "файлы"
+            legacy, legacy_time = measure(f"[{mode}] посимвольно (прежняя реализация)",
+                                          lambda: [legacy_normalize_article(a, for_excel) for a in articles])
+            scalar, _ = measure(f"[{mode}] normalize_article в цикле",
+                                lambda: [image_utils.normalize_article(a, for_excel) for a in articles])
+            batch, batch_time = measure(f"[{mode}] normalize_articles",
+                                        lambda: image_utils.normalize_articles(articles, for_excel))
+            vectorized, series_time = measure(f"[{mode}] normalize_article_series",
+                                              lambda: image_utils.normalize_article_series(series, for_excel))
+
+            assert legacy == scalar == batch == vectorized.tolist(), f"Результаты различаются ({mode})"
+            print(f"[{mode}] ускорение: normalize_articles x{legacy_time / batch_time:.1f}, "
+                  f"normalize_article_series x{legacy_time / series_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
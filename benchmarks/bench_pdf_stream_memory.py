@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Бенчмарк пикового потребления памяти при создании PDF с карточками: документ FPDF целиком в памяти
+против потоковой записи частями (utils/pdf_stream.py). Каждое измерение выполняется в отдельном
+процессе, у каждой карточки свое изображение.
+
+Запуск:
+    python benchmarks/bench_pdf_stream_memory.py [количество строк ...]
+"""
+import gc
+import io
+import os
+import sys
+import time
+import random
+import tempfile
+import subprocess
+
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import card_layout
+from utils import pdf_stream
+
+DEFAULT_COUNTS = [500, 1000, 2000, 4000]
+IMAGE_SIZE_PX = 480
+IMAGE_QUALITY = 70
+IMAGE_POOL = 16  # Количество разных шумовых основ изображений
+FONT_FAMILY = "Helvetica"
+
+_base_images = {}
+
+
+def make_image(seed):
+    """JPEG с шумом и меткой карточки, чтобы изображения разных карточек не совпадали и не объединялись FPDF"""
+    base = _base_images.get(seed % IMAGE_POOL)
+    if base is None:
+        rng = random.Random(seed % IMAGE_POOL)
+        base = Image.effect_noise((IMAGE_SIZE_PX, IMAGE_SIZE_PX), 64).convert("RGB")
+        base = Image.blend(base, Image.new("RGB", base.size, tuple(rng.randrange(256) for _ in range(3))), 0.5)
+        _base_images[seed % IMAGE_POOL] = base
+    image = base.copy()
+    image.paste((seed % 256, seed // 256 % 256, seed // 65536 % 256), (0, 0, 16, 16))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def make_text_lines(index):
+    rng = random.Random(index)
+    words = "Item colour material size package barcode long name Made in Ukraine".split()
+    return [{"header": header, "value": " ".join(rng.choice(words) for _ in range(rng.randint(1, 12)))}
+            for header in ("Article", "Name", "Colour", "Material", "Size", "Barcode")]
+
+
+def new_document():
+    return card_layout.create_card_pdf(card_layout.CARD_PAGE_GEOMETRY, FONT_FAMILY)
+
+
+def render(rows, mode, output_path):
+    """Выводит rows карточек в output_path так же, как create_pdf_cards"""
+    engine = card_layout.CardLayoutEngine(card_layout.CARD_PAGE_GEOMETRY, FONT_FAMILY, {})
+    writer = pdf_stream.StreamingPdfWriter(output_path) if mode == "stream" else None
+    pdf = new_document()
+    for index in range(rows):
+        if writer and index and index % pdf_stream.DEFAULT_CHUNK_CARDS == 0:
+            writer.append_pdf(pdf.output())
+            pdf = new_document()
+            gc.collect()
+        pdf.add_page()
+        pdf.set_y(10)
+        product, package = make_image(index * 2), make_image(index * 2 + 1)
+        layout = engine.layout_card(make_text_lines(index), {"product": "product", "package": "package"},
+                                    article=f"art{index}")
+        card_layout.render_card_layout(pdf, layout, FONT_FAMILY,
+                                       {"product": lambda data=product: data, "package": lambda data=package: data})
+    if writer:
+        writer.append_pdf(pdf.output())
+        writer.close()
+    else:
+        pdf.output(output_path)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return float("nan")
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS - байты
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def worker(rows, mode):
+    with tempfile.TemporaryDirectory() as folder:
+        output_path = os.path.join(folder, "cards.pdf")
+        start = time.perf_counter()
+        render(rows, mode, output_path)
+        elapsed = time.perf_counter() - start
+        size_mb = os.path.getsize(output_path) / 1024 / 1024
+    print(f"{peak_rss_mb():.1f} {elapsed:.3f} {size_mb:.2f}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        worker(int(sys.argv[2]), sys.argv[3])
+        return
+    counts = [int(value) for value in sys.argv[1:]] or DEFAULT_COUNTS
+
+    print(f"{'строк':>7} {'режим':<8} {'пик RSS, МБ':>12} {'время, сек':>11} {'PDF, МБ':>8}")
+    for rows in counts:
+        for mode in ("memory", "stream"):
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", str(rows), mode],
+                                    capture_output=True, text=True, check=True)
+            peak, elapsed, size_mb = result.stdout.split()
+            print(f"{rows:>7} {mode:<8} {float(peak):>12.1f} {float(elapsed):>11.2f} {float(size_mb):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
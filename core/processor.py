@@ -1,5 +1,6 @@
 import os
 import sys
+import gc
 import logging
 import pandas as pd
 from datetime import datetime
@@ -14,7 +15,6 @@ import shutil
 from PIL import Image as PILImage
 import re
 import io
-from fpdf import FPDF
 
 # Add parent directory to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -25,6 +25,17 @@ if parent_dir not in sys.path:
 # Import utils modules directly
 from utils import config_manager
 from utils import image_utils # Импортируем весь модуль
+from utils import image_index
+from utils import image_catalog
+from utils import image_watcher
+from utils import fuzzy_index
+from utils import image_cache
+from utils import image_pipeline
+from utils import budget_planner
+from utils import renditions
+from utils import card_layout
+from utils import pdf_stream
+from utils import card_shards
 
 # Import get_downloads_folder from config_manager
 from utils.config_manager import get_downloads_folder
@@ -50,13 +61,6 @@ EXCEL_PX_TO_PT_RATIO = 0.75  # Коэффициент преобразовани
 DEFAULT_EXCEL_COLUMN_WIDTH = 40  # Ширина колонки в единицах Excel (примерно 300px)
 MIN_COLUMN_WIDTH_PX = 100  # Минимальная допустимая ширина колонки в пикселях
 
-# <<< Constants for PDF layout optimization >>>
-PDF_MARGIN_LEFT = 3  # Левое поле в мм (уменьшено для оптимизации)
-PDF_MARGIN_RIGHT = 3  # Правое поле в мм (уменьшено для оптимизации)
-PDF_MARGIN_TOP = 3  # Верхнее поле в мм (уменьшено для оптимизации)
-PDF_MARGIN_BOTTOM = 3  # Нижнее поле в мм (уменьшено для оптимизации)
-PDF_SAFETY_MARGIN = 10  # Отступ безопасности в мм (уменьшен с 56 = 4 * 14)
-
 # <<< Constants for progress formatting >>>
 POWERSHELL_GREEN = '\033[92m'
 POWERSHELL_YELLOW = '\033[93m'
@@ -124,12 +128,22 @@ def find_images_in_multiple_folders(
     secondary_folder: Optional[str],
     tertiary_folder: Optional[str],
     supported_extensions: Tuple[str, ...],
-    search_recursively: bool = True
+    search_recursively: bool = True,
+    index: Optional[image_index.ImageIndex] = None
 ) -> Dict[str, Any]:
     """
     Ищет изображения по артикулу в нескольких папках с разным приоритетом.
     Использует image_utils.normalize_article для сравнения.
+    Если передан индекс, построенный по этим же папкам, поиск выполняется по нему без обхода диска.
     """
+    if index is not None:
+        tier, found_images = index.find_in_best_tier(article)
+        if not found_images:
+            return {"found": False, "images": [], "source_folder": None}
+        source = image_index.get_tier_name(tier)
+        logger.info(f"Найдено {len(found_images)} изображений для '{article}' в папке '{source}'")
+        return {"found": True, "images": found_images, "source_folder": source}
+
     # Нормализуем артикул из Excel один раз перед поиском
     normalized_article_from_excel = image_utils.normalize_article(article, for_excel=True)
     logger.debug(f"Поиск для артикула '{article}' (нормализован: '{normalized_article_from_excel}')")
@@ -137,37 +151,24 @@ def find_images_in_multiple_folders(
     if not normalized_article_from_excel:
         return {"found": False, "images": [], "source_folder": None}
 
-    search_order = [
-        ("primary", primary_folder),
-        ("secondary", secondary_folder),
-        ("tertiary", tertiary_folder),
-    ]
-
-    for source, folder_path in search_order:
-        if not folder_path or not os.path.exists(folder_path):
-            continue
-
-        found_images = []
-        
-        walk_generator = os.walk(folder_path) if search_recursively else [(os.path.dirname(folder_path) or folder_path, [], os.listdir(folder_path))]
-
-        for root, _, files in walk_generator:
-            for file in files:
-                if file.lower().endswith(supported_extensions):
-                    file_name_without_ext = os.path.splitext(file)[0]
-                    # Нормализуем имя файла для сравнения
-                    normalized_file_name = image_utils.normalize_article(file_name_without_ext, for_excel=False)
-                    
-                    if normalized_file_name == normalized_article_from_excel:
-                        found_images.append(os.path.join(root, file))
-        
-        if found_images:
-            logger.info(f"Найдено {len(found_images)} изображений для '{article}' в папке '{source}'")
-            return {
-                "found": True,
-                "images": sorted(found_images), # Сортируем для предсказуемости
-                "source_folder": source
-            }
+    search_order = [primary_folder, secondary_folder, tertiary_folder]
+    search_order = [folder if folder and os.path.exists(folder) else None for folder in search_order]
+
+    # Ищем по постоянному каталогу изображений вместо обхода папок
+    catalog = image_catalog.get_image_catalog()
+    candidates = catalog.lookup(article, search_order, recursive=search_recursively)
+    candidates = [(tier, path) for tier, path in candidates if path.lower().endswith(supported_extensions)]
+
+    if candidates:
+        best_tier = candidates[0][0]
+        found_images = [path for tier, path in candidates if tier == best_tier]
+        source = image_index.get_tier_name(best_tier)
+        logger.info(f"Найдено {len(found_images)} изображений для '{article}' в папке '{source}'")
+        return {
+            "found": True,
+            "images": sorted(found_images), # Сортируем для предсказуемости
+            "source_folder": source
+        }
 
     return {"found": False, "images": [], "source_folder": None}
 
@@ -419,9 +420,16 @@ def process_excel_file(
     
     print("[PROCESSOR] --- Начало итерации по строкам DataFrame ---", file=sys.stderr)
     
-    # Сбрасываем кеш качества перед обработкой нового файла
-    image_utils.cached_quality = None
-    print("[PROCESSOR] Кеш качества изображений сброшен", file=sys.stderr)
+    # Оптимизатор изображений этого запуска: состояние подбора качества и статистика
+    # не разделяются с другими одновременными обработками
+    image_optimizer = image_utils.ImageOptimizer()
+    
+    # Изображения больше target_width x target_height уменьшаются перед вставкой (если включено resize_enabled)
+    image_max_width, image_max_height = image_utils.get_configured_max_size()
+    
+    # Оптимизированные изображения берутся из дискового кэша, если исходник и параметры не изменились
+    optimized_cache = image_cache.get_configured_image_cache()
+    optimized_cache_stats = optimized_cache.get_stats() if optimized_cache else None
     
     # Переменные для определения оптимального качества сжатия
     successful_quality = DEFAULT_IMG_QUALITY  # Если не найдено, используем значение по умолчанию
@@ -430,6 +438,20 @@ def process_excel_file(
     # Общее количество строк для расчета прогресса
     total_rows = len(df)
     
+    supported_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp')
+    
+    # Получаем пути к резервным папкам из параметров или конфигурации
+    secondary_folder_path = secondary_image_folder or config_manager.get_setting("paths.secondary_images_folder_path", "")
+    tertiary_folder_path = tertiary_image_folder or config_manager.get_setting("paths.tertiary_images_folder_path", "")
+    
+    # Строим индекс изображений один раз для всех строк вместо обхода папок для каждого артикула
+    search_index = image_index.ImageIndex(
+        [image_folder, secondary_folder_path, tertiary_folder_path],
+        supported_extensions=supported_extensions,
+        catalog=image_catalog.get_image_catalog()
+    ).build()
+    print(f"[PROCESSOR] Индекс изображений построен за {search_index.stats['build_time_sec']:.2f} сек, файлов: {search_index.stats['files_indexed']}", file=sys.stderr)
+    
     # Итерация по строкам таблицы
     for excel_row_index, row in df.iterrows():
         # Проверяем, нужно ли обновить прогресс
@@ -448,13 +470,6 @@ def process_excel_file(
             print(f"[PROCESSOR]   Пустой артикул в строке {excel_row_index}, пропускаем", file=sys.stderr)
             continue
         
-        # Find images for this article in multiple folders
-        supported_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp')
-        
-        # Получаем пути к резервным папкам из параметров или конфигурации
-        secondary_folder_path = secondary_image_folder or config_manager.get_setting("paths.secondary_images_folder_path", "")
-        tertiary_folder_path = tertiary_image_folder or config_manager.get_setting("paths.tertiary_images_folder_path", "")
-        
         # Логируем папки для диагностики
         print(f"[PROCESSOR DEBUG] Поиск изображений для артикула '{article_str}' в папках:", file=sys.stderr)
         print(f"[PROCESSOR DEBUG]   Основная: {image_folder}", file=sys.stderr)
@@ -468,7 +483,8 @@ def process_excel_file(
             secondary_folder_path,
             tertiary_folder_path,
             supported_extensions,
-            search_recursively=True
+            search_recursively=True,
+            index=search_index
         )
         
         # Добавляем результат поиска в список
@@ -483,7 +499,10 @@ def process_excel_file(
         
         # If no images found, record and continue
         if not search_result["found"]:
+            search_result['suggestions'] = search_index.suggest(article_str)
             print(f"[PROCESSOR WARNING]   Для артикула '{article_str}' (строка {excel_row_index}) не найдено изображений. Пропускаем.", file=sys.stderr)
+            if search_result['suggestions']:
+                print(f"[PROCESSOR]   Похожие изображения: {', '.join(search_result['suggestions'])}", file=sys.stderr)
             # Добавляем артикул в список не найденных
             not_found_articles.append(article_str)
             continue
@@ -507,7 +526,13 @@ def process_excel_file(
         # 1. ОПТИМИЗАЦИЯ ИЗОБРАЖЕНИЯ (если требуется)
         optimized_buffer = None
         
-        if original_size_kb <= target_kb_per_image:
+        try:
+            needs_downscale = image_utils.exceeds_size(image_path, image_max_width, image_max_height)
+        except Exception as e:
+            print(f"[PROCESSOR ERROR]   Не удалось прочитать размеры изображения: {e}", file=sys.stderr)
+            needs_downscale = False
+        
+        if original_size_kb <= target_kb_per_image and not needs_downscale:
             # Если размер уже подходит, просто загружаем изображение без оптимизации
             print(f"[PROCESSOR]   Изображение уже удовлетворяет требованиям по размеру, загружаем без оптимизации", file=sys.stderr)
             try:
@@ -523,9 +548,13 @@ def process_excel_file(
             print(f"[PROCESSOR]   Вызов optimize_image_for_excel для {image_path} с лимитом {target_kb_per_image:.1f} КБ", file=sys.stderr)
             
             try:
-                optimized_buffer = image_utils.optimize_image_for_excel(
+                optimized_buffer = image_cache.optimize_image_cached(
                     image_path, 
-                    target_size_kb=target_kb_per_image
+                    target_size_kb=target_kb_per_image,
+                    max_width=image_max_width,
+                    max_height=image_max_height,
+                    cache=optimized_cache,
+                    optimizer=image_optimizer
                 )
             except Exception as e:
                 print(f"[PROCESSOR ERROR]   Ошибка при оптимизации изображения: {e}", file=sys.stderr)
@@ -719,6 +748,10 @@ def process_excel_file(
     
     print(f"[PROCESSOR] СТАТИСТИКА: Обработано строк: {rows_processed}, вставлено изображений: {images_inserted}", file=sys.stderr)
     print(f"[PROCESSOR] Общий размер вставленных изображений: {total_processed_image_size_kb:.2f} КБ", file=sys.stderr)
+    print(f"[PROCESSOR] Индекс изображений: {search_index.format_stats()}", file=sys.stderr)
+    if optimized_cache:
+        print(f"[PROCESSOR] Кэш изображений: {optimized_cache.format_stats(optimized_cache_stats)}", file=sys.stderr)
+    print(f"[PROCESSOR] Оптимизация изображений: {image_optimizer.format_stats()}", file=sys.stderr)
     
     # Финальный вывод прогресса обработки
     print_progress(total_rows, total_rows, f"Завершено! Вставлено изображений: {images_inserted}")
@@ -793,13 +826,22 @@ def _get_col_index(col_identifier: str, df_columns: pd.Index) -> int:
         else:
             raise ValueError(f"Столбец '{col_identifier}' не найден.")
 
-def find_image_path(article: str, folders: List[str]) -> Optional[str]:
+def find_image_path(article: str, folders: List[str],
+                    index: Optional[image_index.ImageIndex] = None) -> Optional[str]:
     """
     Ищет изображение по артикулу в списке папок, включая подпапки (рекурсивно).
     Использует централизованную логику нормализации из image_utils.
+    Если передан индекс, построенный по этим же папкам, поиск выполняется по нему без обхода диска.
     """
+    if index is not None:
+        img_path = index.find_first(article)
+        if img_path:
+            logger.info(f"Найдено изображение для артикула '{article}': {img_path}")
+        else:
+            logger.warning(f"Изображение для артикула '{article}' не найдено ни в одной из папок.")
+        return img_path
+
     logger.debug(f"Поиск для артикула '{article}' в папках: {folders}")
-    supported_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp')
 
     # Нормализуем артикул из Excel перед поиском
     normalized_article_from_excel = image_utils.normalize_article(article, for_excel=True)
@@ -808,90 +850,102 @@ def find_image_path(article: str, folders: List[str]) -> Optional[str]:
         logger.warning(f"Артикул '{article}' после нормализации стал пустым, поиск невозможен.")
         return None
 
+    available_folders = []
     for folder in folders:
         if not folder or not os.path.exists(folder):
             if folder:
                 logger.warning(f"Папка с изображениями не существует или недоступна: {folder}")
-            continue
-        
-        for root, _, files in os.walk(folder):
-            for file in files:
-                file_name_without_ext, extension = os.path.splitext(file)
-                if extension.lower() in supported_extensions:
-                    # Нормализуем имя файла для сравнения
-                    normalized_file_name = image_utils.normalize_article(file_name_without_ext, for_excel=False)
-                    if normalized_file_name == normalized_article_from_excel:
-                        img_path = os.path.join(root, file)
-                        logger.info(f"Найдено изображение для артикула '{article}': {img_path}")
-                        return img_path  # Возвращаем первый найденный путь
+            available_folders.append(None)
+        else:
+            available_folders.append(folder)
+
+    # Ищем по постоянному каталогу изображений вместо обхода папок
+    candidates = image_catalog.get_image_catalog().lookup(article, available_folders)
+    if candidates:
+        img_path = candidates[0][1]
+        logger.info(f"Найдено изображение для артикула '{article}': {img_path}")
+        return img_path  # Возвращаем первый найденный путь
 
     logger.warning(f"Изображение для артикула '{article}' не найдено ни в одной из папок.")
     return None
 
-def _split_header_text(pdf: FPDF, header_text: str, max_width: float) -> List[str]:
-    """
-    Разбивает текст заголовка на строки с переносом только по пробелам.
-    Возвращает список строк.
+def resolve_images(
+    articles: List[Any],
+    product_image_folders: List[str],
+    package_image_folders: List[str],
+    product_index: Optional[image_index.ImageIndex] = None,
+    package_index: Optional[image_index.ImageIndex] = None,
+    suggestions_limit: int = fuzzy_index.DEFAULT_SUGGESTIONS_LIMIT
+) -> pd.DataFrame:
     """
-    words = header_text.split(' ')
-    current_line = ''
-    header_lines = []
+    Находит изображения товаров и упаковок для всех строк за один проход по индексам.
+    Повторяющиеся артикулы нормализуются и ищутся один раз.
     
-    for word in words:
-        test_line = current_line + (' ' if current_line else '') + word
-        if pdf.get_string_width(test_line) <= max_width:
-            current_line = test_line
-        else:
-            if current_line:
-                header_lines.append(current_line)
-                current_line = word
-            else:
-                # Если слово не помещается даже в пустую строку, добавляем его целиком
-                header_lines.append(word)
-                current_line = ''
-    
-    if current_line:
-        header_lines.append(current_line)
-    
-    # Если текст пустой, возвращаем список с одной пустой строкой
-    return header_lines if header_lines else ['']
-
-def _count_header_lines(pdf: FPDF, header_text: str, max_width: float) -> int:
-    """
-    Подсчитывает количество строк для заголовка с переносом только по пробелам.
-    """
-    # Получаем список строк и возвращаем их количество
-    header_lines = _split_header_text(pdf, header_text, max_width)
-    return len(header_lines)
-
-def _force_wrap_text(pdf: FPDF, text: str, max_width: float) -> str:
-    """
-    A robust text processing function that prepares text for FPDF's multi_cell.
-    It ensures text fits within the cell width without breaking words across lines.
-    1. Replaces any single character that is too wide with '?'.
-    2. Keeps words intact for dynamic font sizing in create_pdf_cards.
-    """
-    safe_words = []
-    # Replace non-breaking spaces and strip text as a precaution
-    text = text.replace('\u00A0', ' ').strip()
-
-    for word in text.split(' '):
-        if not word:
-            continue
-        
-        # 1. Sanitize the word of any single character that is too wide
-        sanitized_word = ""
-        for char in word:
-            if pdf.get_string_width(char) > max_width:
-                logger.warning(f"A single character ('{char}') was wider than the cell and has been replaced by '?'.") 
-                sanitized_word += "?"
-            else:
-                sanitized_word += char
+    Args:
+        articles (List[Any]): Артикулы в порядке строк
+        product_image_folders (List[str]): Папки с изображениями товаров по приоритету
+        package_image_folders (List[str]): Папки с изображениями упаковок по приоритету
+        product_index (ImageIndex, optional): Индекс папок товаров. По умолчанию - живой индекс процесса
+        package_index (ImageIndex, optional): Индекс папок упаковок. По умолчанию - живой индекс процесса
+        suggestions_limit (int, optional): Количество подсказок с похожими именами файлов для
+            ненайденных изображений. 0 - подсказки не подбираются
         
-        # 2. Keep words intact for dynamic font sizing
-        safe_words.append(sanitized_word)
-            
-    return " ".join(safe_words)
+    Returns:
+        pd.DataFrame: Таблица в порядке строк со столбцами
+            - article: артикул
+            - normalized_article: нормализованный артикул
+            - product_image: путь к изображению товара или None
+            - package_image: путь к изображению упаковки или None
+            - missing: True, если не найдено хотя бы одно из изображений
+            - product_suggestions, package_suggestions: пути к изображениям с похожими именами
+              для ненайденных изображений (пустой список, если изображение найдено)
+    """
+    if product_index is None or package_index is None:
+        catalog = image_catalog.get_image_catalog()
+        if product_index is None:
+            product_index = image_watcher.get_live_index(product_image_folders, kind="product", catalog=catalog)
+        if package_index is None:
+            package_index = image_watcher.get_live_index(package_image_folders, kind="package", catalog=catalog)
+
+    articles = list(articles)
+    normalized_articles = image_utils.normalize_articles(articles, for_excel=True)
+
+    # Ищем каждый уникальный артикул один раз
+    product_paths = {}
+    package_paths = {}
+    for normalized_article in dict.fromkeys(normalized_articles):
+        product_candidates = product_index.get_candidates_normalized(normalized_article)
+        package_candidates = package_index.get_candidates_normalized(normalized_article)
+        product_paths[normalized_article] = product_candidates[0][1] if product_candidates else None
+        package_paths[normalized_article] = package_candidates[0][1] if package_candidates else None
+
+    product_column = [product_paths[normalized_article] for normalized_article in normalized_articles]
+    package_column = [package_paths[normalized_article] for normalized_article in normalized_articles]
+    resolved = pd.DataFrame({
+        "article": pd.Series(articles, dtype=object),
+        "normalized_article": pd.Series(normalized_articles, dtype=object),
+        "product_image": pd.Series(product_column, dtype=object),
+        "package_image": pd.Series(package_column, dtype=object),
+    })
+    resolved["missing"] = resolved["product_image"].isna() | resolved["package_image"].isna()
+
+    # Подсказки подбираются один раз для каждого уникального ненайденного артикула
+    product_suggestions = {}
+    package_suggestions = {}
+    if suggestions_limit > 0:
+        for article, normalized_article in zip(articles, normalized_articles):
+            if product_paths[normalized_article] is None and normalized_article not in product_suggestions:
+                product_suggestions[normalized_article] = product_index.suggest(article, suggestions_limit)
+            if package_paths[normalized_article] is None and normalized_article not in package_suggestions:
+                package_suggestions[normalized_article] = package_index.suggest(article, suggestions_limit)
+    resolved["product_suggestions"] = pd.Series(
+        [product_suggestions.get(normalized_article, []) for normalized_article in normalized_articles], dtype=object)
+    resolved["package_suggestions"] = pd.Series(
+        [package_suggestions.get(normalized_article, []) for normalized_article in normalized_articles], dtype=object)
+
+    logger.info(f"Поиск изображений: строк {len(articles)}, уникальных артикулов {len(product_paths)}, "
+                f"без изображений {int(resolved['missing'].sum())}")
+    return resolved
 
 def create_pdf_cards(
     df: pd.DataFrame,
@@ -905,18 +959,21 @@ def create_pdf_cards(
     sheet_name: str = None,
     workbook: openpyxl.Workbook = None,
     worksheet: openpyxl.worksheet.worksheet.Worksheet = None,
-) -> Tuple[str, int, List[str]]:
+) -> Tuple[str, int, List[Dict[str, Any]]]:
     """
     Создает PDF-файл с карточками товаров.
+    
+    Returns:
+        Tuple[str, int, List[Dict[str, Any]]]: Путь к PDF, количество карточек и список строк без
+            изображений: словари с ключами article, product_suggestions, package_suggestions
+            (пути к изображениям с похожими именами)
     """
     import math  # Импортируем math для проверки на NaN
-    image_utils.cached_quality = None # Reset cached quality for each new processing session
+    # Оптимизатор изображений этого запуска (состояние подбора качества и статистика)
+    image_optimizer = image_utils.ImageOptimizer()
 
-    pdf = FPDF(orientation='P', unit='mm', format=(90, 160))
-    # Устанавливаем минимальные поля для максимального использования пространства
-    pdf.set_margins(PDF_MARGIN_LEFT, PDF_MARGIN_TOP, PDF_MARGIN_RIGHT)
-    # Устанавливаем автоматический разрыв страницы с минимальным нижним полем
-    pdf.set_auto_page_break(True, PDF_MARGIN_BOTTOM)
+    # Документ с размерами и полями страницы карточки
+    pdf = card_layout.create_card_pdf(card_layout.CARD_PAGE_GEOMETRY)
     
     # Проверяем, есть ли данные для обработки
     
@@ -927,21 +984,20 @@ def create_pdf_cards(
     
     # Используем шрифт Arial, который стандартно установлен в Windows
     font_family = 'Arial'
+    # Обычный и жирный шрифты
+    font_files = {'': 'C:/Windows/Fonts/arial.ttf', 'B': 'C:/Windows/Fonts/arialbd.ttf'}
     try:
-        # Добавляем обычный шрифт
-        pdf.add_font(font_family, '', 'C:/Windows/Fonts/arial.ttf', uni=True)
-        # Добавляем жирный шрифт
-        pdf.add_font(font_family, 'B', 'C:/Windows/Fonts/arialbd.ttf', uni=True)
+        for style, font_path in font_files.items():
+            pdf.add_font(font_family, style, font_path)
         pdf.set_font(font_family, '', 14)  # Увеличен стандартный размер шрифта для лучшей читаемости
     except RuntimeError as e:
         logger.warning(f"Не удалось загрузить шрифт Arial: {e}. Используется стандартный шрифт, кириллица может не отображаться.")
         # Fallback to a core font, which may not render Cyrillic correctly
         font_family = 'Helvetica'
+        font_files = {}
         pdf.set_font(font_family, '', 14)  # Увеличен стандартный размер шрифта для лучшей читаемости
-        
-    # Определяем запас по высоте для предотвращения выхода текста за границы страницы
-    # Оставляем запас в 4 строки текста при стандартном размере шрифта
-    safety_margin = PDF_SAFETY_MARGIN  # Используем константу вместо жесткого значения
+    # Разметка карточек рассчитывается отдельно от вывода, документ только воспроизводит планы
+    layout_engine = card_layout.CardLayoutEngine(card_layout.CARD_PAGE_GEOMETRY, font_family, font_files)
 
     inserted_cards = 0
     not_found_articles = []
@@ -963,103 +1019,166 @@ def create_pdf_cards(
         return "", 0, not_found_articles
 
     total_rows = len(data_df)
-    for index, row in data_df.iterrows():
-        if progress_callback:
-            progress_callback(index - 1 + 1, total_rows)  # Корректируем индекс, так как пропустили первую строку
-
+    
+    # Изображения товара и упаковки занимают по половине ширины страницы (около 40 мм).
+    # Исходники уменьшаются до этой ширины при разрешении печати image_settings.print_dpi
+    img_width = card_layout.CARD_PAGE_GEOMETRY.image_width
+    image_max_width_px = (image_utils.mm_to_pixels(img_width, image_utils.get_configured_print_dpi())
+                          if image_utils.is_resize_enabled() else None)
+    optimized_cache = image_cache.get_configured_image_cache()
+    optimized_cache_stats = optimized_cache.get_stats() if optimized_cache else None
+    # Копии изображений, заранее рассчитанные для всей библиотеки (python start.py --precompute-images)
+    rendition_store = renditions.open_configured_store(image_max_width_px, image_optimizer)
+    # Пулы процессов, копии изображений и недописанный PDF закрываются и при прерывании
+    # (например, исключении из progress_callback при остановке Streamlit)
+    row_images = None
+    stream_writer = None
+    shard_renderer = None
+    stream_completed = False
+    try:
+    
+        # Строим индексы изображений один раз: поиск для каждой строки выполняется по словарю без обхода папок
+        # Индексы загружаются из постоянного каталога один раз на процесс и далее поддерживаются
+        # в актуальном состоянии фоновым наблюдением за папками, поэтому повторный обход не нужен
+        catalog = image_catalog.get_image_catalog()
+        product_index = image_watcher.get_live_index(product_image_folders, kind="product", catalog=catalog)
+        package_index = image_watcher.get_live_index(package_image_folders, kind="package", catalog=catalog)
+        product_index_stats = product_index.get_stats()
+        package_index_stats = package_index.get_stats()
+    
         try:
-            article = str(row.iloc[article_col_idx]).strip()
+            articles = [str(value).strip() for value in data_df.iloc[:, article_col_idx].tolist()]
         except IndexError:
             # This case should be caught by _get_col_index, but as a safeguard:
             raise IndexError(f"Столбец с артикулами ({article_col_name}) не существует в файле.")
-
-        product_img_path = find_image_path(article, product_image_folders)
-        package_img_path = find_image_path(article, package_image_folders)
-
+    
+        # Изображения для всех строк находятся одним пакетным запросом к индексам
+        resolved_images = resolve_images(articles, product_image_folders, package_image_folders,
+                                         product_index=product_index, package_index=package_index)
+        # Если хотя бы одно изображение отсутствует, артикул попадает в список "ненайденных"
+        # вместе с подсказками - изображениями с похожими именами
+        not_found_articles = resolved_images.loc[
+            resolved_images["missing"], ["article", "product_suggestions", "package_suggestions"]
+        ].to_dict("records")
+    
         # Рассчитываем лимит размера на изображение
         article_count = len(data_df)
         if article_count == 0:
             article_count = 1  # Избегаем деления на ноль
-            
+        
         image_size_budget_mb = max_total_file_size_mb * SIZE_BUDGET_FACTOR
         target_kb_per_image = (image_size_budget_mb * 1024) / article_count if article_count > 0 else MAX_KB_PER_IMAGE
         target_kb_per_image = max(MIN_KB_PER_IMAGE, min(target_kb_per_image, MAX_KB_PER_IMAGE))
-        
+    
         logger.debug(f"Лимит размера на изображение: {target_kb_per_image:.1f} КБ")
-
-        # Создаем страницу для каждого артикула
-        # Для первого артикула страница создается только если есть данные
-        # Для последующих артикулов страница создается только если предыдущий артикул был успешно добавлен
-        if inserted_cards > 0 or (inserted_cards == 0 and pdf.page == 0):
-            pdf.add_page()
-            pdf.set_y(10)  # Устанавливаем позицию Y в начало новой страницы
-        
-        # Если хотя бы одно изображение отсутствует, добавляем артикул в список "ненайденных"
-        if not product_img_path or not package_img_path:
-            not_found_articles.append(article)
-
-        # Добавляем изображения, только если они были найдены
-        if product_img_path:
-            try:
-                # Оптимизируем изображение перед вставкой
-                optimized_buffer = image_utils.optimize_image_for_excel(
-                    product_img_path,
-                    target_size_kb=target_kb_per_image,
-                    quality=DEFAULT_IMG_QUALITY,
-                    min_quality=MIN_IMG_QUALITY
-                )
-                temp_img_path = os.path.join(tempfile.gettempdir(), f"temp_product_{article}.jpg")
-                with open(temp_img_path, "wb") as f:
-                    f.write(optimized_buffer.getvalue())
-                # Рассчитываем оптимальную ширину изображения товара
-                img_width = (pdf.w - PDF_MARGIN_LEFT - PDF_MARGIN_RIGHT) / 2 - 2
-                pdf.image(temp_img_path, x=PDF_MARGIN_LEFT, y=PDF_MARGIN_TOP, w=img_width)
-                os.remove(temp_img_path)
-            except Exception as e:
-                logger.error(f"Ошибка при вставке изображения товара '{product_img_path}' для артикула '{article}': {e}")
-        if package_img_path:
-            try:
-                # Оптимизируем изображение перед вставкой
-                optimized_buffer = image_utils.optimize_image_for_excel(
-                    package_img_path,
-                    target_size_kb=target_kb_per_image,
-                    quality=DEFAULT_IMG_QUALITY,
-                    min_quality=MIN_IMG_QUALITY
-                )
-                temp_img_path = os.path.join(tempfile.gettempdir(), f"temp_package_{article}.jpg")
-                with open(temp_img_path, "wb") as f:
-                    f.write(optimized_buffer.getvalue())
-                # Рассчитываем оптимальную ширину и позицию изображения упаковки
-                img_width = (pdf.w - PDF_MARGIN_LEFT - PDF_MARGIN_RIGHT) / 2 - 2
-                img_x = PDF_MARGIN_LEFT + img_width + 2
-                pdf.image(temp_img_path, x=img_x, y=PDF_MARGIN_TOP, w=img_width)
-                os.remove(temp_img_path)
-            except Exception as e:
-                logger.error(f"Ошибка при вставке изображения упаковки '{package_img_path}' для артикула '{article}': {e}")
-
-
-        # Add text
-        # Устанавливаем позицию Y после изображений с минимальным отступом
-        img_height = 40  # Примерная высота изображений
-        pdf.set_y(PDF_MARGIN_TOP + img_height + 2)  # Минимальный отступ после изображений
+    
+        product_image_paths = resolved_images["product_image"].tolist()
+        package_image_paths = resolved_images["package_image"].tolist()
+    
+        # План размера: общий лимит распределяется между найденными изображениями по их кривым
+        # "качество -> размер", легкие изображения сохраняют полное качество, сжимаются тяжелые.
+        # Без плана все изображения получают одинаковый лимит target_kb_per_image
+        budget_plan = None
+        if budget_planner.is_planning_enabled():
+            budget_plan = budget_planner.plan_image_budget(
+                [path for path in product_image_paths + package_image_paths if path],
+                max_total_file_size_mb,
+                pages=total_rows,
+                max_width=image_max_width_px,
+                max_kb_per_image=MAX_KB_PER_IMAGE,
+                optimizer=image_optimizer,
+                cache=optimized_cache
+            )
+            logger.info(f"План размера PDF: {budget_plan.format_report()}")
+    
+        # Очень большие листы выводятся параллельно: части из последовательных строк выводятся в пуле
+        # процессов и дописываются в итоговый файл в порядке строк
+        shard_workers = card_shards.get_configured_workers(total_rows)
+        # Большие листы записываются на диск частями по stream_chunk_cards карточек: документ FPDF
+        # хранит в памяти все страницы и изображения, поэтому готовые части дописываются в файл
+        # и документ создается заново
+        stream_chunk_cards = 0 if shard_workers else pdf_stream.get_configured_chunk_cards(total_rows)
+        if stream_chunk_cards or shard_workers:
+            stream_path = os.path.join(output_folder, f".product_cards_{os.getpid()}_{int(time.time())}.pdf.part")
+            stream_writer = pdf_stream.StreamingPdfWriter(stream_path)
+        # Одинаковый набор символов в шрифтах всех частей: шрифты встраиваются в итоговый PDF один раз
+        charset = ""
+        if stream_writer and font_files:
+            charset = card_shards.collect_charset(str(value) for value in headers + data_df.to_numpy().ravel().tolist())
+        if shard_workers:
+            shard_renderer = card_shards.ShardedCardRenderer(
+                stream_writer, card_shards.ShardContext(card_layout.CARD_PAGE_GEOMETRY, font_family, font_files, charset),
+                shard_workers, pdf_stream.get_configured_chunk_size())
+            logger.info(f"Параллельный вывод карточек: строк {total_rows}, процессов {shard_workers}, "
+                        f"частями по {shard_renderer.shard_cards} карточек")
+        elif stream_chunk_cards:
+            card_shards.prepick_charset(pdf, font_family, font_files, charset)
+            logger.info(f"Потоковая запись PDF: строк {total_rows}, частями по {stream_chunk_cards} карточек")
+    
+        # Изображения следующих строк оптимизируются в пуле процессов, пока текущая карточка выводится в PDF
+        row_images = image_pipeline.prepare_images_ahead(
+            zip(product_image_paths, package_image_paths),
+            target_size_kb=target_kb_per_image,
+            max_width=image_max_width_px,
+            cache=optimized_cache,
+            targets_kb=budget_plan.targets_kb if budget_plan else None,
+            optimizer=image_optimizer,
+            renditions=rendition_store
+        )
+    
+        for (index, row), article, product_img_path, package_img_path, (product_image_job, package_image_job) in zip(
+                data_df.iterrows(),
+                articles,
+                product_image_paths,
+                package_image_paths,
+                row_images):
+            if progress_callback:
+                progress_callback(index - 1 + 1, total_rows)  # Корректируем индекс, так как пропустили первую строку
+
+            # Готовая часть документа записывается в файл, следующие карточки выводятся в новый документ
+            if stream_chunk_cards and inserted_cards and inserted_cards % stream_chunk_cards == 0:
+                stream_writer.append_pdf(pdf.output())
+                pdf = card_layout.create_card_pdf(card_layout.CARD_PAGE_GEOMETRY, font_family, font_files)
+                card_shards.prepick_charset(pdf, font_family, font_files, charset)
+                # Документ FPDF содержит циклические ссылки: память части (вместе с изображениями)
+                # освобождается только сборщиком циклов
+                gc.collect()
+
+            # Создаем страницу для каждого артикула
+            # Для первого артикула страница создается только если есть данные
+            # Для последующих артикулов страница создается только если предыдущий артикул был успешно добавлен
+            # При параллельном выводе страницы создаются в документах частей
+            if shard_renderer is None and (inserted_cards > 0 or (inserted_cards == 0 and pdf.page == 0)):
+                pdf.add_page()
+                pdf.set_y(10)  # Устанавливаем позицию Y в начало новой страницы
         
-        # Собираем текст из всех ячеек строки, включая артикул в его исходном порядке
-        text_lines = []
-        # Используем заголовки из первой строки и значения из текущей строки
-        for i in range(len(row)):
-            # Получаем значение ячейки с форматированием, если доступны workbook и worksheet
-            if workbook and worksheet:
-                try:
-                    # Получаем номер строки в Excel (учитываем, что индекс в pandas начинается с 0, а в Excel с 1)
-                    # Также учитываем, что мы пропустили строку заголовков
-                    excel_row = index + 1  # index уже скорректирован для пропуска заголовков
-                    excel_col = i + 1  # Колонки в Excel начинаются с 1
+            # Собираем текст из всех ячеек строки, включая артикул в его исходном порядке
+            text_lines = []
+            # Используем заголовки из первой строки и значения из текущей строки
+            for i in range(len(row)):
+                # Получаем значение ячейки с форматированием, если доступны workbook и worksheet
+                if workbook and worksheet:
+                    try:
+                        # Получаем номер строки в Excel (учитываем, что индекс в pandas начинается с 0, а в Excel с 1)
+                        # Также учитываем, что мы пропустили строку заголовков
+                        excel_row = index + 1  # index уже скорректирован для пропуска заголовков
+                        excel_col = i + 1  # Колонки в Excel начинаются с 1
                     
-                    # Используем функцию форматирования из excel_utils
-                    cell_value = excel_utils.get_formatted_cell_value(worksheet, excel_row, excel_col)
-                except Exception as e:
-                    logger.warning(f"Ошибка при получении отформатированного значения ячейки [{excel_row}, {excel_col}]: {e}")
-                    # Fallback к стандартной обработке
+                        # Используем функцию форматирования из excel_utils
+                        cell_value = excel_utils.get_formatted_cell_value(worksheet, excel_row, excel_col)
+                    except Exception as e:
+                        logger.warning(f"Ошибка при получении отформатированного значения ячейки [{excel_row}, {excel_col}]: {e}")
+                        # Fallback к стандартной обработке
+                        raw_value = row.iloc[i]
+                        if isinstance(raw_value, (int, float)) and not math.isnan(raw_value):
+                            if raw_value == int(raw_value):
+                                cell_value = str(int(raw_value)).strip()
+                            else:
+                                cell_value = str(raw_value).strip()
+                        else:
+                            cell_value = str(raw_value).strip()
+                else:
+                    # Стандартная обработка без форматирования
                     raw_value = row.iloc[i]
                     if isinstance(raw_value, (int, float)) and not math.isnan(raw_value):
                         if raw_value == int(raw_value):
@@ -1068,267 +1187,87 @@ def create_pdf_cards(
                             cell_value = str(raw_value).strip()
                     else:
                         cell_value = str(raw_value).strip()
-            else:
-                # Стандартная обработка без форматирования
-                raw_value = row.iloc[i]
-                if isinstance(raw_value, (int, float)) and not math.isnan(raw_value):
-                    if raw_value == int(raw_value):
-                        cell_value = str(int(raw_value)).strip()
-                    else:
-                        cell_value = str(raw_value).strip()
-                else:
-                    cell_value = str(raw_value).strip()
             
-            # Получаем заголовок для текущей колонки
-            header = headers[i] if i < len(headers) else f"Столбец {i+1}"
-            header = str(header).strip()
-            # Проверяем заголовок, если он пустой или 'nan', заменяем его пробелом
-            if not header or header.lower() == 'nan':
-                header = " "
-            # Если значение пустое или 'nan', заменяем его пробелом
-            if not cell_value or cell_value.lower() == 'nan':
-                cell_value = " "
-            # Добавляем заголовок и значение как отдельные элементы для таблицы
-            text_lines.append({"header": header, "value": cell_value})
-
-        # --- Dynamically adjust font size and column width ---
-        available_width = pdf.w - pdf.l_margin - pdf.r_margin
+                # Получаем заголовок для текущей колонки
+                header = headers[i] if i < len(headers) else f"Столбец {i+1}"
+                header = str(header).strip()
+                # Проверяем заголовок, если он пустой или 'nan', заменяем его пробелом
+                if not header or header.lower() == 'nan':
+                    header = " "
+                # Если значение пустое или 'nan', заменяем его пробелом
+                if not cell_value or cell_value.lower() == 'nan':
+                    cell_value = " "
+                # Добавляем заголовок и значение как отдельные элементы для таблицы
+                text_lines.append({"header": header, "value": cell_value})
+
+            # Рассчитываем план карточки: место изображений, размер шрифта, переносы строк и страницы продолжения
+            layout = layout_engine.layout_card(
+                text_lines, {"product": product_img_path, "package": package_img_path}, article=article)
         
-        # Уменьшаем доступную высоту, чтобы учесть возможное уменьшение пространства внизу страницы
-        # Используем safety_margin, определенный в начале функции
-        # Рассчитываем доступную высоту с учетом нижнего поля и отступа безопасности
-        available_height = pdf.h - pdf.y - PDF_MARGIN_BOTTOM - safety_margin
-
-        best_font_size = 0
-        final_lines_to_render = []
-
-        # Функция для проверки, помещается ли текст в одну строку
-        def text_fits_in_one_line(font_size, text, max_width):
-            pdf.set_font_size(font_size)
-            return pdf.get_string_width(text) <= max_width
-
-        # Определяем минимальную необходимую ширину заголовка для динамического расчета ширины колонок
-        max_header_width = 0
-        for item in text_lines:
-            pdf.set_font(font_family, 'B', 14)  # Используем максимальный размер шрифта для оценки
-            header_width = pdf.get_string_width(item['header'])
-            max_header_width = max(max_header_width, header_width)
-
-        # Оптимизируем ширину колонки заголовка, чтобы она не была избыточно большой при коротких заголовках
-        # Добавляем минимальный отступ и ограничиваем максимальную ширину заголовка до 30% от доступной ширины
-        # Оптимизируем ширину заголовка для лучшего использования пространства
-        max_header_width = min(max_header_width + 2, available_width * 0.4)  # Увеличиваем до 40% от доступной ширины
-        # Устанавливаем отступ между колонками
-        column_spacing = pdf.get_string_width("W")  # Используем ширину широкого символа 'W' как отступ
-        value_width = available_width - max_header_width - column_spacing  # Отступ между колонками
+            # Изображения оптимизированы заранее в конвейере и передаются в FPDF из памяти
+            image_jobs = {"product": product_image_job, "package": package_image_job}
+            image_loaders = {kind: job.result for kind, job in image_jobs.items() if job is not None}
+            if shard_renderer:
+                shard_renderer.add_card(layout, image_loaders)
+            else:
+                card_layout.render_card_layout(pdf, layout, font_family, image_loaders)
         
-        # Если много колонок, уменьшаем шрифт до минимально возможного размера
-        if len(text_lines) > 6:  # Уменьшенное пороговое значение для оптимизации пространства
-            logger.info(f"Обнаружено большое количество колонок ({len(text_lines)}), уменьшаем шрифт для лучшего размещения.")
-            # Начинаем с меньшего размера шрифта для большого количества колонок
-            font_size_range = range(10, 5, -1)  # Увеличен минимальный размер шрифта с 4 до 6 пунктов, начиная с 10
-        else:
-            font_size_range = range(14, 7, -1)  # Стандартный диапазон с увеличенным минимальным размером шрифта до 8 пунктов
-
-        # Iterate from a reasonable max down to a min font size to find the best fit
-        for test_font_size in font_size_range:
-            pdf.set_font_size(test_font_size)
-            
-            all_processed_lines = []
-            total_height = 0
-            fits_in_one_line = True
-            
-            for item in text_lines:
-                # Обрабатываем заголовок и значение отдельно
-                safe_header = _force_wrap_text(pdf, item['header'], max_header_width)
-                safe_value = _force_wrap_text(pdf, item['value'], value_width)
-                
-                # Проверяем, помещается ли значение в одну строку
-                # Для заголовков разрешаем перенос строк, поэтому не проверяем их
-                pdf.set_font(font_family, '')
-                value_fits = text_fits_in_one_line(test_font_size, safe_value, value_width)
-                
-                if not value_fits:
-                    fits_in_one_line = False
-                
-                # Добавляем обработанные строки как словарь
-                all_processed_lines.append({"header": safe_header, "value": safe_value})
-
-            # Calculate height based on the safe, wrapped lines
-            for item in all_processed_lines:
-                # Считаем высоту для заголовка с переносом только по пробелам
-                pdf.set_font(font_family, 'B')
-                header_lines = _count_header_lines(pdf, item['header'], max_header_width)
-                
-                # Считаем высоту для значения
-                pdf.set_font(font_family, '')
-                value_lines = len(pdf.multi_cell(w=value_width, txt=item['value'], split_only=True))
-                
-                # Берем максимальное количество строк (заголовок или значение)
-                max_lines = max(header_lines, value_lines)
-                
-                # Суммируем высоту (используем максимальное количество строк, так как они будут отображаться рядом)
-                total_height += max_lines * pdf.font_size + 2  # +2 для отступа между строками таблицы
-            
-            # Проверяем, помещается ли текст по высоте
-            # Если колонок много, игнорируем требование, чтобы все строки помещались в одну строку
-            if len(text_lines) > 6:  # Уменьшенное пороговое значение для оптимизации пространства
-                if total_height < available_height:
-                    best_font_size = test_font_size
-                    final_lines_to_render = all_processed_lines
-                    break
+            inserted_cards += 1
+    
+        # Закрываем пул процессов конвейера изображений
+        row_images.close()
+        if rendition_store:
+            logger.info(f"Копии изображений: {rendition_store.format_stats()}")
+            rendition_store.close()
+
+        logger.info(f"Индекс изображений товаров: {product_index.format_stats(product_index_stats)}")
+        logger.info(f"Индекс изображений упаковок: {package_index.format_stats(package_index_stats)}")
+        if optimized_cache:
+            logger.info(f"Кэш изображений: {optimized_cache.format_stats(optimized_cache_stats)}")
+        logger.info(f"Оптимизация изображений: {image_optimizer.format_stats()}")
+
+        if inserted_cards == 0:
+            return "", 0, not_found_articles
+
+        # Проверяем, есть ли страницы в PDF (при параллельном выводе - в частях)
+        if pdf.page > 0 or shard_renderer:
+            # Формируем имя файла в формате: <Название исходного файла>_<Имя листа эксель>_<метка времени>
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        
+            if original_file_name and sheet_name:
+                # Получаем имя файла без расширения
+                base_name = os.path.splitext(os.path.basename(original_file_name))[0]
+                output_filename = f"{base_name}_{sheet_name}_{timestamp}.pdf"
             else:
-                # Для небольшого количества колонок сохраняем прежнюю логику
-                if total_height < available_height and fits_in_one_line:
-                    best_font_size = test_font_size
-                    final_lines_to_render = all_processed_lines
-                    break
-
-        # Если не удалось найти размер шрифта, при котором текст помещается на странице,
-        # выбираем наименьший размер шрифта из диапазона
-        if best_font_size == 0:
-            # Используем минимальный размер шрифта из диапазона
-            best_font_size = font_size_range[-1]
-            pdf.set_font_size(best_font_size)
-            # Process with the smallest font size
-            all_processed_lines_fallback = []
-            for line in text_lines:
-                # Обрабатываем заголовок и значение отдельно
-                safe_header = _force_wrap_text(pdf, line['header'], max_header_width)
-                safe_value = _force_wrap_text(pdf, line['value'], value_width)
-                
-                # Добавляем обработанные строки как словарь
-                all_processed_lines_fallback.append({'header': safe_header, 'value': safe_value})
-            final_lines_to_render = all_processed_lines_fallback
-            
-            # Optional: check height again for warning
-            total_height_fallback = 0
-            for item in final_lines_to_render:
-                # Считаем высоту для заголовка с переносом только по пробелам
-                pdf.set_font(font_family, 'B')
-                header_lines = _count_header_lines(pdf, item['header'], max_header_width)
-                
-                # Считаем высоту для значения
-                pdf.set_font(font_family, '')
-                # Для значений разрешаем перенос по словам
-                value_lines = len(pdf.multi_cell(w=value_width, txt=item['value'], split_only=True))
-                
-                # Берем максимальное количество строк (заголовок или значение)
-                max_lines = max(header_lines, value_lines)
-                
-                # Суммируем высоту (используем максимальное количество строк, так как они будут отображаться рядом)
-                total_height_fallback += max_lines * pdf.font_size + 2  # +2 для отступа между строками таблицы
-            if total_height_fallback > available_height:
-                logger.warning(f"Текст для артикула {article} не помещается по высоте даже с минимальным шрифтом ({font_size_range[-1]}). Возможны искажения или обрезание текста.")
-            # Предупреждение о переполнении текста больше не нужно, так как заголовки теперь могут переноситься
-
-        pdf.set_font_size(best_font_size)
-
-        # Добавляем каждую строку текста в PDF в формате двухколоночной таблицы
-        # Отслеживаем позицию для определения необходимости новой страницы
-        page_items_count = 0
-        for item in final_lines_to_render:
-            # Проверяем, не достигли ли мы нижней границы страницы
-            # Используем то же ограничение, что и при расчете available_height
-            if pdf.get_y() > (pdf.h - PDF_MARGIN_BOTTOM - safety_margin):  # Оставляем отступ от нижнего края с учетом safety_margin
-                # Добавляем красные стрелки, указывающие на продолжение на следующей странице
-                current_y = pdf.get_y()
-                # Сохраняем текущие настройки шрифта
-                current_font_size = pdf.font_size
-                current_font_style = pdf.font_style
-                
-
-
-                pdf.set_text_color(255, 0, 0)  # Устанавливаем красный цвет
-                pdf.set_font(font_family, 'B', 14)  # Жирный шрифт для стрелок
-                pdf.set_xy(10, current_y - 5)  # Позиционируем стрелки ниже последнего элемента
-                pdf.cell(70, 10, txt="Продовження на наст. сторінці", align='C')
-
-                
-                # Восстанавливаем настройки шрифта и цвета
-                pdf.set_text_color(0, 0, 0)  # Возвращаем черный цвет
-                pdf.set_font(font_family, current_font_style, current_font_size)
-                
-                pdf.add_page()  # Добавляем новую страницу
-                pdf.set_y(10)  # Устанавливаем позицию Y в начало новой страницы
-                page_items_count = 0  # Сбрасываем счетчик элементов на странице
-            
-            # Сохраняем текущую позицию X и Y
-            x_pos = pdf.get_x()
-            y_pos = pdf.get_y()
-            
-            # Устанавливаем жирный шрифт для заголовка (левая колонка)
-            pdf.set_font_size(best_font_size)
-            pdf.set_font(font_family, 'B')  # B - жирный шрифт
+                # Если не переданы имя файла или имя листа, используем стандартное имя
+                output_filename = f"product_cards_{timestamp}.pdf"
             
-            # Отрисовываем заголовок (левая колонка) с возможностью переноса строк
-            pdf.set_xy(x_pos, y_pos)
-            pdf.set_font(font_family, 'B')
-            header_text = item['header']
-            
-            # Используем функцию _split_header_text для разбиения заголовка на строки с переносом только по пробелам
-            header_lines = _split_header_text(pdf, header_text, max_header_width)
-            
-            # Отрисовываем заголовок с переносом только по пробелам
-            pdf.set_xy(x_pos, y_pos)
-            for i, line in enumerate(header_lines):
-                pdf.set_xy(x_pos, y_pos + i * pdf.font_size)
-                pdf.cell(w=max_header_width, h=pdf.font_size, txt=line, align='L')
-            
-            # Для значения разрешаем перенос по словам
-            pdf.set_font(font_family, '')
-            value_text = item['value']
-            
-            # Получаем текущую позицию Y после отрисовки заголовка
-            current_y = pdf.get_y()
-            
-            # Отрисовываем значение (правая колонка) с переносом по словам
-            pdf.set_xy(x_pos + max_header_width + column_spacing, y_pos)  # Используем переменную column_spacing для отступа
-            
-            # Используем multi_cell для значения, чтобы разрешить перенос по словам
-            value_lines = pdf.multi_cell(w=value_width, h=pdf.font_size, txt=value_text, align='L', split_only=True)
-            
-            # Если значение помещается в одну строку, используем cell для лучшего выравнивания
-            if len(value_lines) == 1:
-                pdf.set_xy(x_pos + max_header_width + column_spacing, y_pos)
-                pdf.cell(w=value_width, h=pdf.font_size, txt=value_text, align='L')
+            output_path = os.path.join(output_folder, output_filename)
+            if shard_renderer:
+                shard_renderer.finish()
+                logger.info(f"Параллельный вывод карточек: {shard_renderer.format_stats()}")
+            elif stream_writer:
+                stream_writer.append_pdf(pdf.output())
+            if stream_writer:
+                stream_writer.close()
+                os.replace(stream_writer.path, output_path)
+                stream_completed = True
+                logger.info(f"Потоковая запись PDF: {stream_writer.format_stats()}")
             else:
-                # Если значение не помещается в одну строку, используем multi_cell
-                pdf.set_xy(x_pos + max_header_width + column_spacing, y_pos)
-                pdf.multi_cell(w=value_width, h=pdf.font_size, txt=value_text, align='L')
-            
-            # Определяем, какой элемент (заголовок или значение) занимает больше строк
-            header_height = len(header_lines) * pdf.font_size
-            value_height = len(value_lines) * pdf.font_size
-            
-            # Устанавливаем позицию Y для следующей строки на максимальную из двух высот
-            next_y = y_pos + max(header_height, value_height) + 2  # +2 для отступа между строками
-            pdf.set_y(next_y)
-            
-            # Увеличиваем счетчик элементов на странице
-            page_items_count += 1
-            
-        inserted_cards += 1
-
-    if inserted_cards == 0:
-        return "", 0, not_found_articles
-
-    # Проверяем, есть ли страницы в PDF
-    if pdf.page > 0:
-        # Формируем имя файла в формате: <Название исходного файла>_<Имя листа эксель>_<метка времени>
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        if original_file_name and sheet_name:
-            # Получаем имя файла без расширения
-            base_name = os.path.splitext(os.path.basename(original_file_name))[0]
-            output_filename = f"{base_name}_{sheet_name}_{timestamp}.pdf"
+                pdf.output(output_path)
+            if budget_plan:
+                logger.info(f"Размер PDF: {budget_plan.format_report(os.path.getsize(output_path))}, "
+                            f"лимит {max_total_file_size_mb} МБ")
         else:
-            # Если не переданы имя файла или имя листа, используем стандартное имя
-            output_filename = f"product_cards_{timestamp}.pdf"
-            
-        output_path = os.path.join(output_folder, output_filename)
-        pdf.output(output_path)
-    else:
-        return "", 0, not_found_articles
+            return "", 0, not_found_articles
     
-    return output_path, inserted_cards, not_found_articles
\ No newline at end of file
+        return output_path, inserted_cards, not_found_articles
+    finally:
+        if shard_renderer:
+            shard_renderer.close()
+        if row_images is not None:
+            row_images.close()
+        if rendition_store:
+            rendition_store.close()
+        if stream_writer and not stream_completed:
+            stream_writer.abort()
\ No newline at end of file
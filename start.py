@@ -117,9 +117,70 @@ def start_web_app():
         print(f"Ошибка при запуске веб-интерфейса: {e}")
         input("Нажмите Enter для продолжения...")
 
+# Функция для работы со снимком индекса изображений
+def run_index_snapshot_command(export_path=None, import_path=None):
+    """
+    Сохраняет или загружает снимок индекса изображений для папок из настроек.
+    Снимок, сохраненный на одной рабочей станции, позволяет остальным не обходить сетевые папки.
+    
+    Args:
+        export_path: Путь, по которому нужно сохранить снимок
+        import_path: Путь к снимку, который нужно загрузить в локальный каталог
+    """
+    from utils import config_manager, image_catalog, index_snapshot
+    
+    config_manager.init_config_manager(os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings_presets"))
+    catalog = image_catalog.get_image_catalog()
+    
+    if import_path:
+        stats = index_snapshot.import_snapshot(import_path, catalog)
+        print(f"Снимок загружен: импортировано папок {len(stats['imported'])}, файлов {stats['files']}, "
+              f"пропущено как устаревшие {len(stats['skipped'])}")
+    if export_path:
+        header = index_snapshot.export_snapshot(export_path, catalog)
+        print(f"Снимок сохранен в {export_path}: папок {len(header['roots'])}, "
+              f"файлов {sum(entry['files'] for entry in header['roots'])}")
+
+# Функция для расчета копий изображений
+def run_precompute_images_command(workers=None):
+    """
+    Рассчитывает уменьшенные копии всех изображений товаров и упаковок из настроек.
+    Повторный запуск пересчитывает только новые и измененные изображения.
+    
+    Args:
+        workers: Количество процессов (None - из настроек)
+    """
+    from utils import config_manager, renditions
+    
+    config_manager.init_config_manager(os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings_presets"))
+    try:
+        stats = renditions.precompute_renditions(workers=workers)
+    except KeyboardInterrupt:
+        print("Расчет прерван. Рассчитанные копии сохранены, повторный запуск продолжит работу")
+        return
+    print(f"Копии изображений: файлов {stats['total']}, рассчитано {stats['rendered']}, "
+          f"актуальных {stats['skipped']}, ошибок {stats['failed']}, время {stats['time_sec']:.1f} сек")
+
 def main():
     """Главная функция запуска"""
+    parser = argparse.ArgumentParser(description="Запуск ExcelToPDF")
+    parser.add_argument("--export-index-snapshot", metavar="ПУТЬ",
+                        help="Обойти папки изображений из настроек и сохранить снимок индекса")
+    parser.add_argument("--import-index-snapshot", metavar="ПУТЬ",
+                        help="Загрузить снимок индекса изображений в локальный каталог")
+    parser.add_argument("--precompute-images", action="store_true",
+                        help="Рассчитать копии изображений для карточек PDF по папкам из настроек")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="Количество процессов для --precompute-images")
+    args = parser.parse_args()
+    
     ensure_project_structure()
+    if args.export_index_snapshot or args.import_index_snapshot:
+        run_index_snapshot_command(args.export_index_snapshot, args.import_index_snapshot)
+        return
+    if args.precompute_images:
+        run_precompute_images_command(args.workers)
+        return
     start_web_app()
 
 if __name__ == "__main__":
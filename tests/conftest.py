@@ -0,0 +1,26 @@
+"""
+Общие настройки тестов: корень проекта в sys.path и шрифты TTF для проверок с подмножествами шрифтов
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Пары файлов TTF (обычный, жирный): шрифт приложения в Windows и DejaVu в Linux
+TTF_CANDIDATES = [
+    ("C:/Windows/Fonts/arial.ttf", "C:/Windows/Fonts/arialbd.ttf"),
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/TTF/DejaVuSans.ttf", "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf"),
+    ("/Library/Fonts/Arial.ttf", "/Library/Fonts/Arial Bold.ttf"),
+]
+
+
+@pytest.fixture
+def ttf_font_files():
+    """Файлы TTF по начертаниям ('' и 'B'); тест пропускается, если шрифтов нет"""
+    for regular, bold in TTF_CANDIDATES:
+        if os.path.isfile(regular) and os.path.isfile(bold):
+            return {'': regular, 'B': bold}
+    pytest.skip("Не найдены шрифты TTF")
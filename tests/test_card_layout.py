@@ -0,0 +1,115 @@
+"""
+Регрессионные тесты разметки карточек: размер шрифта, подобранный делением диапазона пополам,
+и количество строк значений совпадают с перебором размеров сверху вниз и переносом самого FPDF
+(multi_cell(dry_run=True, output="LINES")) на случайных текстах
+"""
+import random
+
+import pytest
+
+from utils import card_layout
+from utils import font_metrics
+
+CORE_FONT_FAMILY = "Helvetica"
+TTF_FONT_FAMILY = "CardFont"
+
+ASCII_WORDS = ("Item colour material size package barcode long name Made in Ukraine cotton 100% "
+               "polyester 4820000123456789 WWWWWWWWWWWWWWWWWWWWWWWW iiiiiiiiiiiiiiii x 1,5 kg").split()
+CYRILLIC_WORDS = "Найменування товару Колір Матеріал Розмір упаковка Виробник Україна Артикул".split()
+
+
+@pytest.fixture(params=["core", "ttf"])
+def engine(request):
+    if request.param == "core":
+        return card_layout.CardLayoutEngine(card_layout.CARD_PAGE_GEOMETRY, CORE_FONT_FAMILY, {})
+    font_files = request.getfixturevalue("ttf_font_files")
+    return card_layout.CardLayoutEngine(card_layout.CARD_PAGE_GEOMETRY, TTF_FONT_FAMILY, font_files)
+
+
+def random_text(rng, words, max_words):
+    text = " ".join(rng.choice(words) for _ in range(rng.randint(0, max_words)))
+    if text and rng.random() < 0.1:
+        position = rng.randrange(len(text))
+        text = text[:position] + "\n" + text[position:]
+    return text
+
+
+def random_card(rng, words):
+    columns = rng.randint(1, card_layout.MANY_COLUMNS + 3)
+    headers = [random_text(rng, words, 4) or "Header" for _ in range(columns)]
+    return [{"header": header, "value": random_text(rng, words, rng.choice((1, 2, 3, 5, 10, 40)))} for header in headers]
+
+
+def card_words(engine):
+    return ASCII_WORDS + CYRILLIC_WORDS if engine.font_files else ASCII_WORDS
+
+
+def reference_layout(engine, text_lines):
+    """
+    Перебор размеров шрифта сверху вниз с переносом строк значений самим FPDF (как до деления пополам).
+
+    Returns:
+        Tuple[int, bool, float]: Размер шрифта, признак того, что текст поместился, и высота текста
+    """
+    pdf = engine.pdf
+    family = engine.font_family
+    geometry = engine.geometry
+    headers = tuple(item['header'] for item in text_lines)
+    max_header_width, _, value_width = engine.column_geometry(headers)
+    sizes = list(engine._font_size_range(len(text_lines)))
+    available_height = geometry.text_bottom - geometry.text_top
+    require_one_line = len(text_lines) <= card_layout.MANY_COLUMNS
+
+    heights = {}
+    for size in sizes:
+        processed = []
+        fits_in_one_line = True
+        for index, item in enumerate(text_lines):
+            pdf.set_font(family, 'B' if index == 0 and size == sizes[0] else '', size)
+            header = card_layout._force_wrap_text(pdf, item['header'], max_header_width)
+            value = card_layout._force_wrap_text(pdf, item['value'], value_width)
+            pdf.set_font(family, '')
+            if pdf.get_string_width(value) > value_width:
+                fits_in_one_line = False
+            processed.append((header, value))
+        total_height = 0
+        for header, value in processed:
+            pdf.set_font(family, 'B')
+            header_lines = len(card_layout._split_header_text(pdf, header, max_header_width))
+            pdf.set_font(family, '')
+            value_lines = len(pdf.multi_cell(w=value_width, text=value, dry_run=True, output="LINES"))
+            total_height += max(header_lines, value_lines) * pdf.font_size + 2
+        heights[size] = total_height
+        if total_height < available_height and (fits_in_one_line or not require_one_line):
+            return size, True, total_height
+    return sizes[-1], False, heights[sizes[-1]]
+
+
+def test_layout_card_matches_linear_scan_and_multi_cell(engine):
+    rng = random.Random(21)
+    words = card_words(engine)
+    for card in range(80):
+        text_lines = random_card(rng, words)
+        layout = engine.layout_card(text_lines, article=f"art{card}")
+        font_size, fitted, text_height = reference_layout(engine, text_lines)
+
+        assert (layout.font_size, layout.fitted) == (font_size, fitted), text_lines
+        assert layout.text_height == pytest.approx(text_height)
+        pdf = engine.pdf
+        pdf.set_font(engine.font_family, '', layout.font_size)
+        for row in layout.rows:
+            expected = len(pdf.multi_cell(w=layout.value_width, text=row.value, dry_run=True, output="LINES"))
+            assert row.value_lines == expected, row.value
+
+
+def test_count_lines_matches_multi_cell(engine):
+    rng = random.Random(1021)
+    words = card_words(engine)
+    metrics = font_metrics.get_font_metrics()
+    pdf = engine.pdf
+    for _ in range(300):
+        pdf.set_font(engine.font_family, rng.choice(('', 'B')), rng.randint(6, 14))
+        text = random_text(rng, words, 40)
+        width = rng.uniform(15, 80)
+        expected = len(pdf.multi_cell(w=width, text=text, dry_run=True, output="LINES"))
+        assert metrics.count_lines(pdf, text, width) == expected, (text, width)
@@ -0,0 +1,124 @@
+"""
+Тесты потоковой записи PDF: несколько документов FPDF.output() дописываются в один файл, результат
+разбирается заново и проверяется порядок страниц, общие шрифты и изображения и таблица xref
+"""
+import io
+import re
+import zlib
+
+import pytest
+from PIL import Image
+
+from utils import card_layout
+from utils import card_shards
+from utils import pdf_stream
+
+PARTS = 3
+PAGES_PER_PART = 4
+# Номер страницы выводится встроенным шрифтом, чтобы его можно было прочитать в потоке содержимого
+MARKER_FONT = "Courier"
+TEXTS = ["Item colour material", "Найменування товару", "Колір Матеріал Розмір", "Made in Ukraine"]
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.effect_noise((64, 48), 64).convert("RGB").save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def make_part(part, font_family, font_files, image, texts):
+    pdf = card_layout.create_card_pdf(card_layout.CARD_PAGE_GEOMETRY, font_family, font_files)
+    card_shards.prepick_charset(pdf, font_family, font_files, card_shards.collect_charset(texts))
+    for page in range(PAGES_PER_PART):
+        pdf.add_page()
+        pdf.image(io.BytesIO(image), x=3, y=3, w=40)
+        pdf.set_font(font_family, 'B', 12)
+        pdf.cell(text=texts[(part + page) % len(texts)])
+        pdf.set_font(font_family, '', 10)
+        pdf.ln()
+        pdf.cell(text=texts[page % len(texts)])
+        pdf.set_font(MARKER_FONT, '', 8)
+        pdf.ln()
+        pdf.cell(text=f"PAGE-{part * PAGES_PER_PART + page:03d}")
+    return bytes(pdf.output())
+
+
+def objects_of_type(objects, name):
+    pattern = re.compile(rb"/Type\s*/" + name + rb"\b")
+    return [number for number, obj in objects.items() if pattern.search(obj.head)]
+
+
+def check_xref(data, objects, trailer):
+    """Таблица xref без пропусков, смещения указывают на объекты, /Size и startxref согласованы"""
+    startxref = int(re.findall(rb"startxref\s+(\d+)", data)[-1])
+    assert data.startswith(b"xref", startxref)
+    assert data.rstrip().endswith(b"%%EOF")
+    size = int(re.search(rb"/Size\s+(\d+)", trailer).group(1))
+    assert sorted(objects) == list(range(1, size))
+    assert re.search(rb"/ID\s*\[<[0-9A-F]{32}><[0-9A-F]{32}>\]", trailer)
+
+
+def page_markers(objects, kids):
+    markers = []
+    for page in kids:
+        contents = int(re.search(rb"/Contents\s+(\d+)\s+0\s+R", objects[page].head).group(1))
+        content = objects[contents]
+        stream = bytes(content.stream)
+        if b"/FlateDecode" in content.head:
+            stream = zlib.decompress(stream)
+        markers.extend(re.findall(rb"\(PAGE-(\d+)\)", stream))
+    return [int(marker) for marker in markers]
+
+
+@pytest.fixture(params=["core", "ttf"])
+def font(request):
+    if request.param == "core":
+        return "Helvetica", {}, [text for text in TEXTS if text.isascii()]
+    return "CardFont", request.getfixturevalue("ttf_font_files"), TEXTS
+
+
+def test_streamed_parts_form_one_document(tmp_path, font):
+    font_family, font_files, texts = font
+    image = make_image()
+    parts = [make_part(part, font_family, font_files, image, texts) for part in range(PARTS)]
+
+    path = str(tmp_path / "cards.pdf")
+    writer = pdf_stream.StreamingPdfWriter(path)
+    for data in parts:
+        assert writer.append_pdf(data) == PAGES_PER_PART
+    writer.close()
+
+    with open(path, "rb") as f:
+        data = f.read()
+    objects, trailer, _ = pdf_stream.parse_pdf(data)
+    check_xref(data, objects, trailer)
+
+    # Каталог ссылается на общее дерево страниц, страницы идут в порядке частей
+    root = int(re.search(rb"/Root\s+(\d+)\s+0\s+R", trailer).group(1))
+    assert objects[root].dict_ref(b"Pages") == pdf_stream.PAGES_OBJECT
+    pages_root = objects[pdf_stream.PAGES_OBJECT].head
+    assert int(re.search(rb"/Count\s+(\d+)", pages_root).group(1)) == PARTS * PAGES_PER_PART
+    kids = [int(kid) for kid in re.findall(rb"(\d+)\s+0\s+R", re.search(rb"/Kids\s*\[([^\]]*)\]", pages_root).group(1))]
+    assert len(kids) == PARTS * PAGES_PER_PART
+    assert all(objects[kid].type() == b"Page" for kid in kids)
+    assert all(objects[kid].dict_ref(b"Parent") == pdf_stream.PAGES_OBJECT for kid in kids)
+    assert page_markers(objects, kids) == list(range(PARTS * PAGES_PER_PART))
+
+    # Шрифты и изображение записаны один раз, как в одной части
+    part_objects, _, _ = pdf_stream.parse_pdf(parts[0])
+    assert len(objects_of_type(objects, b"Font")) == len(objects_of_type(part_objects, b"Font"))
+    assert len(objects_of_type(objects, b"FontDescriptor")) == len(objects_of_type(part_objects, b"FontDescriptor"))
+    images = [number for number, obj in objects.items() if re.search(rb"/Subtype\s*/Image\b", obj.head)]
+    assert len(images) == 1
+    if font_files:
+        # Подмножества TTF (обычный и жирный) с одинаковым набором символов в каждой части
+        assert len(objects_of_type(objects, b"FontDescriptor")) == len(font_files)
+    assert writer.stats["shared_objects"] > 0
+
+
+def test_abort_removes_partial_file(tmp_path):
+    path = tmp_path / "cards.pdf.part"
+    writer = pdf_stream.StreamingPdfWriter(str(path))
+    writer.append_pdf(make_part(0, "Helvetica", {}, make_image(), ["Item"]))
+    writer.abort()
+    assert not path.exists()
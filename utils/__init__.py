@@ -3,4 +3,19 @@
 """
 # Используем относительные импорты
 from . import config_manager
-from . import image_utils 
\ No newline at end of file
+from . import image_utils 
+from . import image_index
+from . import image_catalog
+from . import image_watcher
+from . import tree_scanner
+from . import lookup_cache
+from . import index_snapshot
+from . import fuzzy_index
+from . import image_cache
+from . import image_pipeline
+from . import budget_planner
+from . import renditions
+from . import font_metrics
+from . import card_layout
+from . import pdf_stream
+from . import card_shards
\ No newline at end of file
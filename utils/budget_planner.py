@@ -0,0 +1,285 @@
+"""
+Планирование размера PDF: распределение общего лимита размера файла между изображениями
+"""
+import json
+import math
+import heapq
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+from . import image_utils
+from . import image_cache
+from . import image_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Качества, при которых измеряется размер каждого изображения (полностью кодируется только среднее,
+# см. ImageOptimizer.measure). Между ними логарифм размера интерполируется линейно (см. _predict_sizes)
+MEASURE_QUALITIES = (20, 60, 95)
+
+# Уровни качества, между которыми выбирает распределитель
+QUALITY_LEVELS = (1, 10, 20, 30, 40, 50, 60, 70, 75, 80, 85, 90, 95, 100)
+
+# Оценка размера PDF без изображений: подмножества шрифтов Arial и служебные структуры
+# плюс сжатый текст каждой карточки (около 0.5 КБ на карточку, с запасом)
+PDF_FIXED_OVERHEAD_BYTES = 64 * 1024
+PDF_PAGE_OVERHEAD_BYTES = 1024
+
+# Запас на погрешность предсказания размеров
+BUDGET_SAFETY_FACTOR = 0.97
+
+# Версия формата кривых размера в дисковом кэше
+_CURVE_CACHE_VERSION = 2
+
+
+@dataclass
+class BudgetPlan:
+    """
+    Результат планирования: целевой размер каждого изображения и прогноз размера PDF.
+    """
+    targets_kb: Dict[str, float] = field(default_factory=dict)  # Путь -> целевой размер в КБ
+    qualities: Dict[str, int] = field(default_factory=dict)     # Путь -> выбранное качество (0 - исходный JPEG или PNG с палитрой)
+    image_budget_bytes: int = 0
+    predicted_image_bytes: int = 0
+    predicted_total_bytes: int = 0
+    failed: List[str] = field(default_factory=list)             # Изображения, которые не удалось измерить
+
+    def format_report(self, actual_total_bytes: Optional[int] = None) -> str:
+        """
+        Возвращает прогноз размера PDF (и фактический размер, если он известен) в виде строки для лога.
+        """
+        report = (f"изображений {len(self.targets_kb)}, бюджет изображений {self.image_budget_bytes / 1024 / 1024:.2f} МБ, "
+                  f"прогноз изображений {self.predicted_image_bytes / 1024 / 1024:.2f} МБ, "
+                  f"прогноз PDF {self.predicted_total_bytes / 1024 / 1024:.2f} МБ")
+        if actual_total_bytes is not None:
+            deviation = ((actual_total_bytes - self.predicted_total_bytes) / self.predicted_total_bytes * 100
+                         if self.predicted_total_bytes else 0.0)
+            report += f", фактически {actual_total_bytes / 1024 / 1024:.2f} МБ ({deviation:+.1f}%)"
+        return report
+
+
+def estimate_pdf_overhead(pages: int) -> int:
+    """
+    Оценивает размер PDF без изображений для заданного количества карточек.
+    """
+    return PDF_FIXED_OVERHEAD_BYTES + PDF_PAGE_OVERHEAD_BYTES * max(0, pages)
+
+
+def _predict_sizes(measured: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Предсказывает размер для каждого уровня QUALITY_LEVELS по измеренным точкам: логарифм размера
+    интерполируется линейно между соседними точками и продолжается за крайние точки по крайним отрезкам.
+    Размер не убывает с ростом качества.
+    """
+    points = sorted((q, math.log(max(1, size))) for q, size in measured)
+    if len(points) == 1:
+        return [(q, int(math.exp(points[0][1]))) for q in QUALITY_LEVELS]
+
+    predicted = []
+    largest = 0
+    for quality in QUALITY_LEVELS:
+        segment = 0
+        while segment < len(points) - 2 and quality > points[segment + 1][0]:
+            segment += 1
+        (q1, log1), (q2, log2) = points[segment], points[segment + 1]
+        log_size = log1 + (log2 - log1) * (quality - q1) / (q2 - q1) if q2 != q1 else log1
+        largest = max(largest, int(math.exp(log_size)))
+        predicted.append((quality, largest))
+    return predicted
+
+
+def _measure_job(image_path: str, max_width: Optional[int], max_height: Optional[int],
+                 optimizer: image_utils.ImageOptimizer) -> Optional[Dict[str, Any]]:
+    """
+    Задание для процесса пула: измеряет кривую размера одного изображения.
+    """
+    try:
+        return optimizer.measure(image_path, MEASURE_QUALITIES, max_width, max_height)
+    except Exception as e:
+        logger.warning(f"Не удалось измерить изображение {image_path}: {e}")
+        return None
+
+
+def _curve_key(cache: image_cache.ImageCache, image_path: str, max_width: Optional[int],
+               max_height: Optional[int], optimizer: image_utils.ImageOptimizer) -> Optional[str]:
+    return cache.make_key(image_path, dict(optimizer.get_settings(), kind="size_curve",
+                                           curve_version=_CURVE_CACHE_VERSION,
+                                           qualities=list(MEASURE_QUALITIES),
+                                           max_width=max_width, max_height=max_height))
+
+
+def measure_images(image_paths: Iterable[str], max_width: Optional[int] = None,
+                   max_height: Optional[int] = None,
+                   optimizer: Optional[image_utils.ImageOptimizer] = None,
+                   cache: Optional[image_cache.ImageCache] = None,
+                   workers: Optional[int] = None) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Измеряет кривые размера изображений (см. ImageOptimizer.measure) в пуле процессов.
+    Измерения сохраняются в дисковый кэш и при следующих запусках не повторяются.
+
+    Args:
+        image_paths (Iterable[str]): Пути к изображениям
+        max_width (Optional[int]): Максимальная ширина в пикселях
+        max_height (Optional[int]): Максимальная высота в пикселях
+        optimizer (Optional[ImageOptimizer]): Оптимизатор запуска (настройки подготовки изображений)
+        cache (Optional[ImageCache]): Дисковый кэш
+        workers (Optional[int]): Количество процессов. None - из настроек конвейера изображений
+
+    Returns:
+        Dict[str, Optional[Dict[str, Any]]]: Путь -> измерения или None, если изображение не удалось прочитать
+    """
+    optimizer = optimizer or image_utils.ImageOptimizer()
+    results: Dict[str, Optional[Dict[str, Any]]] = {}
+    keys: Dict[str, str] = {}
+    pending = []
+    for image_path in dict.fromkeys(image_paths):
+        key = _curve_key(cache, image_path, max_width, max_height, optimizer) if cache is not None else None
+        data = cache.get(key) if key is not None else None
+        if data is not None:
+            try:
+                results[image_path] = json.loads(data.decode('utf-8'))
+                continue
+            except ValueError:
+                pass
+        if key is not None:
+            keys[image_path] = key
+        pending.append(image_path)
+
+    workers = workers if workers is not None else image_pipeline.get_configured_workers()
+    measured = None
+    if workers > 1 and len(pending) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+                measured = list(executor.map(_measure_job, pending, [max_width] * len(pending),
+                                             [max_height] * len(pending), [optimizer] * len(pending),
+                                             chunksize=max(1, len(pending) // (workers * 4))))
+        except (OSError, NotImplementedError, ValueError) as e:
+            logger.warning(f"Не удалось запустить пул процессов для измерения изображений: {e}")
+    if measured is None:
+        measured = [_measure_job(image_path, max_width, max_height, optimizer) for image_path in pending]
+
+    for image_path, measurement in zip(pending, measured):
+        results[image_path] = measurement
+        if measurement is not None and image_path in keys:
+            cache.put(keys[image_path], json.dumps(measurement).encode('utf-8'))
+    return results
+
+
+def allocate_budget(curves: Dict[str, List[Tuple[int, int]]], budget_bytes: float) -> Dict[str, int]:
+    """
+    Распределяет бюджет между изображениями жадным алгоритмом по предельной полезности.
+
+    Все изображения начинают с нижнего уровня. Затем каждый шаг повышает уровень изображения
+    с наибольшим приростом полезности на байт, пока повышение укладывается в бюджет. Полезность
+    уровня - логарифм качества, поэтому легкие изображения быстро получают полное качество,
+    а сокращение приходится на тяжелые, у которых каждый шаг качества стоит дорого.
+
+    Args:
+        curves (Dict[str, List[Tuple[int, int]]]): Путь -> уровни (качество, размер в байтах)
+            по возрастанию качества. Качество 0 - исходный JPEG без перекодирования или PNG с палитрой
+        budget_bytes (float): Бюджет в байтах
+
+    Returns:
+        Dict[str, int]: Путь -> номер выбранного уровня
+    """
+    def utility(quality: int) -> float:
+        return math.log(1 + (image_utils.MAX_JPEG_QUALITY if quality == 0 else quality))
+
+    chosen = {path: 0 for path in curves}
+    spent = sum(levels[0][1] for levels in curves.values())
+
+    def push_next(heap: list, path: str) -> None:
+        levels = curves[path]
+        current = chosen[path]
+        # Следующий уровень с ростом полезности; уровни без роста размера берутся сразу
+        for next_level in range(current + 1, len(levels)):
+            extra_bytes = levels[next_level][1] - levels[current][1]
+            extra_utility = utility(levels[next_level][0]) - utility(levels[current][0])
+            if extra_utility <= 0:
+                continue
+            ratio = extra_utility / extra_bytes if extra_bytes > 0 else math.inf
+            heapq.heappush(heap, (-ratio, path, next_level, extra_bytes))
+            return
+
+    heap = []
+    for path in curves:
+        push_next(heap, path)
+    while heap:
+        _, path, next_level, extra_bytes = heapq.heappop(heap)
+        if spent + extra_bytes > budget_bytes:
+            continue  # Повышение этого изображения не помещается; другие могут поместиться
+        chosen[path] = next_level
+        spent += extra_bytes
+        push_next(heap, path)
+    return chosen
+
+
+def plan_image_budget(image_paths: Iterable[str], max_total_file_size_mb: float, pages: int,
+                      max_width: Optional[int] = None, max_height: Optional[int] = None,
+                      max_kb_per_image: Optional[float] = None,
+                      optimizer: Optional[image_utils.ImageOptimizer] = None,
+                      cache: Optional[image_cache.ImageCache] = None,
+                      workers: Optional[int] = None) -> BudgetPlan:
+    """
+    Планирует целевые размеры изображений так, чтобы PDF получился близким к лимиту, но не больше него.
+
+    Одинаковые пути учитываются один раз: FPDF встраивает одинаковые изображения один раз.
+    Бюджет изображений - лимит файла за вычетом оценки размера остального PDF (estimate_pdf_overhead)
+    с запасом BUDGET_SAFETY_FACTOR на погрешность прогноза. Целевой размер изображения - прогноз
+    размера на выбранном уровне; ImageOptimizer затем подбирает наибольшее качество, укладывающееся
+    в него.
+
+    Args:
+        image_paths (Iterable[str]): Пути к изображениям всех карточек
+        max_total_file_size_mb (float): Лимит размера PDF в МБ
+        pages (int): Количество карточек
+        max_width (Optional[int]): Максимальная ширина изображений в пикселях
+        max_height (Optional[int]): Максимальная высота изображений в пикселях
+        max_kb_per_image (Optional[float]): Верхний предел целевого размера одного изображения
+        optimizer (Optional[ImageOptimizer]): Оптимизатор запуска
+        cache (Optional[ImageCache]): Дисковый кэш для измерений
+        workers (Optional[int]): Количество процессов для измерений
+
+    Returns:
+        BudgetPlan: План
+    """
+    measurements = measure_images(image_paths, max_width, max_height, optimizer, cache, workers)
+    plan = BudgetPlan()
+    overhead = estimate_pdf_overhead(pages)
+    plan.image_budget_bytes = int(max(0, max_total_file_size_mb * 1024 * 1024 - overhead) * BUDGET_SAFETY_FACTOR)
+
+    max_bytes = max_kb_per_image * 1024 if max_kb_per_image else math.inf
+    curves = {}
+    for image_path, measurement in measurements.items():
+        if measurement is None:
+            plan.failed.append(image_path)
+            continue
+        levels = [(q, size) for q, size in _predict_sizes(measurement["sizes"]) if size <= max_bytes]
+        if not levels:
+            levels = [(QUALITY_LEVELS[0], dict(measurement["sizes"]).get(QUALITY_LEVELS[0], 0) or
+                       min(size for _, size in measurement["sizes"]))]
+        # Исходный JPEG или PNG с палитрой для графики заменяет уровни, которые были бы больше него
+        fixed_bytes = measurement.get("passthrough_bytes") or measurement.get("lossless_bytes")
+        if fixed_bytes is not None and fixed_bytes <= max_bytes:
+            levels = [(q, size) for q, size in levels if size < fixed_bytes] + [(0, fixed_bytes)]
+        curves[image_path] = levels
+
+    chosen = allocate_budget(curves, plan.image_budget_bytes)
+    for image_path, level in chosen.items():
+        quality, size = curves[image_path][level]
+        plan.targets_kb[image_path] = size / 1024
+        plan.qualities[image_path] = quality
+        plan.predicted_image_bytes += size
+    plan.predicted_total_bytes = plan.predicted_image_bytes + overhead
+    return plan
+
+
+def is_planning_enabled() -> bool:
+    """
+    Проверяет настройку "image_settings.plan_budget": распределять ли лимит размера PDF между изображениями.
+    """
+    from . import config_manager
+
+    return bool(config_manager.get_setting_or_default("image_settings.plan_budget", True))
@@ -0,0 +1,621 @@
+"""
+Разметка PDF-карточек товаров: подбор размера шрифта, переносы строк и страницы продолжения
+рассчитываются без вывода в документ. План карточки (CardLayout) сериализуется, поэтому его можно
+рассчитать в другом процессе или сохранить, а документ FPDF только воспроизводит план
+"""
+import io
+import logging
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from fpdf import FPDF
+
+from . import font_metrics
+
+logger = logging.getLogger(__name__)
+
+# Колонки карточки, начиная с которых выбирается меньший диапазон размеров шрифта
+MANY_COLUMNS = 6
+
+# Диапазоны размеров шрифта (по убыванию) для обычных карточек и карточек с большим количеством колонок
+FONT_SIZE_RANGE = range(14, 7, -1)
+MANY_COLUMNS_FONT_SIZE_RANGE = range(10, 5, -1)
+
+# Размер жирного шрифта, по которому оцениваются ширина колонки заголовков и отступ между колонками
+HEADER_MEASURE_FONT_SIZE = 14
+
+# Доля доступной ширины, которую может занимать колонка заголовков
+MAX_HEADER_WIDTH_SHARE = 0.4
+
+# Отступ между строками таблицы в мм
+ROW_GAP = 2
+
+CONTINUATION_TEXT = "Продовження на наст. сторінці"
+
+
+@dataclass
+class PageGeometry:
+    """
+    Размеры страницы карточки и областей на ней в мм.
+    """
+    page_width: float
+    page_height: float
+    margin_left: float
+    margin_top: float
+    margin_right: float
+    margin_bottom: float
+    safety_margin: float            # Запас над нижним полем, после которого текст переносится на следующую страницу
+    image_area_height: float = 40   # Примерная высота изображений
+    image_gap: float = 2            # Отступ между изображениями и после них
+    continuation_top: float = 10    # Начало текста на странице продолжения
+
+    @property
+    def image_width(self) -> float:
+        """Ширина изображения: изображения товара и упаковки занимают по половине ширины страницы (около 40 мм)"""
+        return (self.page_width - self.margin_left - self.margin_right) / 2 - self.image_gap
+
+    @property
+    def text_top(self) -> float:
+        """Начало текста на первой странице карточки (под изображениями)"""
+        return self.margin_top + self.image_area_height + self.image_gap
+
+    @property
+    def text_bottom(self) -> float:
+        """Нижняя граница, после которой строки таблицы переносятся на страницу продолжения"""
+        return self.page_height - self.margin_bottom - self.safety_margin
+
+
+# Геометрия страницы карточки товара (create_pdf_cards) в мм
+CARD_PAGE_GEOMETRY = PageGeometry(
+    page_width=90,
+    page_height=160,
+    margin_left=3,  # Поля уменьшены для оптимизации
+    margin_top=3,
+    margin_right=3,
+    margin_bottom=3,
+    safety_margin=10  # Запас уменьшен с 56 = 4 * 14
+)
+
+
+@dataclass
+class ImageBox:
+    """
+    Место изображения на первой странице карточки. Высота известна, если известно соотношение
+    сторон изображения, иначе FPDF рассчитывает ее при вставке.
+    """
+    kind: str                       # "product" или "package"
+    source: str                     # Путь к исходному изображению
+    x: float
+    y: float
+    w: float
+    h: Optional[float] = None
+
+
+@dataclass
+class CardRow:
+    """
+    Строка таблицы карточки: заголовок, разбитый на строки, и значение.
+    """
+    header: str
+    header_lines: List[str]
+    value: str
+    value_lines: int                # Количество строк значения при переносе по словам
+    y: float                        # Верх строки на ее странице
+    bottom: float                   # Позиция следующей строки
+    page: int = 0                   # Номер страницы карточки (0 - первая)
+    continuation: bool = False      # Перед строкой начинается страница продолжения
+
+
+@dataclass
+class HeaderLayout:
+    """
+    Колонка заголовков при заданном размере шрифта. Зависит только от строки заголовков листа
+    и размера шрифта, поэтому рассчитывается один раз на запуск.
+    """
+    headers: List[str]              # Заголовки после замены слишком широких символов
+    lines: List[List[str]]          # Заголовки, разбитые на строки
+
+
+@dataclass
+class CardLayout:
+    """
+    План карточки: изображения, размер шрифта, геометрия колонок и строки таблицы по страницам.
+    """
+    article: str
+    font_size: int
+    fitted: bool                    # Текст поместился (иначе выбран наименьший размер шрифта)
+    text_height: float
+    text_x: float
+    header_width: float
+    column_spacing: float
+    value_width: float
+    text_top: float
+    images: List[ImageBox] = field(default_factory=list)
+    rows: List[CardRow] = field(default_factory=list)
+    pages: int = 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Возвращает план в виде словаря из простых типов (для JSON или передачи между процессами).
+        """
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CardLayout":
+        """
+        Восстанавливает план из словаря to_dict.
+        """
+        data = dict(data)
+        data["images"] = [ImageBox(**image) for image in data.get("images", [])]
+        data["rows"] = [CardRow(**row) for row in data.get("rows", [])]
+        return cls(**data)
+
+
+def _split_header_text(pdf: FPDF, header_text: str, max_width: float) -> List[str]:
+    """
+    Разбивает текст заголовка на строки с переносом только по пробелам.
+    Возвращает список строк.
+    """
+    metrics = font_metrics.get_font_metrics()
+    words = header_text.split(' ')
+    current_line = ''
+    current_units = 0
+    header_lines = []
+    # Ширины слов считаются один раз, ширина строки-кандидата складывается из них
+    space_units = metrics.text_units(pdf, ' ')
+    word_units = metrics.word_units(pdf, header_text)
+    
+    for index, word in enumerate(words):
+        test_line = current_line + (' ' if current_line else '') + word
+        if word_units is not None:
+            test_units = current_units + (space_units if current_line else 0) + word_units[index]
+            test_width = metrics.units_to_width(pdf, test_units)
+        else:
+            test_width = metrics.string_width(pdf, test_line)
+        if test_width <= max_width:
+            current_line = test_line
+            current_units = test_units if word_units is not None else 0
+        else:
+            if current_line:
+                header_lines.append(current_line)
+                current_line = word
+                current_units = word_units[index] if word_units is not None else 0
+            else:
+                # Если слово не помещается даже в пустую строку, добавляем его целиком
+                header_lines.append(word)
+                current_line = ''
+                current_units = 0
+    
+    if current_line:
+        header_lines.append(current_line)
+    
+    # Если текст пустой, возвращаем список с одной пустой строкой
+    return header_lines if header_lines else ['']
+
+
+def _count_header_lines(pdf: FPDF, header_text: str, max_width: float) -> int:
+    """
+    Подсчитывает количество строк для заголовка с переносом только по пробелам.
+    """
+    # Получаем список строк и возвращаем их количество
+    header_lines = _split_header_text(pdf, header_text, max_width)
+    return len(header_lines)
+
+
+def _force_wrap_text(pdf: FPDF, text: str, max_width: float) -> str:
+    """
+    A robust text processing function that prepares text for FPDF's multi_cell.
+    It ensures text fits within the cell width without breaking words across lines.
+    1. Replaces any single character that is too wide with '?'.
+    2. Keeps words intact for dynamic font sizing in create_pdf_cards.
+    """
+    metrics = font_metrics.get_font_metrics()
+    safe_words = []
+    # Replace non-breaking spaces and strip text as a precaution
+    text = text.replace('\u00A0', ' ').strip()
+
+    # Widths of all characters are measured at once; usually none of them is too wide
+    if not (metrics.char_widths(pdf, text) > max_width).any():
+        return " ".join(word for word in text.split(' ') if word)
+
+    for word in text.split(' '):
+        if not word:
+            continue
+        
+        # 1. Sanitize the word of any single character that is too wide
+        sanitized_word = ""
+        for char, char_width in zip(word, metrics.char_widths(pdf, word)):
+            if char_width > max_width:
+                logger.warning(f"A single character ('{char}') was wider than the cell and has been replaced by '?'.") 
+                sanitized_word += "?"
+            else:
+                sanitized_word += char
+        
+        # 2. Keep words intact for dynamic font sizing
+        safe_words.append(sanitized_word)
+            
+    return " ".join(safe_words)
+
+
+def _layout_card_text(pdf: FPDF, font_family: str, text_lines: List[Dict[str, str]], font_size: int,
+                      first_font_size: int, max_header_width: float, value_width: float,
+                      header_layout: Optional[HeaderLayout] = None) -> Tuple[List[Dict[str, str]], float, bool]:
+    """
+    Подготавливает строки таблицы карточки для заданного размера шрифта и считает их высоту.
+
+    Args:
+        pdf: Документ FPDF
+        font_family: Семейство шрифта
+        text_lines: Пары заголовок/значение
+        font_size: Проверяемый размер шрифта
+        first_font_size: Наибольший размер диапазона
+        max_header_width: Ширина колонки заголовков
+        value_width: Ширина колонки значений
+        header_layout: Готовая колонка заголовков для этого размера (None - рассчитать)
+
+    Returns:
+        Tuple[List[Dict[str, str]], float, bool]: Обработанные строки, общая высота и признак того,
+        что каждое значение помещается в одну строку
+    """
+    metrics = font_metrics.get_font_metrics()
+    processed_lines = []
+    total_height = 0
+    fits_in_one_line = True
+
+    for index, item in enumerate(text_lines):
+        # Первый элемент при наибольшем размере обрабатывается жирным шрифтом, который остается
+        # после оценки ширины заголовков, остальные - обычным
+        pdf.set_font(font_family, 'B' if index == 0 and font_size == first_font_size else '', font_size)
+        if header_layout is not None:
+            safe_header = header_layout.headers[index]
+        else:
+            safe_header = _force_wrap_text(pdf, item['header'], max_header_width)
+        safe_value = _force_wrap_text(pdf, item['value'], value_width)
+
+        # Проверяем, помещается ли значение в одну строку
+        # Для заголовков разрешаем перенос строк, поэтому не проверяем их
+        pdf.set_font(font_family, '')
+        if metrics.string_width(pdf, safe_value) > value_width:
+            fits_in_one_line = False
+        processed_lines.append({"header": safe_header, "value": safe_value})
+
+    for index, item in enumerate(processed_lines):
+        # Считаем высоту для заголовка с переносом только по пробелам
+        pdf.set_font(font_family, 'B')
+        if header_layout is not None:
+            header_lines = len(header_layout.lines[index])
+        else:
+            header_lines = _count_header_lines(pdf, item['header'], max_header_width)
+
+        # Считаем высоту для значения с переносом по словам
+        pdf.set_font(font_family, '')
+        value_lines = metrics.count_lines(pdf, item['value'], value_width)
+
+        # Заголовок и значение отображаются рядом, поэтому берем большее количество строк
+        total_height += max(header_lines, value_lines) * pdf.font_size + 2  # +2 для отступа между строками таблицы
+
+    return processed_lines, total_height, fits_in_one_line
+
+
+def _fit_card_font_size(pdf: FPDF, font_family: str, text_lines: List[Dict[str, str]], font_size_range: range,
+                        max_header_width: float, value_width: float, available_height: float,
+                        require_one_line: bool, header_layouts: Optional[Callable[[int], HeaderLayout]] = None
+                        ) -> Tuple[int, List[Dict[str, str]], bool, float]:
+    """
+    Находит наибольший размер шрифта из диапазона, при котором текст карточки помещается по высоте
+    (и, если require_one_line, каждое значение помещается в одну строку).
+
+    Ширины текста пропорциональны размеру шрифта, поэтому количество строк и высота текста
+    не убывают с ростом размера, и вместо перебора всех размеров сверху вниз диапазон делится
+    пополам. Результат совпадает с перебором, а проверяется не больше трех размеров вместо семи.
+
+    Args:
+        pdf: Документ FPDF
+        font_family: Семейство шрифта
+        text_lines: Пары заголовок/значение
+        font_size_range: Размеры шрифта по убыванию
+        max_header_width: Ширина колонки заголовков
+        value_width: Ширина колонки значений
+        available_height: Доступная высота
+        require_one_line: Требовать, чтобы каждое значение помещалось в одну строку
+        header_layouts: Функция, возвращающая готовую колонку заголовков для размера шрифта
+
+    Returns:
+        Tuple[int, List[Dict[str, str]], bool, float]: Размер шрифта, обработанные строки,
+        признак того, что текст поместился (иначе выбран наименьший размер), и высота текста
+    """
+    sizes = list(font_size_range)
+    layouts = {}
+
+    def fits(index: int) -> bool:
+        if index not in layouts:
+            layouts[index] = _layout_card_text(pdf, font_family, text_lines, sizes[index], sizes[0],
+                                               max_header_width, value_width,
+                                               header_layouts(sizes[index]) if header_layouts else None)
+        _, total_height, fits_in_one_line = layouts[index]
+        return total_height < available_height and (fits_in_one_line or not require_one_line)
+
+    # Ищем первый (наибольший) подходящий размер: все размеры после него тоже подходят
+    low, high = 0, len(sizes)
+    while low < high:
+        middle = (low + high) // 2
+        if fits(middle):
+            high = middle
+        else:
+            low = middle + 1
+
+    fitted = low < len(sizes)
+    index = low if fitted else len(sizes) - 1
+    fits(index)
+    processed_lines, total_height, _ = layouts[index]
+    pdf.set_font(font_family, '', sizes[index])
+    return sizes[index], processed_lines, fitted, total_height
+
+
+
+def create_card_pdf(geometry: PageGeometry, font_family: Optional[str] = None,
+                    font_files: Optional[Dict[str, str]] = None) -> FPDF:
+    """
+    Создает документ FPDF с размерами и полями страницы карточки.
+
+    Args:
+        geometry: Размеры страницы карточки
+        font_family: Семейство шрифта, выбираемое в документе (None - шрифт не выбирается)
+        font_files: Файлы TTF по начертаниям ('' и 'B'), подключаемые к документу
+
+    Returns:
+        FPDF: Документ без страниц
+    """
+    pdf = FPDF(orientation='P', unit='mm', format=(geometry.page_width, geometry.page_height))
+    # Устанавливаем минимальные поля для максимального использования пространства
+    pdf.set_margins(geometry.margin_left, geometry.margin_top, geometry.margin_right)
+    # Устанавливаем автоматический разрыв страницы с минимальным нижним полем
+    pdf.set_auto_page_break(True, geometry.margin_bottom)
+    for style, path in (font_files or {}).items():
+        pdf.add_font(font_family, style, path)
+    if font_family:
+        pdf.set_font(font_family, '', 14)
+    return pdf
+
+
+class CardLayoutEngine:
+    """
+    Рассчитывает планы карточек. Текст измеряется в собственном документе FPDF с теми же шрифтами,
+    что и у выводимого документа; в него ничего не выводится, поэтому движок можно создать
+    в другом процессе по тем же параметрам.
+    """
+
+    def __init__(self, geometry: PageGeometry, font_family: str, font_files: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            geometry: Размеры страницы карточки
+            font_family: Семейство шрифта
+            font_files: Файлы TTF по начертаниям ('' и 'B') или None для встроенного шрифта
+        """
+        self.geometry = geometry
+        self.font_family = font_family
+        self.font_files = dict(font_files or {})
+        self.pdf = create_card_pdf(geometry, font_family, self.font_files)
+        # Страница нужна FPDF для разбиения текста на строки; в документ ничего не выводится
+        self.pdf.add_page()
+        self.pdf.set_font(font_family, '', HEADER_MEASURE_FONT_SIZE)
+        # Геометрия колонок по строке заголовков и колонки заголовков по (размер шрифта, заголовки).
+        # Заголовки одинаковы для всех строк листа, поэтому рассчитываются один раз на запуск
+        self._column_geometry_cache: Dict[Tuple[str, ...], Tuple[float, float, float]] = {}
+        self._header_layout_cache: Dict[Tuple[int, Tuple[str, ...]], HeaderLayout] = {}
+
+    def column_geometry(self, headers: Tuple[str, ...]) -> Tuple[float, float, float]:
+        """
+        Возвращает ширину колонки заголовков, отступ между колонками и ширину колонки значений.
+
+        Args:
+            headers: Заголовки карточки
+
+        Returns:
+            Tuple[float, float, float]: Ширина заголовков, отступ и ширина значений
+        """
+        geometry = self._column_geometry_cache.get(headers)
+        if geometry is not None:
+            return geometry
+        pdf = self.pdf
+        metrics = font_metrics.get_font_metrics()
+        available_width = pdf.w - pdf.l_margin - pdf.r_margin
+
+        # Определяем минимальную необходимую ширину заголовка для динамического расчета ширины колонок
+        max_header_width = 0
+        for header in headers:
+            pdf.set_font(self.font_family, 'B', HEADER_MEASURE_FONT_SIZE)  # Используем максимальный размер шрифта для оценки
+            max_header_width = max(max_header_width, metrics.string_width(pdf, header))
+
+        # Колонка заголовков не шире MAX_HEADER_WIDTH_SHARE доступной ширины
+        max_header_width = min(max_header_width + 2, available_width * MAX_HEADER_WIDTH_SHARE)
+        # Отступ между колонками - ширина широкого символа 'W'
+        pdf.set_font(self.font_family, 'B', HEADER_MEASURE_FONT_SIZE)
+        column_spacing = metrics.string_width(pdf, "W")
+        geometry = (max_header_width, column_spacing, available_width - max_header_width - column_spacing)
+        self._column_geometry_cache[headers] = geometry
+        return geometry
+
+    def header_layout(self, headers: Tuple[str, ...], font_size: int) -> HeaderLayout:
+        """
+        Возвращает колонку заголовков для размера шрифта: заголовки с замененными слишком широкими
+        символами и их разбиение на строки.
+
+        Args:
+            headers: Заголовки карточки
+            font_size: Размер шрифта
+
+        Returns:
+            HeaderLayout: Колонка заголовков
+        """
+        key = (font_size, headers)
+        layout = self._header_layout_cache.get(key)
+        if layout is not None:
+            return layout
+        pdf = self.pdf
+        max_header_width = self.column_geometry(headers)[0]
+        first_font_size = self._font_size_range(len(headers))[0]
+        safe_headers = []
+        for index, header in enumerate(headers):
+            # Как и при подборе размера, первый заголовок при наибольшем размере обрабатывается жирным шрифтом
+            pdf.set_font(self.font_family, 'B' if index == 0 and font_size == first_font_size else '', font_size)
+            safe_headers.append(_force_wrap_text(pdf, header, max_header_width))
+        pdf.set_font(self.font_family, 'B', font_size)
+        layout = HeaderLayout(safe_headers, [_split_header_text(pdf, header, max_header_width) for header in safe_headers])
+        self._header_layout_cache[key] = layout
+        return layout
+
+    @staticmethod
+    def _font_size_range(columns: int) -> range:
+        """
+        Диапазон размеров шрифта: при большом количестве колонок начинаем с меньшего размера.
+        """
+        return MANY_COLUMNS_FONT_SIZE_RANGE if columns > MANY_COLUMNS else FONT_SIZE_RANGE
+
+    def layout_card(self, text_lines: List[Dict[str, str]], image_sources: Optional[Dict[str, Optional[str]]] = None,
+                    image_aspects: Optional[Dict[str, float]] = None, article: str = "") -> CardLayout:
+        """
+        Рассчитывает план карточки.
+
+        Args:
+            text_lines: Пары заголовок/значение (словари с ключами header и value)
+            image_sources: Пути к изображениям товара и упаковки по видам ("product", "package"),
+                None - изображение не найдено
+            image_aspects: Соотношения сторон изображений (высота/ширина) по видам, если известны
+            article: Артикул (для сообщений в логе)
+
+        Returns:
+            CardLayout: План карточки
+        """
+        geometry = self.geometry
+        pdf = self.pdf
+        metrics = font_metrics.get_font_metrics()
+        font_family = self.font_family
+        image_sources = image_sources or {}
+        image_aspects = image_aspects or {}
+
+        # Изображения товара и упаковки располагаются рядом под верхним полем
+        images = []
+        for kind, x in (("product", geometry.margin_left),
+                        ("package", geometry.margin_left + geometry.image_width + geometry.image_gap)):
+            if image_sources.get(kind):
+                aspect = image_aspects.get(kind)
+                images.append(ImageBox(kind, image_sources[kind], x, geometry.margin_top, geometry.image_width,
+                                       geometry.image_width * aspect if aspect else None))
+
+        # Доступная высота с учетом нижнего поля и отступа безопасности
+        available_height = geometry.text_bottom - geometry.text_top
+
+        headers = tuple(item['header'] for item in text_lines)
+        max_header_width, column_spacing, value_width = self.column_geometry(headers)
+
+        font_size_range = self._font_size_range(len(text_lines))
+        if len(text_lines) > MANY_COLUMNS:
+            logger.info(f"Обнаружено большое количество колонок ({len(text_lines)}), уменьшаем шрифт для лучшего размещения.")
+
+        # Находим наибольший подходящий размер шрифта делением диапазона пополам
+        font_size, processed_lines, fitted, text_height = _fit_card_font_size(
+            pdf, font_family, text_lines, font_size_range, max_header_width, value_width,
+            available_height, require_one_line=len(text_lines) <= MANY_COLUMNS,
+            header_layouts=lambda size: self.header_layout(headers, size))
+        if not fitted and text_height > available_height:
+            logger.warning(f"Текст для артикула {article} не помещается по высоте даже с минимальным шрифтом ({font_size_range[-1]}). Возможны искажения или обрезание текста.")
+
+        # Раскладываем строки таблицы по страницам: строка, начинающаяся ниже text_bottom,
+        # переносится на страницу продолжения
+        header_layout = self.header_layout(headers, font_size)
+        pdf.set_font(font_family, '', font_size)
+        line_height = pdf.font_size
+        rows = []
+        page = 0
+        y = geometry.text_top
+        for item, header_lines in zip(processed_lines, header_layout.lines):
+            continuation = y > geometry.text_bottom
+            if continuation:
+                page += 1
+                y = geometry.continuation_top
+            value_lines = metrics.count_lines(pdf, item['value'], value_width)
+            bottom = y + max(len(header_lines) * line_height, value_lines * line_height) + ROW_GAP
+            rows.append(CardRow(item['header'], header_lines, item['value'], value_lines, y, bottom, page, continuation))
+            y = bottom
+
+        return CardLayout(
+            article=article,
+            font_size=font_size,
+            fitted=fitted,
+            text_height=text_height,
+            text_x=geometry.margin_left,
+            header_width=max_header_width,
+            column_spacing=column_spacing,
+            value_width=value_width,
+            text_top=geometry.text_top,
+            images=images,
+            rows=rows,
+            pages=page + 1
+        )
+
+
+IMAGE_ERROR_MESSAGES = {
+    "product": "Ошибка при вставке изображения товара",
+    "package": "Ошибка при вставке изображения упаковки",
+}
+
+
+def render_card_layout(pdf: FPDF, layout: CardLayout, font_family: str,
+                       images: Optional[Dict[str, Callable[[], bytes]]] = None) -> None:
+    """
+    Выводит карточку по плану в документ FPDF, начиная с текущей страницы.
+
+    Args:
+        pdf: Документ FPDF
+        layout: План карточки
+        font_family: Семейство шрифта (те же шрифты, что и при расчете плана)
+        images: Функции, возвращающие содержимое изображений по видам ("product", "package")
+    """
+    images = images or {}
+    for box in layout.images:
+        try:
+            # FPDF называет изображение по хэшу содержимого, поэтому одинаковые изображения
+            # нескольких карточек встраиваются в PDF один раз
+            pdf.image(io.BytesIO(images[box.kind]()), x=box.x, y=box.y, w=box.w)
+        except Exception as e:
+            logger.error(f"{IMAGE_ERROR_MESSAGES.get(box.kind, 'Ошибка при вставке изображения')} "
+                         f"'{box.source}' для артикула '{layout.article}': {e}")
+
+    # Текст начинается под изображениями
+    pdf.set_y(layout.text_top)
+    pdf.set_font_size(layout.font_size)
+
+    previous_bottom = layout.text_top
+    for row in layout.rows:
+        if row.continuation:
+            # Надпись о продолжении на следующей странице под последней строкой
+            current_font_size = pdf.font_size
+            current_font_style = pdf.font_style
+            pdf.set_text_color(255, 0, 0)
+            pdf.set_font(font_family, 'B', 14)
+            pdf.set_xy(10, previous_bottom - 5)
+            pdf.cell(70, 10, text=CONTINUATION_TEXT, align='C')
+            # Восстанавливаем настройки шрифта и цвета
+            pdf.set_text_color(0, 0, 0)
+            pdf.set_font(font_family, current_font_style, current_font_size)
+            pdf.add_page()
+
+        # Заголовок (левая колонка) жирным шрифтом с переносом только по пробелам
+        pdf.set_font_size(layout.font_size)
+        pdf.set_font(font_family, 'B')
+        for i, line in enumerate(row.header_lines):
+            pdf.set_xy(layout.text_x, row.y + i * pdf.font_size)
+            pdf.cell(w=layout.header_width, h=pdf.font_size, text=line, align='L')
+
+        # Значение (правая колонка) с переносом по словам
+        pdf.set_font(font_family, '')
+        pdf.set_xy(layout.text_x + layout.header_width + layout.column_spacing, row.y)
+        if row.value_lines == 1:
+            # Значение в одну строку выводится через cell для лучшего выравнивания
+            pdf.cell(w=layout.value_width, h=pdf.font_size, text=row.value, align='L')
+        else:
+            pdf.multi_cell(w=layout.value_width, h=pdf.font_size, text=row.value, align='L')
+
+        pdf.set_y(row.bottom)
+        previous_bottom = row.bottom
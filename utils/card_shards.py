@@ -0,0 +1,303 @@
+"""
+Параллельный вывод карточек PDF: карточки последовательных диапазонов строк (частей) выводятся
+в отдельные PDF в пуле процессов, а части дописываются в итоговый документ (см. pdf_stream)
+в порядке строк
+"""
+import gc
+import os
+import time
+import shutil
+import string
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Callable, Iterable
+
+from . import card_layout
+from . import pdf_stream
+
+logger = logging.getLogger(__name__)
+
+# Параллельный вывод включается для листов с таким количеством строк и больше (0 - не использовать)
+DEFAULT_SHARD_MIN_ROWS = 20000
+
+# Символы, которые могут появиться в тексте карточек помимо значений ячеек: форматирование чисел
+# и дат, замена слишком широких символов, надпись о продолжении
+EXTRA_CHARSET = string.digits + string.punctuation + " ?" + card_layout.CONTINUATION_TEXT
+
+
+@dataclass
+class ShardContext:
+    """
+    Общие для всех частей параметры вывода (передаются процессам пула один раз при запуске).
+    """
+    geometry: card_layout.PageGeometry
+    font_family: str
+    font_files: Dict[str, str]
+    # Символы, заранее добавляемые в подмножества шрифтов каждой части
+    charset: str = ""
+
+
+@dataclass
+class CardShard:
+    """
+    Часть документа: планы карточек последовательных строк и их изображения.
+    """
+    index: int
+    output_path: str
+    layouts: List[card_layout.CardLayout] = field(default_factory=list)
+    # Содержимое изображений карточек по видам и сообщения об ошибках их подготовки
+    images: List[Dict[str, bytes]] = field(default_factory=list)
+    image_errors: List[Dict[str, str]] = field(default_factory=list)
+
+
+class _LogCollector(logging.Handler):
+    """
+    Собирает сообщения о карточках в процессе пула, чтобы основной процесс записал их в свой лог.
+    """
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records: List[Tuple[str, int, str]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append((record.name, record.levelno, record.getMessage()))
+
+
+def _failed_image(message: str) -> Callable[[], bytes]:
+    def load() -> bytes:
+        raise RuntimeError(message)
+    return load
+
+
+def prepick_charset(pdf, font_family: str, font_files: Dict[str, str], charset: str) -> None:
+    """
+    Добавляет символы charset в подмножества TTF-шрифтов документа в одном и том же порядке.
+
+    FPDF нумерует символы подмножества в порядке их первого использования, поэтому без этого
+    шрифты разных частей различались бы и встраивались в итоговый PDF для каждой части. С одинаковым
+    набором символов объекты шрифтов частей совпадают и записываются один раз (см. pdf_stream).
+
+    Args:
+        pdf: Документ FPDF с подключенными шрифтами
+        font_family: Семейство шрифта
+        font_files: Файлы TTF по начертаниям (пусто - встроенный шрифт, подмножеств нет)
+        charset: Символы (см. collect_charset)
+    """
+    if not font_files or not charset:
+        return
+    for style in font_files:
+        pdf.set_font(font_family, style, 14)
+        font = pdf.current_font
+        for char in charset:
+            if ord(char) in font.cmap:
+                font.subset.pick(ord(char))
+    pdf.set_font(font_family, '', 14)
+
+
+def render_shard(context: ShardContext, shard: CardShard) -> Tuple[int, str, int, List[Tuple[str, int, str]]]:
+    """
+    Выводит карточки части в отдельный PDF (shard.output_path).
+
+    Args:
+        context: Параметры вывода
+        shard: Часть документа
+
+    Returns:
+        Tuple[int, str, int, List[Tuple[str, int, str]]]: Номер части, путь к PDF, количество страниц
+            и сообщения лога (логгер, уровень, текст)
+    """
+    # Сообщения о карточках записываются в лог основным процессом в порядке частей
+    collector = _LogCollector()
+    card_logger = logging.getLogger(card_layout.__name__)
+    propagate = card_logger.propagate
+    card_logger.addHandler(collector)
+    card_logger.propagate = False
+    try:
+        pdf = card_layout.create_card_pdf(context.geometry, context.font_family, context.font_files)
+        prepick_charset(pdf, context.font_family, context.font_files, context.charset)
+        for layout, images, image_errors in zip(shard.layouts, shard.images, shard.image_errors):
+            pdf.add_page()
+            pdf.set_y(10)
+            loaders = {kind: (lambda data=data: data) for kind, data in images.items()}
+            loaders.update({kind: _failed_image(message) for kind, message in image_errors.items()})
+            card_layout.render_card_layout(pdf, layout, context.font_family, loaders)
+        pdf.output(shard.output_path)
+        pages = pdf.page
+    finally:
+        card_logger.removeHandler(collector)
+        card_logger.propagate = propagate
+    # Документ FPDF содержит циклические ссылки, память части освобождается сборщиком циклов
+    del pdf
+    gc.collect()
+    return shard.index, shard.output_path, pages, collector.records
+
+
+# Параметры вывода в процессе пула (см. _init_worker)
+_worker_context: Optional[ShardContext] = None
+
+
+def _init_worker(context: ShardContext) -> None:
+    global _worker_context
+    _worker_context = context
+
+
+def _render_shard_in_worker(shard: CardShard) -> Tuple[int, str, int, List[Tuple[str, int, str]]]:
+    return render_shard(_worker_context, shard)
+
+
+def collect_charset(texts: Iterable[str]) -> str:
+    """
+    Возвращает отсортированный набор символов текстов карточек вместе с EXTRA_CHARSET.
+
+    Args:
+        texts: Заголовки и значения ячеек
+
+    Returns:
+        str: Символы без повторов
+    """
+    chars = set(EXTRA_CHARSET)
+    for text in texts:
+        chars.update(text)
+    return "".join(sorted(chars))
+
+
+class ShardedCardRenderer:
+    """
+    Выводит карточки частями в пуле процессов и дописывает части в StreamingPdfWriter в порядке строк.
+
+    Планы карточек рассчитываются в основном процессе (add_card), части по shard_cards карточек
+    отправляются в пул. В памяти одновременно находится не больше workers + 1 частей с изображениями.
+    """
+
+    def __init__(self, writer: pdf_stream.StreamingPdfWriter, context: ShardContext, workers: int,
+                 shard_cards: int, temp_dir: Optional[str] = None):
+        """
+        Args:
+            writer: Итоговый документ
+            context: Параметры вывода
+            workers: Количество процессов (1 - вывод в текущем процессе)
+            shard_cards: Количество карточек в части
+            temp_dir: Папка для временных PDF частей (None - системная временная папка)
+        """
+        self.writer = writer
+        self.context = context
+        self.shard_cards = max(1, shard_cards)
+        self.max_pending = workers + 1
+        self._temp_dir = tempfile.mkdtemp(prefix=".card_shards_", dir=temp_dir)
+        self._executor = None
+        if workers > 1:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                     initargs=(context,))
+            except (OSError, NotImplementedError, ValueError) as e:
+                logger.warning(f"Не удалось запустить пул процессов для вывода карточек: {e}. "
+                               f"Вывод в текущем процессе")
+        self._pending: deque = deque()
+        self._shard: Optional[CardShard] = None
+        self._next_index = 0
+        self.stats = {"shards": 0, "cards": 0, "pages": 0, "wait_sec": 0.0}
+
+    def add_card(self, layout: card_layout.CardLayout, images: Dict[str, Callable[[], bytes]]) -> None:
+        """
+        Добавляет карточку в текущую часть. Изображения подготавливаются сразу, ошибки их подготовки
+        записываются в лог при выводе карточки, как при последовательном выводе.
+
+        Args:
+            layout: План карточки
+            images: Функции, возвращающие содержимое изображений по видам
+        """
+        if self._shard is None:
+            self._shard = CardShard(self._next_index,
+                                    os.path.join(self._temp_dir, f"shard_{self._next_index:06d}.pdf"))
+            self._next_index += 1
+        card_images = {}
+        image_errors = {}
+        for kind, load in images.items():
+            try:
+                card_images[kind] = load()
+            except Exception as e:
+                image_errors[kind] = str(e)
+        self._shard.layouts.append(layout)
+        self._shard.images.append(card_images)
+        self._shard.image_errors.append(image_errors)
+        self.stats["cards"] += 1
+        if len(self._shard.layouts) >= self.shard_cards:
+            self._submit()
+
+    def _submit(self) -> None:
+        shard, self._shard = self._shard, None
+        if self._executor is not None:
+            self._pending.append(self._executor.submit(_render_shard_in_worker, shard))
+        else:
+            future = Future()
+            future.set_result(render_shard(self.context, shard))
+            self._pending.append(future)
+        while len(self._pending) >= self.max_pending:
+            self._append(self._pending.popleft())
+
+    def _append(self, future: Future) -> None:
+        started = time.perf_counter()
+        index, path, pages, records = future.result()
+        self.stats["wait_sec"] += time.perf_counter() - started
+        for name, level, message in records:
+            logging.getLogger(name).log(level, message)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.remove(path)
+        self.writer.append_pdf(data)
+        self.stats["shards"] += 1
+        self.stats["pages"] += pages
+
+    def finish(self) -> None:
+        """
+        Выводит оставшиеся карточки, дописывает все части в итоговый документ и закрывает пул.
+        """
+        try:
+            if self._shard is not None:
+                self._submit()
+            while self._pending:
+                self._append(self._pending.popleft())
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Закрывает пул процессов и удаляет временные PDF частей.
+        """
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+    def format_stats(self) -> str:
+        """
+        Возвращает статистику вывода в виде строки для лога.
+        """
+        return (f"частей {self.stats['shards']}, карточек {self.stats['cards']}, страниц {self.stats['pages']}, "
+                f"ожидание частей {self.stats['wait_sec']:.1f} сек")
+
+
+def get_configured_workers(rows: int) -> int:
+    """
+    Возвращает количество процессов параллельного вывода карточек по настройкам
+    "pdf_settings.shard_min_rows" и "pdf_settings.shard_workers" (0 - по количеству ядер без одного).
+
+    Args:
+        rows: Количество карточек
+
+    Returns:
+        int: Количество процессов или 0, если карточки выводятся последовательно
+    """
+    from . import config_manager
+
+    min_rows = config_manager.get_non_negative_int_setting("pdf_settings.shard_min_rows", DEFAULT_SHARD_MIN_ROWS)
+    if not min_rows or rows < min_rows:
+        return 0
+    workers = config_manager.get_non_negative_int_setting("pdf_settings.shard_workers", 0) or (os.cpu_count() or 1) - 1
+    return workers if workers > 1 else 0
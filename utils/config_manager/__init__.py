@@ -66,6 +66,40 @@ def get_setting(path: str, default=None) -> Any:
     """
     return get_config_manager().get_setting(path, default)
 
+def get_setting_or_default(path: str, default=None) -> Any:
+    """
+    Получает значение настройки, как get_setting, но без инициализированного ConfigManager
+    (процессы пула, тесты, вызов из скриптов) возвращает default вместо исключения
+    
+    Args:
+        path: Путь к настройке в точечной нотации
+        default: Значение по умолчанию
+        
+    Returns:
+        Значение настройки или default
+    """
+    try:
+        return get_setting(path, default)
+    except RuntimeError:
+        return default
+
+def get_non_negative_int_setting(path: str, default: int) -> int:
+    """
+    Получает целочисленную настройку (отрицательные значения заменяются нулем)
+    
+    Args:
+        path: Путь к настройке в точечной нотации
+        default: Значение по умолчанию, в том числе для нечисловых значений
+        
+    Returns:
+        Неотрицательное целое значение
+    """
+    value = get_setting_or_default(path, default)
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return default
+
 def set_setting(path: str, value: Any) -> None:
     """
     Устанавливает значение настройки по указанному пути
@@ -46,7 +46,30 @@ class ConfigManager:
                 "quality": 100,
                 "target_width": 300,
                 "target_height": 300,
-                "supported_extensions": [".jpg"]
+                "supported_extensions": [".jpg"],
+                "resize_enabled": True,  # Уменьшать изображения до target_width x target_height (Excel) и print_dpi (PDF)
+                "print_dpi": 300,        # Разрешение печати изображений в карточках PDF
+                "max_decode_pixels": 150000000,  # Лимит пикселей изображения, декодируемого целиком (0 - без ограничения)
+                "cache_enabled": True,   # Дисковый кэш оптимизированных изображений
+                "cache_dir": "",         # Папка кэша (пусто - settings_presets/image_cache)
+                "cache_max_mb": 1024,    # Максимальный размер кэша в МБ
+                "pipeline_workers": 0,   # Процессы оптимизации изображений PDF (0 - по числу ядер)
+                "pipeline_lookahead": 0, # Окно опережения в строках (0 - две строки на процесс)
+                "plan_budget": True,     # Распределять лимит размера PDF между изображениями по их сжимаемости
+                "rendition_tiers_kb": [40, 120, 300],  # Ступени размера заранее рассчитанных копий изображений
+                "renditions_dir": ""     # Папка копий изображений (пусто - settings_presets/renditions)
+            },
+            "pdf_settings": {
+                "stream_min_rows": 2000,   # Записывать PDF на диск частями для листов с таким числом строк (0 - не использовать)
+                "stream_chunk_cards": 200, # Количество карточек в одной части
+                "shard_min_rows": 20000,   # Выводить карточки частями в пуле процессов для листов с таким числом строк (0 - не использовать)
+                "shard_workers": 0         # Процессы вывода карточек (0 - по числу ядер без одного)
+            },
+            "scan_settings": {
+                "max_workers": 8,        # Количество папок, читаемых одновременно при обходе
+                "dir_timeout_sec": 30,   # Максимальное время чтения одной папки в секундах
+                "catalog_refresh_sec": 60,  # Через сколько секунд поиск по каталогу снова проверяет mtime папок (0 - при каждом поиске)
+                "snapshot_path": ""      # Общий снимок индекса изображений, загружаемый при запуске
             },
             "ui_settings": {
                 "show_preview": True,
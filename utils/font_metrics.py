@@ -0,0 +1,300 @@
+"""
+Кэш метрик шрифтов для измерения текста в PDF-карточках без посимвольных вызовов FPDF
+"""
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from fpdf import FPDF
+
+try:
+    from fpdf.line_break import BREAKING_SPACE_SYMBOLS_STR, NBSP, SOFT_HYPHEN
+except ImportError:
+    # Значения из fpdf.line_break (модуль не является частью публичного API FPDF)
+    BREAKING_SPACE_SYMBOLS_STR = " \u200b\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2008\u2009\u200a\u205f\u3000\t"
+    NBSP = "\u00a0"
+    SOFT_HYPHEN = "\u00ad"
+try:
+    from fpdf.util import FloatTolerance
+    _FLOAT_TOLERANCE = FloatTolerance.TOLERANCE
+except (ImportError, AttributeError):
+    _FLOAT_TOLERANCE = 1e-9
+
+logger = logging.getLogger(__name__)
+
+# Размер таблицы ширин (базовая многоязычная плоскость Unicode). Ширины символов за ее пределами
+# берутся из таблицы шрифта FPDF по одному
+TABLE_CODEPOINTS = 0x10000
+
+# Символы, перенос которых выполняет сам FPDF (особые пробелы, мягкий перенос, неразрывный пробел,
+# перевод страницы)
+SPECIAL_WRAP_CHARS = frozenset(BREAKING_SPACE_SYMBOLS_STR.replace(" ", "") + SOFT_HYPHEN + NBSP + "\f")
+
+CODE_SPACE = ord(" ")
+CODE_LF = ord("\n")
+CODE_CR = ord("\r")
+
+# Допуск сравнения ширины строки с шириной ячейки (как в FPDF)
+WIDTH_TOLERANCE = _FLOAT_TOLERANCE
+
+
+class FontMetricsCache:
+    """
+    Таблицы ширин символов шрифтов FPDF в тысячных долях кегля, индексированные кодом символа.
+
+    Таблица строится один раз для каждого начертания (обычного и жирного), после чего ширина строки
+    при размере шрифта s равна векторной сумме ширин ее символов, умноженной на s. Результат
+    совпадает с pdf.get_string_width до бита: суммируются те же целые ширины и в том же порядке
+    применяются размер шрифта и коэффициент единиц. Для режимов, которые таблица не описывает
+    (растяжение шрифта, межсимвольный интервал, text shaping, запасные шрифты, символьные шрифты),
+    измерение выполняет сам FPDF.
+    """
+
+    def __init__(self):
+        self._tables: Dict[Tuple, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _font_table(self, font) -> np.ndarray:
+        """
+        Возвращает таблицу ширин шрифта, строя ее при первом обращении.
+
+        Args:
+            font: Текущий шрифт FPDF (pdf.current_font)
+
+        Returns:
+            np.ndarray: Ширины символов (int32) по кодам символов
+        """
+        key = (type(font).__name__, getattr(font, "ttffile", None), font.fontkey)
+        table = self._tables.get(key)
+        if table is not None:
+            return table
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                return table
+            if hasattr(font, "cmap"):
+                # TTF: ширины по кодам символов, для отсутствующих в шрифте символов - ширина по умолчанию
+                table = np.full(TABLE_CODEPOINTS, font.desc.missing_width, dtype=np.int32)
+                for code in font.cmap:
+                    if code < TABLE_CODEPOINTS:
+                        table[code] = font.cw[code]
+            else:
+                # Встроенные шрифты: ширины по символам latin-1
+                table = np.zeros(256, dtype=np.int32)
+                for char, width in font.cw.items():
+                    if len(char) == 1 and ord(char) < 256:
+                        table[ord(char)] = width
+            self._tables[key] = table
+            logger.debug(f"Таблица ширин шрифта {font.fontkey}: {len(table)} символов")
+            return table
+
+    @staticmethod
+    def _supported(pdf: FPDF) -> bool:
+        """
+        Проверяет, что ширина текста в текущем состоянии FPDF определяется только таблицей ширин.
+        Если версия FPDF не сообщает состояние text shaping или запасных шрифтов, текст измеряет FPDF.
+        """
+        font = pdf.current_font
+        return (font is not None
+                and not getattr(font, "is_symbol", False)
+                and not getattr(pdf, "text_shaping", True)
+                and not getattr(pdf, "_fallback_font_ids", True)
+                and getattr(pdf, "font_stretching", None) == 100
+                and getattr(pdf, "char_spacing", None) == 0)
+
+    def _codes(self, pdf: FPDF, text: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Возвращает коды символов текста и таблицу ширин текущего шрифта или None,
+        если текст должен измерять FPDF.
+        """
+        if not self._supported(pdf):
+            return None
+        if pdf.str_alias_nb_pages and pdf.str_alias_nb_pages in text:
+            return None
+        # Для встроенных шрифтов FPDF перекодирует текст и отклоняет неподдерживаемые символы
+        text = pdf.normalize_text(text)
+        codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype="<u4")
+        return codes, self._font_table(pdf.current_font)
+
+    @staticmethod
+    def _sum_units(pdf: FPDF, codes: np.ndarray, table: np.ndarray) -> int:
+        """
+        Сумма ширин символов в тысячных долях кегля.
+        """
+        if not len(codes):
+            return 0
+        if codes.max() < len(table):
+            return int(table[codes].sum())
+        inside = codes < len(table)
+        cw = pdf.current_font.cw
+        return int(table[codes[inside]].sum()) + sum(cw[int(code)] for code in codes[~inside])
+
+    def text_units(self, pdf: FPDF, text: str) -> Optional[int]:
+        """
+        Ширина текста текущим шрифтом в тысячных долях кегля (не зависит от размера шрифта).
+        Ширина склеенных строк равна сумме их ширин.
+
+        Args:
+            pdf: Документ FPDF с выбранным шрифтом
+            text: Текст
+
+        Returns:
+            Optional[int]: Ширина или None, если текст должен измерять FPDF
+        """
+        prepared = self._codes(pdf, text)
+        if prepared is None:
+            return None
+        return self._sum_units(pdf, *prepared)
+
+    def word_units(self, pdf: FPDF, text: str) -> Optional[List[int]]:
+        """
+        Ширины слов текста, разделенного пробелами (как text.split(' ')), в тысячных долях кегля.
+
+        Args:
+            pdf: Документ FPDF с выбранным шрифтом
+            text: Текст
+
+        Returns:
+            Optional[List[int]]: Ширины слов или None, если текст должен измерять FPDF
+        """
+        prepared = self._codes(pdf, text)
+        if prepared is None or len(prepared[0]) != len(text):
+            return None
+        codes, table = prepared
+        totals = np.concatenate(([0], np.cumsum(self._code_units(pdf, codes, table))))
+        bounds = np.flatnonzero(codes == CODE_SPACE)
+        starts = np.concatenate(([0], bounds + 1))
+        ends = np.concatenate((bounds, [len(codes)]))
+        return (totals[ends] - totals[starts]).tolist()
+
+    @staticmethod
+    def units_to_width(pdf: FPDF, units: int) -> float:
+        """
+        Переводит ширину в тысячных долях кегля в единицы документа при текущем размере шрифта.
+        """
+        return units * pdf.font_size_pt * 0.001 / pdf.k
+
+    def string_width(self, pdf: FPDF, text: str) -> float:
+        """
+        Ширина строки в единицах документа, равная pdf.get_string_width(text).
+
+        Args:
+            pdf: Документ FPDF с выбранным шрифтом и размером
+            text: Текст
+
+        Returns:
+            float: Ширина строки
+        """
+        units = self.text_units(pdf, text)
+        if units is None:
+            return pdf.get_string_width(text)
+        return self.units_to_width(pdf, units)
+
+    @staticmethod
+    def _code_units(pdf: FPDF, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+        """
+        Ширины отдельных символов в тысячных долях кегля.
+        """
+        if not len(codes) or codes.max() < len(table):
+            return table[codes].astype(np.int64)
+        cw = pdf.current_font.cw
+        return np.array([table[code] if code < len(table) else cw[int(code)] for code in codes], dtype=np.int64)
+
+    def char_widths(self, pdf: FPDF, text: str) -> np.ndarray:
+        """
+        Ширины отдельных символов в единицах документа, равные pdf.get_string_width(char).
+
+        Args:
+            pdf: Документ FPDF с выбранным шрифтом и размером
+            text: Текст
+
+        Returns:
+            np.ndarray: Ширина каждого символа текста
+        """
+        prepared = self._codes(pdf, text)
+        if prepared is None or len(prepared[0]) != len(text):
+            return np.array([pdf.get_string_width(char) for char in text], dtype=np.float64)
+        return self._code_units(pdf, *prepared) * pdf.font_size_pt * 0.001 / pdf.k
+
+    def count_lines(self, pdf: FPDF, text: str, width: float) -> int:
+        """
+        Количество строк текста при переносе по словам, равное
+        len(pdf.multi_cell(w=width, text=text, split_only=True)).
+
+        Перенос повторяет MultiLineBreak из FPDF: строка заканчивается на символе, с которым ее
+        ширина превысила бы доступную (ширина ячейки без двух отступов c_margin), и переносится по
+        последнему пробелу, а слово без пробелов - по символам. Ширина строки-кандидата для всех
+        символов считается векторно. Тексты с мягкими переносами, неразрывными и особыми пробелами,
+        а также символы, не помещающиеся в пустую строку, переносит сам FPDF.
+
+        Args:
+            pdf: Документ FPDF с выбранным шрифтом и размером
+            text: Текст
+            width: Ширина ячейки
+
+        Returns:
+            int: Количество строк (не меньше 1)
+        """
+        prepared = self._codes(pdf, text) if width > 0 else None
+        if prepared is None or any(char in SPECIAL_WRAP_CHARS for char in text):
+            return len(pdf.multi_cell(w=width, text=text, split_only=True))
+        codes, table = prepared
+        codes = codes[codes != CODE_CR]
+        units = self._code_units(pdf, codes, table)
+        max_width = width
+        for margin in (pdf.c_margin, pdf.c_margin):
+            max_width -= float(margin)
+
+        scale = pdf.font_size_pt * 0.001
+        k = pdf.k
+        char_width = units * scale / k
+        lines = 0
+        start = 0
+        # Абзацы между переводами строк переносятся независимо
+        for end in list(np.flatnonzero(codes == CODE_LF)) + [len(codes)]:
+            while True:
+                segment = units[start:end]
+                line_units = np.cumsum(segment) - segment
+                overflow = (line_units * scale / k + char_width[start:end]) - max_width > WIDTH_TOLERANCE
+                if not overflow.any():
+                    break
+                position = start + int(overflow.argmax())
+                lines += 1
+                if codes[position] == CODE_SPACE:
+                    start = position + 1
+                    continue
+                spaces = np.flatnonzero(codes[start:position] == CODE_SPACE)
+                if len(spaces):
+                    start = start + int(spaces[-1]) + 1
+                elif position > start:
+                    start = position
+                else:
+                    # Символ не помещается в пустую строку: FPDF сообщит об ошибке сам
+                    return len(pdf.multi_cell(w=width, text=text, split_only=True))
+            if end < len(codes):
+                # Перевод строки завершает строку, даже пустую
+                lines += 1
+                start = end + 1
+            elif units[start:end].sum():
+                lines += 1
+        return max(lines, 1)
+
+
+# Общий экземпляр кэша: таблицы шрифтов не меняются между запусками
+_font_metrics = None
+_font_metrics_lock = threading.Lock()
+
+
+def get_font_metrics() -> FontMetricsCache:
+    """
+    Возвращает общий для процесса кэш метрик шрифтов.
+
+    Returns:
+        FontMetricsCache: Кэш метрик
+    """
+    global _font_metrics
+    with _font_metrics_lock:
+        if _font_metrics is None:
+            _font_metrics = FontMetricsCache()
+        return _font_metrics
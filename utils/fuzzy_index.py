@@ -0,0 +1,274 @@
+"""
+Нечеткий поиск артикулов: индекс частей имен и проверка ограниченного расстояния Левенштейна
+"""
+import bisect
+import threading
+from typing import List, Dict, Optional, Tuple, Iterable
+
+import numpy as np
+
+# Максимальное расстояние редактирования для подсказок
+DEFAULT_MAX_DISTANCE = 2
+
+# Количество подсказок по умолчанию
+DEFAULT_SUGGESTIONS_LIMIT = 5
+
+# Более короткие артикулы похожи слишком на многое, подсказки для них не ищутся
+MIN_QUERY_LENGTH = 4
+
+
+# Наибольшее количество частей, на которые делится имя в индексе (см. _segments)
+MAX_SEGMENTS = 5
+
+
+def _segments(length: int) -> List[Tuple[int, int]]:
+    """
+    Делит имя длины length на min(MAX_SEGMENTS, length) последовательных частей почти равной длины.
+
+    Returns:
+        List[Tuple[int, int]]: Начало и длина каждой части
+    """
+    count = min(MAX_SEGMENTS, length)
+    base, extra = divmod(length, count)
+    segments = []
+    start = 0
+    for index in range(count):
+        segment_length = base + (1 if index >= count - extra else 0)
+        segments.append((start, segment_length))
+        start += segment_length
+    return segments
+
+
+def _segment_keys(name: str) -> List[int]:
+    """
+    Возвращает хэши частей имени вместе с длиной имени и номером части.
+    """
+    length = len(name)
+    return [hash((length, index, name[start:start + segment_length]))
+            for index, (start, segment_length) in enumerate(_segments(length))]
+
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> Optional[int]:
+    """
+    Вычисляет расстояние Левенштейна, если оно не превышает max_distance.
+
+    Считается только полоса шириной 2 * max_distance + 1 вокруг диагонали, вычисление
+    прерывается, как только расстояние гарантированно превышает предел.
+
+    Args:
+        a (str): Первая строка
+        b (str): Вторая строка
+        max_distance (int): Предельное расстояние
+
+    Returns:
+        Optional[int]: Расстояние или None, если оно больше max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    too_far = max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        low = max(1, i - max_distance)
+        high = min(len(b), i + max_distance)
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= max_distance else too_far
+        char_a = a[i - 1]
+        row_min = current[0]
+        for j in range(low, high + 1):
+            cost = 0 if char_a == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            current[j] = value if value < too_far else too_far
+            if current[j] < row_min:
+                row_min = current[j]
+        if row_min > max_distance:
+            return None
+        previous = current
+    distance = previous[len(b)]
+    return distance if distance <= max_distance else None
+
+
+class FuzzyIndex:
+    """
+    Индекс для поиска имен файлов, близких к артикулу.
+
+    Находит три вида подсказок:
+    - имена на расстоянии не больше DEFAULT_MAX_DISTANCE правок: имя делится на MAX_SEGMENTS частей
+      (см. _segments), хэши частей хранятся в отсортированном массиве NumPy. Каждая правка затрагивает
+      не больше одной части, поэтому у имени на расстоянии d не меньше (частей - d) частей встречаются
+      в артикуле без изменений со сдвигом не больше d. Запрос сводится к двоичным поискам подстрок
+      артикула, а память индекса растет линейно с количеством имен;
+    - имена, начинающиеся с артикула ("abc-123_v2" для "abc-123") - по отсортированному списку имен;
+    - имена, которыми начинается артикул ("abc-123" для "abc-123_v2") - по словарю имен.
+
+    Хэши строк зависят от процесса, поэтому индекс строится заново в каждом процессе.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        """
+        Args:
+            names (Iterable[str]): Нормализованные имена файлов
+        """
+        self._lock = threading.RLock()
+        self._names: List[Optional[str]] = sorted(set(name for name in names if name))
+        self._ids: Dict[str, int] = {name: name_id for name_id, name in enumerate(self._names)}
+        self._sorted_names: List[str] = list(self._names)
+        # Имена, добавленные после построения: ключ части -> номера имен
+        self._pending: Dict[int, List[int]] = {}
+        # Имена не длиннее DEFAULT_MAX_DISTANCE: у них может не остаться ни одной неизмененной части,
+        # поэтому они проверяются перебором (таких имен единицы)
+        self._short_ids: List[int] = []
+
+        keys = []
+        key_ids = []
+        for name_id, name in enumerate(self._names):
+            if len(name) <= DEFAULT_MAX_DISTANCE:
+                self._short_ids.append(name_id)
+                continue
+            name_keys = _segment_keys(name)
+            keys.extend(name_keys)
+            key_ids.extend([name_id] * len(name_keys))
+        keys = np.array(keys, dtype=np.int64)
+        # Устойчивая сортировка: номера имен с одним ключом идут по возрастанию (см. _lookup)
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._key_ids = np.array(key_ids, dtype=np.int32)[order]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, name: str) -> None:
+        """
+        Добавляет имя в индекс.
+        """
+        with self._lock:
+            if not name or name in self._ids:
+                return
+            name_id = len(self._names)
+            self._names.append(name)
+            self._ids[name] = name_id
+            bisect.insort(self._sorted_names, name)
+            if len(name) <= DEFAULT_MAX_DISTANCE:
+                self._short_ids.append(name_id)
+                return
+            for key in _segment_keys(name):
+                self._pending.setdefault(key, []).append(name_id)
+
+    def discard(self, name: str) -> None:
+        """
+        Удаляет имя из индекса (ключи его частей отбрасываются при поиске).
+        """
+        with self._lock:
+            name_id = self._ids.pop(name, None)
+            if name_id is None:
+                return
+            self._names[name_id] = None
+            position = bisect.bisect_left(self._sorted_names, name)
+            if position < len(self._sorted_names) and self._sorted_names[position] == name:
+                del self._sorted_names[position]
+
+    def _lookup(self, key: int) -> np.ndarray:
+        """
+        Номера имен с ключом части key по возрастанию (включая добавленные после построения).
+        """
+        start = np.searchsorted(self._keys, key, side='left')
+        end = np.searchsorted(self._keys, key, side='right')
+        pending = self._pending.get(key)
+        if pending:
+            return np.concatenate([self._key_ids[start:end], np.array(pending, dtype=np.int32)])
+        return self._key_ids[start:end]
+
+    def _segment_candidates(self, query: str, max_distance: int) -> List[int]:
+        """
+        Номера имен, у которых не меньше (частей - max_distance) частей встречаются в запросе
+        со сдвигом не больше max_distance (необходимое условие расстояния не больше max_distance).
+
+        Кандидаты берутся из (max_distance + 1) самых редких частей: хотя бы одна из них обязана
+        совпасть, поэтому частые части (общий префикс артикулов) не перебираются.
+        """
+        candidates = []
+        for length in range(max(DEFAULT_MAX_DISTANCE + 1, len(query) - max_distance), len(query) + max_distance + 1):
+            # Для каждой части - отсортированные номера имен по сдвигам
+            segment_ids = []
+            for index, (start, segment_length) in enumerate(_segments(length)):
+                found = []
+                for shift in range(-max_distance, max_distance + 1):
+                    position = start + shift
+                    if position < 0 or position + segment_length > len(query):
+                        continue
+                    ids = self._lookup(hash((length, index, query[position:position + segment_length])))
+                    if len(ids):
+                        found.append(ids)
+                segment_ids.append(found)
+            required = len(segment_ids) - max_distance
+            rarest = sorted(segment_ids, key=lambda found: sum(map(len, found)))[:max_distance + 1]
+            rarest_ids = [ids for found in rarest for ids in found]
+            if not rarest_ids:
+                continue
+            length_candidates = np.unique(np.concatenate(rarest_ids))
+            # Совпавшие части считаются двоичным поиском в отсортированных номерах, без слияния
+            # больших списков частых частей
+            matched = np.zeros(len(length_candidates), dtype=np.int32)
+            for found in segment_ids:
+                present = np.zeros(len(length_candidates), dtype=bool)
+                for ids in found:
+                    positions = np.minimum(np.searchsorted(ids, length_candidates), len(ids) - 1)
+                    present |= ids[positions] == length_candidates
+                matched += present
+            candidates.extend(length_candidates[matched >= required].tolist())
+        return candidates
+
+    def search(self, query: str, limit: int = DEFAULT_SUGGESTIONS_LIMIT,
+               max_distance: int = DEFAULT_MAX_DISTANCE) -> List[Tuple[int, str]]:
+        """
+        Находит имена, близкие к запросу.
+
+        Args:
+            query (str): Нормализованный артикул
+            limit (int): Максимальное количество результатов
+            max_distance (int): Максимальное расстояние для имен, найденных по частям имен
+                (не больше DEFAULT_MAX_DISTANCE)
+
+        Returns:
+            List[Tuple[int, str]]: Пары (расстояние, имя), упорядоченные по расстоянию и имени.
+                Для имен, которые начинаются с запроса или которыми начинается запрос, расстоянием
+                считается разница длин
+        """
+        if not query or len(query) < MIN_QUERY_LENGTH or limit <= 0:
+            return []
+
+        results: Dict[str, int] = {}
+        with self._lock:
+            # Имена на расстоянии не больше max_distance
+            max_distance = min(max_distance, DEFAULT_MAX_DISTANCE)
+            candidate_ids = set(self._short_ids)
+            candidate_ids.update(self._segment_candidates(query, max_distance))
+
+            for name_id in candidate_ids:
+                name = self._names[name_id]
+                if name is None or name == query:
+                    continue
+                distance = bounded_levenshtein(query, name, max_distance)
+                if distance is not None:
+                    results[name] = distance
+
+            # Имена, которые начинаются с запроса (версии и ракурсы одного артикула)
+            position = bisect.bisect_left(self._sorted_names, query)
+            found_extensions = 0
+            while position < len(self._sorted_names) and found_extensions < limit:
+                name = self._sorted_names[position]
+                if not name.startswith(query):
+                    break
+                if name != query and name not in results:
+                    results[name] = len(name) - len(query)
+                    found_extensions += 1
+                position += 1
+
+            # Имена, которыми начинается запрос
+            for length in range(len(query) - 1, MIN_QUERY_LENGTH - 1, -1):
+                prefix = query[:length]
+                if prefix in self._ids and prefix not in results:
+                    results[prefix] = len(query) - length
+
+        return sorted((distance, name) for name, distance in results.items())[:limit]
@@ -0,0 +1,327 @@
+"""
+Дисковый кэш оптимизированных изображений: повторные запуски не перекодируют одни и те же фотографии
+"""
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from . import image_utils
+
+logger = logging.getLogger(__name__)
+
+# Версия формата кэша. Меняется вместе с алгоритмом оптимизации, чтобы старые записи не использовались
+CACHE_VERSION = 1
+
+# Папка кэша по умолчанию (рядом с пресетами настроек)
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'settings_presets',
+    'image_cache'
+)
+
+# Максимальный размер кэша по умолчанию
+DEFAULT_CACHE_MAX_MB = 1024
+
+# При переполнении удаляются давно использованные записи, пока кэш не сократится до этой доли лимита
+EVICTION_TARGET_RATIO = 0.9
+
+# Временные файлы старше этого возраста остались от прерванных записей и удаляются при очистке
+STALE_TEMP_FILE_AGE_SEC = 3600
+
+CACHE_EXTENSION = ".jpg"
+_TEMP_EXTENSION = ".tmp"
+
+
+class ImageCache:
+    """
+    Кэш закодированных JPEG на диске.
+
+    Ключ - хэш пути, размера и времени изменения исходного файла и параметров преобразования,
+    поэтому изменение исходника или параметров дает новый ключ, а устаревшие записи со временем
+    вытесняются. Записи хранятся отдельными файлами <ключ[:2]>/<ключ>.jpg и записываются атомарно
+    (временный файл и os.replace), поэтому кэш могут одновременно использовать несколько сессий
+    и процессов. Время изменения файла записи обновляется при каждом попадании и служит
+    отметкой последнего использования для вытеснения (LRU).
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_size_mb: float = DEFAULT_CACHE_MAX_MB):
+        """
+        Args:
+            cache_dir (str): Папка кэша
+            max_size_mb (float): Максимальный суммарный размер записей в МБ
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        # Суммарный размер записей; None - еще не подсчитан
+        self._total_bytes: Optional[int] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "errors": 0,
+            "bytes_read": 0,
+            "bytes_written": 0,
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, source_path: str, params: Dict[str, Any]) -> Optional[str]:
+        """
+        Вычисляет ключ записи для исходного файла и параметров преобразования.
+
+        Args:
+            source_path (str): Путь к исходному изображению
+            params (Dict[str, Any]): Параметры преобразования (значения должны сериализоваться в JSON)
+
+        Returns:
+            Optional[str]: Ключ или None, если исходный файл недоступен
+        """
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return None
+        identity = json.dumps([CACHE_VERSION, os.path.normcase(os.path.abspath(source_path)),
+                               stat.st_size, stat.st_mtime_ns, params],
+                              sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_EXTENSION)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Возвращает содержимое записи или None, если записи нет.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        except OSError as e:
+            logger.debug(f"Не удалось прочитать запись кэша изображений {path}: {e}")
+            data = None
+            with self._lock:
+                self.stats["errors"] += 1
+
+        if not data:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+
+        try:
+            os.utime(path)  # Отметка последнего использования для LRU
+        except OSError:
+            pass
+        with self._lock:
+            self.stats["hits"] += 1
+            self.stats["bytes_read"] += len(data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Атомарно сохраняет запись и при переполнении вытесняет давно использованные записи.
+        Ошибки записи только учитываются в статистике: кэш не должен прерывать обработку.
+        """
+        path = self._entry_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}{_TEMP_EXTENSION}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.debug(f"Не удалось сохранить запись кэша изображений {path}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self.stats["stores"] += 1
+            self.stats["bytes_written"] += len(data)
+            if self._total_bytes is not None:
+                self._total_bytes += len(data)
+            needs_eviction = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if needs_eviction:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Подсчитывает размер кэша и, если он больше лимита, удаляет записи с самым давним
+        использованием, пока размер не станет не больше EVICTION_TARGET_RATIO от лимита.
+        Размер пересчитывается по диску, так как кэш могут пополнять другие процессы.
+
+        Returns:
+            int: Количество удаленных записей
+        """
+        entries = []
+        now = time.time()
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(_TEMP_EXTENSION):
+                    if now - stat.st_mtime > STALE_TEMP_FILE_AGE_SEC:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    continue
+                if name.endswith(CACHE_EXTENSION):
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICTION_TARGET_RATIO
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass  # Запись уже удалена другим процессом
+                except OSError:
+                    continue
+                total -= size
+            logger.info(f"Кэш изображений: вытеснено записей {removed}, размер {total / 1024 / 1024:.1f} МБ")
+
+        with self._lock:
+            self._total_bytes = total
+            self.stats["evictions"] += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику кэша.
+
+        Returns:
+            Dict[str, Any]: Копия словаря статистики
+        """
+        with self._lock:
+            return dict(self.stats)
+
+    def format_stats(self, baseline: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Возвращает статистику кэша в виде строки для лога.
+
+        Args:
+            baseline (Optional[Dict[str, Any]]): Ранее снятая статистика (get_stats()). Если указана,
+                выводится разница с ней (статистика одного запуска для общего кэша)
+
+        Returns:
+            str: Строка со статистикой
+        """
+        baseline = baseline or {}
+        stats = self.get_stats()
+        delta = {key: value - baseline.get(key, 0) for key, value in stats.items()}
+        lookups = delta["hits"] + delta["misses"]
+        hit_ratio = delta["hits"] / lookups * 100 if lookups else 0.0
+        return (f"попаданий {delta['hits']} из {lookups} ({hit_ratio:.1f}%), "
+                f"сохранено {delta['stores']}, вытеснено {delta['evictions']}, ошибок {delta['errors']}, "
+                f"прочитано {delta['bytes_read'] / 1024:.1f} КБ")
+
+
+def make_optimize_key(cache: ImageCache, image_path: str, target_size_kb: float,
+                      max_width: Optional[int] = None, max_height: Optional[int] = None,
+                      optimizer: Optional[image_utils.ImageOptimizer] = None) -> Optional[str]:
+    """
+    Вычисляет ключ кэша для результата оптимизации изображения с указанными параметрами.
+
+    Returns:
+        Optional[str]: Ключ или None, если исходный файл недоступен
+    """
+    settings = (optimizer or image_utils.ImageOptimizer()).get_settings()
+    return cache.make_key(image_path, dict(settings, target_size_kb=target_size_kb,
+                                           max_width=max_width, max_height=max_height))
+
+
+def optimize_image_cached(image_path: str, target_size_kb: float,
+                          max_width: Optional[int] = None,
+                          max_height: Optional[int] = None,
+                          cache: Optional[ImageCache] = None,
+                          optimizer: Optional[image_utils.ImageOptimizer] = None) -> io.BytesIO:
+    """
+    Оптимизирует изображение (см. image_utils.ImageOptimizer), используя дисковый кэш.
+
+    Args:
+        image_path (str): Путь к изображению
+        target_size_kb (float): Целевой размер файла в КБ
+        max_width (Optional[int]): Максимальная ширина в пикселях
+        max_height (Optional[int]): Максимальная высота в пикселях
+        cache (Optional[ImageCache]): Кэш. None - оптимизация без кэша
+        optimizer (Optional[ImageOptimizer]): Оптимизатор запуска. None - отдельный оптимизатор для вызова
+
+    Returns:
+        io.BytesIO: Буфер с оптимизированным изображением
+    """
+    optimizer = optimizer or image_utils.ImageOptimizer()
+    key = None
+    if cache is not None:
+        key = make_optimize_key(cache, image_path, target_size_kb, max_width, max_height, optimizer)
+        if key is not None:
+            data = cache.get(key)
+            if data is not None:
+                return io.BytesIO(data)
+
+    buffer, call_stats = optimizer.encode(image_path, target_size_kb=target_size_kb,
+                                          max_width=max_width, max_height=max_height)
+    optimizer.record(call_stats)
+    # Исходные JPEG, переданные без перекодирования, в кэш не копируются
+    if key is not None and not call_stats.get("passthrough"):
+        cache.put(key, buffer.getvalue())
+    buffer.seek(0)
+    return buffer
+
+
+# Общий экземпляр кэша
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_configured_image_cache() -> Optional[ImageCache]:
+    """
+    Возвращает общий для процесса кэш изображений с параметрами из настроек
+    "image_settings.cache_enabled", "image_settings.cache_dir" и "image_settings.cache_max_mb".
+
+    Returns:
+        Optional[ImageCache]: Кэш или None, если кэш отключен или его папка недоступна
+    """
+    from . import config_manager
+
+    global _image_cache
+    enabled = config_manager.get_setting_or_default("image_settings.cache_enabled", True)
+    cache_dir = config_manager.get_setting_or_default("image_settings.cache_dir", "") or DEFAULT_CACHE_DIR
+    max_size_mb = config_manager.get_setting_or_default("image_settings.cache_max_mb", DEFAULT_CACHE_MAX_MB)
+    if not enabled:
+        return None
+
+    try:
+        max_size_mb = float(max_size_mb)
+    except (TypeError, ValueError):
+        max_size_mb = DEFAULT_CACHE_MAX_MB
+
+    with _image_cache_lock:
+        if _image_cache is None or _image_cache.cache_dir != cache_dir:
+            try:
+                _image_cache = ImageCache(cache_dir, max_size_mb)
+            except OSError as e:
+                logger.warning(f"Кэш изображений {cache_dir} недоступен: {e}")
+                return None
+        _image_cache.max_bytes = int(max_size_mb * 1024 * 1024)
+        return _image_cache
@@ -0,0 +1,566 @@
+"""
+Постоянный каталог изображений в SQLite с инкрементальным обновлением по mtime папок
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Dict, Optional, Tuple, Any, Iterable
+
+from . import image_utils
+from . import tree_scanner
+from . import lookup_cache
+from .image_index import SUPPORTED_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы каталога. При изменении схемы или правил нормализации каталог пересоздается
+CATALOG_VERSION = 1
+
+# Путь к каталогу по умолчанию (рядом с пресетами настроек)
+DEFAULT_CATALOG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'settings_presets',
+    'image_catalog.sqlite3'
+)
+
+# Через сколько секунд поиск по каталогу снова проверяет mtime папок корневой папки
+# (как опрос сетевых папок в image_watcher)
+DEFAULT_REFRESH_TTL_SEC = 60
+
+# Типы папок в настройках и соответствующие префиксы ключей
+FOLDER_KINDS = {
+    "product": "paths.product_images_folder_path_",
+    "package": "paths.package_images_folder_path_",
+}
+FOLDERS_PER_KIND = 3
+
+
+def get_configured_folders() -> Dict[str, List[str]]:
+    """
+    Возвращает папки с изображениями из текущих настроек.
+
+    Returns:
+        Dict[str, List[str]]: Словарь "тип папки -> список путей по приоритету" (пустые пути сохраняются)
+    """
+    from . import config_manager
+
+    folders = {}
+    for kind, key_prefix in FOLDER_KINDS.items():
+        folders[kind] = [
+            config_manager.get_setting(f"{key_prefix}{i}", "") or ""
+            for i in range(1, FOLDERS_PER_KIND + 1)
+        ]
+    return folders
+
+
+def get_configured_refresh_ttl() -> int:
+    """
+    Возвращает интервал повторной проверки папок при поиске из настройки "scan_settings.catalog_refresh_sec"
+    (0 - проверять при каждом поиске).
+    """
+    from . import config_manager
+
+    return config_manager.get_non_negative_int_setting("scan_settings.catalog_refresh_sec", DEFAULT_REFRESH_TTL_SEC)
+
+
+class ImageCatalog:
+    """
+    Каталог изображений, сохраняемый на диске между запусками приложения.
+
+    Для каждой корневой папки хранит известные подпапки с их mtime и файлы изображений
+    (нормализованный артикул, путь, размер, mtime). При обновлении перечитываются
+    только папки, у которых изменился mtime; для остальных используется сохраненный
+    список подпапок, поэтому повторное обновление сводится к stat() каждой папки.
+
+    Для каждой корневой папки хранится номер поколения, который увеличивается, когда
+    обновление обнаружило изменившиеся по mtime папки. Фильтр Блума по артикулам папки и
+    кэш отрицательных результатов действительны в пределах поколения и позволяют ответить
+    на запрос отсутствующего артикула без обращения к базе.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CATALOG_PATH,
+                 supported_extensions: Tuple[str, ...] = SUPPORTED_EXTENSIONS,
+                 scanner: Optional[tree_scanner.ParallelTreeScanner] = None,
+                 refresh_ttl: Optional[float] = None):
+        """
+        Открывает (или создает) каталог.
+
+        Args:
+            db_path (str): Путь к файлу базы SQLite
+            supported_extensions (Tuple[str, ...]): Расширения файлов изображений
+            scanner (Optional[ParallelTreeScanner]): Сканер папок. По умолчанию создается
+                при каждом обновлении с текущими настройками "scan_settings.*"
+            refresh_ttl (Optional[float]): Через сколько секунд после обновления корневая папка
+                снова проверяется при поиске (см. ensure_refreshed). None - из настроек
+                (см. get_configured_refresh_ttl)
+        """
+        self.db_path = db_path
+        self.supported_extensions = tuple(ext.lower() for ext in supported_extensions)
+        self.scanner = scanner
+        self.refresh_ttl = refresh_ttl
+        self._lock = threading.RLock()
+        # Корневая папка -> время начала последнего обновления (time.monotonic())
+        self._refreshed_at: Dict[str, float] = {}
+        self._generations: Dict[str, int] = {}
+        self._blooms: Dict[str, Tuple[int, lookup_cache.BloomFilter]] = {}
+        self._negative_cache = lookup_cache.NegativeLookupCache()
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "bloom_rejects": 0,
+            "negative_cache_hits": 0,
+        }
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        """
+        Включает режим WAL и создает таблицы, пересоздавая их при смене версии схемы.
+        """
+        with self._lock:
+            conn = self._conn
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != CATALOG_VERSION:
+                if version:
+                    logger.info(f"Версия каталога изображений изменилась ({version} -> {CATALOG_VERSION}), каталог пересоздается")
+                conn.executescript("""
+                    DROP TABLE IF EXISTS folders;
+                    DROP TABLE IF EXISTS dirs;
+                    DROP TABLE IF EXISTS files;
+                """)
+
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS folders (
+                    root TEXT PRIMARY KEY,
+                    kind TEXT,
+                    tier INTEGER,
+                    refreshed_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    parent TEXT,
+                    mtime REAL
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    dir TEXT NOT NULL,
+                    article TEXT NOT NULL,
+                    size INTEGER,
+                    mtime REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_files_root_article ON files(root, article);
+                CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir);
+                CREATE INDEX IF NOT EXISTS idx_dirs_root ON dirs(root);
+            """)
+            conn.execute(f"PRAGMA user_version={CATALOG_VERSION}")
+            conn.commit()
+
+    def close(self) -> None:
+        """
+        Закрывает соединение с базой.
+        """
+        with self._lock:
+            self._conn.close()
+
+    def register_folder(self, root: str, kind: Optional[str] = None, tier: Optional[int] = None) -> None:
+        """
+        Сохраняет сведения о корневой папке (тип и уровень приоритета из настроек).
+
+        Args:
+            root (str): Корневая папка
+            kind (Optional[str]): Тип папки ("product" или "package")
+            tier (Optional[int]): Уровень приоритета (0 - основная папка)
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO folders(root, kind, tier, refreshed_at) VALUES (?, ?, ?, NULL) "
+                "ON CONFLICT(root) DO UPDATE SET kind=COALESCE(excluded.kind, kind), "
+                "tier=COALESCE(excluded.tier, tier)",
+                (root, kind, tier)
+            )
+            self._conn.commit()
+
+    def refresh(self, root: str, kind: Optional[str] = None, tier: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Инкрементально обновляет каталог для корневой папки.
+
+        Папки обходятся параллельно (см. ParallelTreeScanner). Папка перечитывается (os.scandir)
+        только если ее mtime отличается от сохраненного. Подпапки, которых больше нет на диске,
+        удаляются из каталога вместе с файлами; пропущенные из-за ошибки или таймаута папки
+        сохраняются в каталоге без изменений.
+
+        Args:
+            root (str): Корневая папка
+            kind (Optional[str]): Тип папки ("product" или "package")
+            tier (Optional[int]): Уровень приоритета
+
+        Returns:
+            Dict[str, Any]: Статистика обновления
+        """
+        start_time = time.perf_counter()
+        started_at = time.monotonic()
+        stats = {"dirs_checked": 0, "dirs_rescanned": 0, "dirs_removed": 0,
+                 "files_total": 0, "refresh_time_sec": 0.0}
+
+        if not root or not os.path.isdir(root):
+            logger.warning(f"Папка с изображениями не существует или недоступна: {root}")
+            return stats
+
+        self.register_folder(root, kind, tier)
+        scanner = self.scanner or tree_scanner.get_configured_scanner()
+
+        with self._lock:
+            conn = self._conn
+            known_dirs = {path: mtime for path, mtime in
+                          conn.execute("SELECT path, mtime FROM dirs WHERE root=?", (root,))}
+            known_children: Dict[str, List[str]] = {}
+            for path, parent in conn.execute("SELECT path, parent FROM dirs WHERE root=?", (root,)):
+                if parent is not None:
+                    known_children.setdefault(parent, []).append(path)
+
+        def visit(dir_path: str):
+            # Выполняется в потоке сканера: только чтение диска, без обращения к базе
+            dir_mtime = os.stat(dir_path).st_mtime
+            if known_dirs.get(dir_path) == dir_mtime:
+                # Папка не изменилась - ее файлы и подпапки в каталоге актуальны
+                children = known_children.get(dir_path, [])
+                return children, (children, None)
+            listing = tree_scanner.list_directory(dir_path, self.supported_extensions)
+            return listing.subdirs, (listing.subdirs, listing)
+
+        # Обход выполняется без блокировки каталога: поиск и обновление других папок не ждут
+        # чтения диска (на сетевых папках - минуты), в базу изменения записываются после обхода
+        visited = set()
+        parents = {root: None}
+        listings: List[Tuple[tree_scanner.DirListing, Optional[str]]] = []
+        for dir_path, (subdirs, listing) in scanner.walk(root, visit):
+            visited.add(dir_path)
+            stats["dirs_checked"] += 1
+            for child in subdirs:
+                parents[child] = dir_path
+            if listing is not None:
+                listings.append((listing, parents.get(dir_path)))
+        stats["dirs_rescanned"] = len(listings)
+
+        skipped_prefixes = tuple(os.path.join(path, '') for path in scanner.skipped_dirs)
+        skipped = set(scanner.skipped_dirs)
+        removed_dirs = [path for path in known_dirs
+                        if path not in visited and path not in skipped
+                        and not path.startswith(skipped_prefixes)]
+        stats["dirs_removed"] = len(removed_dirs)
+
+        with self._lock:
+            conn = self._conn
+            for listing, parent in listings:
+                self._store_listing(root, listing, parent)
+            for path in removed_dirs:
+                conn.execute("DELETE FROM files WHERE dir=?", (path,))
+                conn.execute("DELETE FROM dirs WHERE path=?", (path,))
+
+            conn.execute("UPDATE folders SET refreshed_at=? WHERE root=?", (time.time(), root))
+            conn.commit()
+            if stats["dirs_rescanned"] or stats["dirs_removed"] or root not in self._generations:
+                self._generations[root] = self._generations.get(root, 0) + 1
+            stats["files_total"] = conn.execute("SELECT COUNT(*) FROM files WHERE root=?", (root,)).fetchone()[0]
+            self._refreshed_at[root] = started_at
+
+        stats["refresh_time_sec"] = time.perf_counter() - start_time
+        logger.info(f"Каталог изображений обновлен для '{root}' за {stats['refresh_time_sec']:.2f} сек: "
+                    f"проверено папок {stats['dirs_checked']}, перечитано {stats['dirs_rescanned']}, "
+                    f"удалено {stats['dirs_removed']}, файлов {stats['files_total']}")
+        return stats
+
+    def _store_listing(self, root: str, listing: tree_scanner.DirListing, parent: Optional[str]) -> None:
+        """
+        Заменяет в каталоге файлы перечитанной папки.
+
+        Args:
+            root (str): Корневая папка
+            listing (DirListing): Содержимое папки
+            parent (Optional[str]): Родительская папка
+        """
+        articles = image_utils.normalize_articles(
+            (os.path.splitext(file_entry.name)[0] for file_entry in listing.files), for_excel=False)
+        file_rows = [(file_entry.path, root, listing.path, article, file_entry.size, file_entry.mtime)
+                     for file_entry, article in zip(listing.files, articles) if article]
+
+        conn = self._conn
+        conn.execute("DELETE FROM files WHERE dir=?", (listing.path,))
+        conn.executemany("INSERT OR REPLACE INTO files(path, root, dir, article, size, mtime) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", file_rows)
+        conn.execute("INSERT OR REPLACE INTO dirs(path, root, parent, mtime) VALUES (?, ?, ?, ?)",
+                     (listing.path, root, parent, listing.mtime))
+
+    def ensure_refreshed(self, roots: Iterable[Optional[str]]) -> None:
+        """
+        Обновляет корневые папки, которые еще не обновлялись этим экземпляром каталога или
+        обновлялись раньше, чем refresh_ttl секунд назад. Повторное обновление неизменившейся
+        папки сводится к stat() ее подпапок, поэтому поиск видит изменения файлов не позже чем
+        через refresh_ttl секунд без обхода папок при каждом запросе.
+
+        Args:
+            roots (Iterable[Optional[str]]): Корневые папки (пустые значения пропускаются)
+        """
+        ttl = self.refresh_ttl if self.refresh_ttl is not None else get_configured_refresh_ttl()
+        now = time.monotonic()
+        for root in roots:
+            if not root:
+                continue
+            refreshed_at = self._refreshed_at.get(root)
+            if refreshed_at is None or now - refreshed_at >= ttl:
+                self.refresh(root)
+
+    def refresh_configured(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Обновляет каталог для всех папок изображений из настроек.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Статистика обновления по каждой папке
+        """
+        results = {}
+        for kind, folders in get_configured_folders().items():
+            for tier, root in enumerate(folders):
+                if root:
+                    results[root] = self.refresh(root, kind, tier)
+        return results
+
+    def load_entries(self, root: str, recursive: bool = True) -> List[Tuple[str, str]]:
+        """
+        Возвращает все изображения корневой папки из каталога.
+
+        Args:
+            root (str): Корневая папка
+            recursive (bool): Включать ли файлы из подпапок
+
+        Returns:
+            List[Tuple[str, str]]: Пары (нормализованный артикул, путь), упорядоченные по пути
+        """
+        with self._lock:
+            if recursive:
+                rows = self._conn.execute(
+                    "SELECT article, path FROM files WHERE root=? ORDER BY path", (root,)).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT article, path FROM files WHERE root=? AND dir=? ORDER BY path", (root, root)).fetchall()
+        return [(article, path) for article, path in rows if self._is_supported(path)]
+
+    def export_root(self, root: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает содержимое каталога для корневой папки (для снимка индекса).
+
+        Args:
+            root (str): Корневая папка
+
+        Returns:
+            Optional[Dict[str, Any]]: Словарь с ключами kind, tier, refreshed_at, dirs (path, parent, mtime)
+                и files (path, dir, size, mtime), упорядоченными по пути, или None, если папка не в каталоге
+        """
+        with self._lock:
+            folder = self._conn.execute(
+                "SELECT kind, tier, refreshed_at FROM folders WHERE root=?", (root,)).fetchone()
+            if folder is None or folder[2] is None:
+                return None
+            dirs = self._conn.execute(
+                "SELECT path, parent, mtime FROM dirs WHERE root=? ORDER BY path", (root,)).fetchall()
+            files = self._conn.execute(
+                "SELECT path, dir, size, mtime FROM files WHERE root=? ORDER BY path", (root,)).fetchall()
+        return {"kind": folder[0], "tier": folder[1], "refreshed_at": folder[2], "dirs": dirs, "files": files}
+
+    def import_root(self, root: str, kind: Optional[str], tier: Optional[int], refreshed_at: float,
+                    dirs: List[Tuple[str, Optional[str], float]],
+                    files: List[Tuple[str, str, int, float]]) -> bool:
+        """
+        Заменяет содержимое каталога для корневой папки данными из снимка индекса.
+
+        Данные импортируются, только если снимок новее локального каталога. После импорта папка
+        считается не обновленной этим экземпляром каталога: первый поиск или построение индекса
+        проверит ее по mtime папок и перечитает только изменившиеся после создания снимка.
+
+        Args:
+            root (str): Корневая папка
+            kind (Optional[str]): Тип папки
+            tier (Optional[int]): Уровень приоритета
+            refreshed_at (float): Время обновления каталога, из которого создан снимок
+            dirs (List[Tuple[str, Optional[str], float]]): Папки (путь, родительская папка, mtime)
+            files (List[Tuple[str, str, int, float]]): Файлы (путь, папка, размер, mtime)
+
+        Returns:
+            bool: True, если данные импортированы
+        """
+        with self._lock:
+            conn = self._conn
+            local = conn.execute("SELECT refreshed_at FROM folders WHERE root=?", (root,)).fetchone()
+            if local is not None and local[0] is not None and local[0] >= refreshed_at:
+                return False
+
+            articles = image_utils.normalize_articles(
+                (os.path.splitext(os.path.basename(path))[0] for path, _, _, _ in files), for_excel=False)
+            conn.execute("DELETE FROM files WHERE root=?", (root,))
+            conn.execute("DELETE FROM dirs WHERE root=?", (root,))
+            conn.executemany("INSERT OR REPLACE INTO dirs(path, root, parent, mtime) VALUES (?, ?, ?, ?)",
+                             [(path, root, parent, mtime) for path, parent, mtime in dirs])
+            conn.executemany("INSERT OR REPLACE INTO files(path, root, dir, article, size, mtime) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             [(path, root, dir_path, article, size, mtime)
+                              for (path, dir_path, size, mtime), article in zip(files, articles) if article])
+            conn.execute(
+                "INSERT INTO folders(root, kind, tier, refreshed_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(root) DO UPDATE SET kind=COALESCE(excluded.kind, kind), "
+                "tier=COALESCE(excluded.tier, tier), refreshed_at=excluded.refreshed_at",
+                (root, kind, tier, refreshed_at)
+            )
+            conn.commit()
+            self._refreshed_at.pop(root, None)
+            self._generations[root] = self._generations.get(root, 0) + 1
+        return True
+
+    def get_generation(self, root: str) -> int:
+        """
+        Возвращает номер поколения корневой папки (0, если папка еще не обновлялась).
+
+        Args:
+            root (str): Корневая папка
+
+        Returns:
+            int: Номер поколения
+        """
+        return self._generations.get(root, 0)
+
+    def _get_bloom(self, root: str) -> lookup_cache.BloomFilter:
+        """
+        Возвращает фильтр Блума по артикулам корневой папки, перестраивая его при смене поколения.
+        Вызывается под блокировкой каталога.
+        """
+        generation = self.get_generation(root)
+        cached = self._blooms.get(root)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        articles = [article for (article,) in
+                    self._conn.execute("SELECT DISTINCT article FROM files WHERE root=?", (root,))]
+        bloom = lookup_cache.BloomFilter(max(1024, len(articles)))
+        bloom.update(articles)
+        self._blooms[root] = (generation, bloom)
+        return bloom
+
+    def lookup(self, article: Any, folders: List[Optional[str]], recursive: bool = True) -> List[Tuple[int, str]]:
+        """
+        Ищет изображения артикула из Excel по каталогу.
+
+        Args:
+            article (Any): Артикул в исходном виде (нормализуется как данные из Excel)
+            folders (List[Optional[str]]): Папки в порядке приоритета
+            recursive (bool): Учитывать ли файлы из подпапок
+
+        Returns:
+            List[Tuple[int, str]]: Пары (уровень, путь), упорядоченные по приоритету папок
+        """
+        normalized_article = image_utils.normalize_article(article, for_excel=True)
+        self.stats["lookups"] += 1
+        if not normalized_article:
+            self.stats["misses"] += 1
+            return []
+
+        self.ensure_refreshed(folders)
+        candidates = []
+        with self._lock:
+            cache_key = (normalized_article, tuple(folders), recursive)
+            generation = tuple(self.get_generation(root) for root in folders if root)
+            if self._negative_cache.contains(cache_key, generation):
+                self.stats["negative_cache_hits"] += 1
+                self.stats["misses"] += 1
+                return []
+
+            queried = False
+            for tier, root in enumerate(folders):
+                if not root:
+                    continue
+                if normalized_article not in self._get_bloom(root):
+                    continue
+                queried = True
+                if recursive:
+                    rows = self._conn.execute(
+                        "SELECT path FROM files WHERE root=? AND article=? ORDER BY path",
+                        (root, normalized_article)).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT path FROM files WHERE root=? AND dir=? AND article=? ORDER BY path",
+                        (root, root, normalized_article)).fetchall()
+                candidates.extend((tier, path) for (path,) in rows if self._is_supported(path))
+
+            if candidates:
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                if queried:
+                    self._negative_cache.add(cache_key, generation)
+                else:
+                    self.stats["bloom_rejects"] += 1
+        return candidates
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику поиска по каталогу.
+
+        Returns:
+            Dict[str, Any]: Копия словаря статистики
+        """
+        return dict(self.stats)
+
+    def format_stats(self, baseline: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Возвращает статистику поиска по каталогу в виде строки для лога, включая долю промахов,
+        отсеянных фильтром Блума и кэшем отрицательных результатов без запроса к базе.
+
+        Args:
+            baseline (Optional[Dict[str, Any]]): Ранее снятая статистика (get_stats()). Если указана,
+                выводится разница с ней (статистика одного запуска для общего каталога)
+
+        Returns:
+            str: Строка со статистикой
+        """
+        baseline = baseline or {}
+        lookups = self.stats['lookups'] - baseline.get('lookups', 0)
+        hits = self.stats['hits'] - baseline.get('hits', 0)
+        misses = self.stats['misses'] - baseline.get('misses', 0)
+        return (f"запросов {lookups}, найдено {hits}, не найдено {misses}, "
+                f"{lookup_cache.format_negative_stats(self.stats, baseline)}")
+
+    def _is_supported(self, path: str) -> bool:
+        """
+        Проверяет расширение файла по списку поддерживаемых расширений каталога.
+        """
+        return os.path.splitext(path)[1].lower() in self.supported_extensions
+
+
+# Глобальный экземпляр каталога
+_image_catalog = None
+_image_catalog_lock = threading.Lock()
+
+
+def get_image_catalog(db_path: str = DEFAULT_CATALOG_PATH) -> ImageCatalog:
+    """
+    Возвращает общий для процесса экземпляр каталога изображений, создавая его при первом вызове.
+
+    Args:
+        db_path (str): Путь к файлу базы SQLite (используется только при создании)
+
+    Returns:
+        ImageCatalog: Экземпляр каталога
+    """
+    global _image_catalog
+    with _image_catalog_lock:
+        if _image_catalog is None:
+            _image_catalog = ImageCatalog(db_path)
+        return _image_catalog
@@ -0,0 +1,491 @@
+"""
+Индекс изображений: однократный обход папок с изображениями и поиск по артикулу за O(1)
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+from typing import List, Dict, Optional, Tuple, Any
+
+from . import image_utils
+from . import tree_scanner
+from . import fuzzy_index
+
+logger = logging.getLogger(__name__)
+
+# Расширения файлов, которые считаются изображениями
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp')
+
+# Названия уровней приоритета папок (в порядке убывания приоритета)
+TIER_NAMES = ("primary", "secondary", "tertiary")
+
+
+def get_tier_name(tier: int) -> str:
+    """
+    Возвращает название уровня приоритета папки по его номеру.
+
+    Args:
+        tier (int): Номер уровня (0 - основная папка)
+
+    Returns:
+        str: Название уровня ("primary", "secondary", ...)
+    """
+    if 0 <= tier < len(TIER_NAMES):
+        return TIER_NAMES[tier]
+    return f"tier_{tier + 1}"
+
+
+class ImageIndex:
+    """
+    Индекс изображений для набора папок с разным приоритетом.
+
+    Каждая папка обходится один раз при построении индекса. Индекс хранит словарь
+    "нормализованный артикул -> список (уровень, путь)", упорядоченный по приоритету
+    папок, поэтому поиск по артикулу не требует обращения к файловой системе.
+    Промах обходится так же дешево, как попадание (одно обращение к словарю), поэтому быстрый
+    отказ (см. lookup_cache) нужен только поиску по каталогу (ImageCatalog.lookup).
+    """
+
+    def __init__(self, folders: List[Optional[str]],
+                 supported_extensions: Tuple[str, ...] = SUPPORTED_EXTENSIONS,
+                 recursive: bool = True,
+                 catalog: Optional[Any] = None,
+                 kind: Optional[str] = None,
+                 scanner: Optional[tree_scanner.ParallelTreeScanner] = None):
+        """
+        Инициализирует индекс (без обхода папок, см. build()).
+
+        Args:
+            folders (List[Optional[str]]): Папки в порядке приоритета. Пустые значения допускаются,
+                номер уровня соответствует позиции папки в списке
+            supported_extensions (Tuple[str, ...]): Расширения файлов изображений
+            recursive (bool): Искать ли изображения в подпапках
+            catalog (Optional[ImageCatalog]): Постоянный каталог изображений. Если указан, индекс
+                строится из каталога после его инкрементального обновления, а не обходом папок
+            kind (Optional[str]): Тип папок ("product" или "package") для записи в каталог
+            scanner (Optional[ParallelTreeScanner]): Сканер для обхода папок без каталога.
+                По умолчанию создается с текущими настройками "scan_settings.*"
+        """
+        self.folders = list(folders)
+        self.supported_extensions = tuple(ext.lower() for ext in supported_extensions)
+        self.recursive = recursive
+        self.catalog = catalog
+        self.kind = kind
+        self.scanner = scanner
+        self._entries: Dict[str, List[Tuple[int, str]]] = {}
+        self._lock = threading.RLock()
+        # Индекс нечеткого поиска строится при первом запросе подсказок (см. get_fuzzy_index)
+        self._fuzzy: Optional[fuzzy_index.FuzzyIndex] = None
+        self._fuzzy_lock = threading.Lock()
+        self.is_built = False
+        self.stats = {
+            "build_time_sec": 0.0,
+            "folders_indexed": 0,
+            "files_indexed": 0,
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "events_applied": 0,
+        }
+
+    def build(self) -> 'ImageIndex':
+        """
+        Обходит все папки один раз и строит индекс.
+
+        Returns:
+            ImageIndex: Этот же индекс (для цепочки вызовов)
+        """
+        start_time = time.perf_counter()
+        entries: Dict[str, List[Tuple[int, str]]] = {}
+        folders_indexed = 0
+        files_indexed = 0
+
+        for tier in range(len(self.folders)):
+            scanned = self._collect_tier(tier)
+            if scanned is None:
+                continue
+
+            for normalized_name, path in scanned:
+                entries.setdefault(normalized_name, []).append((tier, path))
+                files_indexed += 1
+            folders_indexed += 1
+
+        with self._lock:
+            self._entries = entries
+            self._fuzzy = None
+            self.is_built = True
+        self.stats["build_time_sec"] = time.perf_counter() - start_time
+        self.stats["folders_indexed"] = folders_indexed
+        self.stats["files_indexed"] = files_indexed
+        logger.info(f"Индекс изображений построен за {self.stats['build_time_sec']:.2f} сек: "
+                    f"папок {folders_indexed}, файлов {files_indexed}, артикулов {len(entries)}")
+        return self
+
+    def _collect_tier(self, tier: int) -> Optional[List[Tuple[str, str]]]:
+        """
+        Собирает изображения одной папки: из каталога (если он задан) или обходом папки.
+
+        Args:
+            tier (int): Уровень папки (позиция в списке папок)
+
+        Returns:
+            Optional[List[Tuple[str, str]]]: Пары (нормализованное имя, путь) или None, если папка недоступна
+        """
+        folder = self.folders[tier]
+        if not folder:
+            return None
+        if not os.path.exists(folder):
+            logger.warning(f"Папка с изображениями не существует или недоступна: {folder}")
+            return None
+
+        if self.catalog is not None:
+            self.catalog.refresh(folder, self.kind, tier)
+            return [(normalized_name, path)
+                    for normalized_name, path in self.catalog.load_entries(folder, self.recursive)
+                    if self._is_supported(path)]
+        return self._scan_folder(folder)
+
+    def _is_supported(self, path: str) -> bool:
+        """
+        Проверяет расширение файла по списку поддерживаемых расширений индекса.
+        """
+        return os.path.splitext(path)[1].lower() in self.supported_extensions
+
+    def _scan_folder(self, folder: str) -> List[Tuple[str, str]]:
+        """
+        Обходит папку и возвращает пары (нормализованное имя файла, путь) для всех изображений.
+        Подпапки читаются параллельно (см. ParallelTreeScanner).
+
+        Args:
+            folder (str): Путь к папке
+
+        Returns:
+            List[Tuple[str, str]]: Найденные изображения, упорядоченные по пути
+        """
+        if self.recursive:
+            scanner = self.scanner or tree_scanner.get_configured_scanner()
+            listings = scanner.scan(folder, self.supported_extensions)
+        else:
+            listings = [tree_scanner.list_directory(folder, self.supported_extensions)]
+
+        files = [file_entry for listing in listings for file_entry in listing.files]
+        normalized_names = image_utils.normalize_articles(
+            (os.path.splitext(file_entry.name)[0] for file_entry in files), for_excel=False)
+        result = [(normalized_name, file_entry.path)
+                  for normalized_name, file_entry in zip(normalized_names, files) if normalized_name]
+        result.sort(key=lambda item: item[1])
+        return result
+
+    def get_candidates(self, article: Any) -> List[Tuple[int, str]]:
+        """
+        Возвращает все найденные изображения для артикула из Excel.
+
+        Args:
+            article (Any): Артикул в исходном виде (нормализуется как данные из Excel)
+
+        Returns:
+            List[Tuple[int, str]]: Пары (уровень, путь), упорядоченные по приоритету папок
+        """
+        return self.get_candidates_normalized(image_utils.normalize_article(article, for_excel=True))
+
+    def get_candidates_normalized(self, normalized_article: str) -> List[Tuple[int, str]]:
+        """
+        Возвращает все найденные изображения для уже нормализованного артикула
+        (см. image_utils.normalize_articles для пакетной нормализации).
+
+        Args:
+            normalized_article (str): Артикул, нормализованный как данные из Excel
+
+        Returns:
+            List[Tuple[int, str]]: Пары (уровень, путь), упорядоченные по приоритету папок
+        """
+        if not self.is_built:
+            self.build()
+
+        with self._lock:
+            candidates = list(self._entries.get(normalized_article, [])) if normalized_article else []
+
+            self.stats["lookups"] += 1
+            if candidates:
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+        return candidates
+
+    def find_first(self, article: Any) -> Optional[str]:
+        """
+        Возвращает первое найденное изображение с учетом приоритета папок.
+
+        Args:
+            article (Any): Артикул из Excel
+
+        Returns:
+            Optional[str]: Путь к изображению или None
+        """
+        candidates = self.get_candidates(article)
+        return candidates[0][1] if candidates else None
+
+    def find_in_best_tier(self, article: Any) -> Tuple[Optional[int], List[str]]:
+        """
+        Возвращает все изображения артикула из папки с наивысшим приоритетом, где они найдены.
+
+        Args:
+            article (Any): Артикул из Excel
+
+        Returns:
+            Tuple[Optional[int], List[str]]: Уровень папки (или None) и отсортированный список путей
+        """
+        candidates = self.get_candidates(article)
+        if not candidates:
+            return None, []
+        best_tier = candidates[0][0]
+        return best_tier, sorted(path for tier, path in candidates if tier == best_tier)
+
+    def get_fuzzy_index(self) -> fuzzy_index.FuzzyIndex:
+        """
+        Возвращает индекс нечеткого поиска по нормализованным именам файлов, строя его при
+        первом обращении. Далее он обновляется вместе с индексом по событиям файловой системы.
+
+        Returns:
+            FuzzyIndex: Индекс нечеткого поиска
+        """
+        if not self.is_built:
+            self.build()
+        with self._fuzzy_lock:
+            if self._fuzzy is None:
+                start_time = time.perf_counter()
+                with self._lock:
+                    names = list(self._entries)
+                fuzzy = fuzzy_index.FuzzyIndex(names)
+                with self._lock:
+                    # Изменения, примененные во время построения, переносятся в новый индекс
+                    for name in set(names) - self._entries.keys():
+                        fuzzy.discard(name)
+                    for name in self._entries.keys() - set(names):
+                        fuzzy.add(name)
+                    self._fuzzy = fuzzy
+                logger.info(f"Индекс нечеткого поиска построен за {time.perf_counter() - start_time:.2f} сек: "
+                            f"имен {len(fuzzy)}")
+            return self._fuzzy
+
+    def suggest(self, article: Any, limit: int = fuzzy_index.DEFAULT_SUGGESTIONS_LIMIT) -> List[str]:
+        """
+        Подбирает изображения с похожими именами для ненайденного артикула.
+
+        Args:
+            article (Any): Артикул из Excel
+            limit (int): Максимальное количество подсказок
+
+        Returns:
+            List[str]: Пути к изображениям (по одному на имя), от самых похожих к менее похожим
+        """
+        normalized_article = image_utils.normalize_article(article, for_excel=True)
+        matches = self.get_fuzzy_index().search(normalized_article, limit=limit)
+        suggestions = []
+        with self._lock:
+            for _, name in matches:
+                candidates = self._entries.get(name)
+                if candidates:
+                    suggestions.append(candidates[0][1])
+        return suggestions
+
+    def _tiers_for_path(self, path: str) -> List[int]:
+        """
+        Определяет уровни папок, внутри которых находится путь.
+
+        Args:
+            path (str): Путь к файлу или папке
+
+        Returns:
+            List[int]: Номера уровней
+        """
+        tiers = []
+        for tier, folder in enumerate(self.folders):
+            if not folder:
+                continue
+            folder_prefix = os.path.join(folder, '')
+            if path.startswith(folder_prefix) and (self.recursive or os.path.dirname(path) == folder.rstrip('\\/')):
+                tiers.append(tier)
+        return tiers
+
+    def add_path(self, path: str) -> bool:
+        """
+        Добавляет файл изображения в индекс (например, по событию файловой системы).
+
+        Args:
+            path (str): Путь к файлу
+
+        Returns:
+            bool: True, если индекс изменился
+        """
+        if not self._is_supported(path):
+            return False
+        normalized_name = image_utils.normalize_article(os.path.splitext(os.path.basename(path))[0], for_excel=False)
+        if not normalized_name:
+            return False
+
+        changed = False
+        with self._lock:
+            for tier in self._tiers_for_path(path):
+                candidates = self._entries.setdefault(normalized_name, [])
+                if (tier, path) in candidates:
+                    continue
+                if not candidates and self._fuzzy is not None:
+                    self._fuzzy.add(normalized_name)
+                # Вставляем после всех путей того же уровня, сохраняя порядок приоритета папок
+                position = bisect.bisect_right([candidate_tier for candidate_tier, _ in candidates], tier)
+                candidates.insert(position, (tier, path))
+                changed = True
+            if changed:
+                self.stats["files_indexed"] += 1
+                self.stats["events_applied"] += 1
+        return changed
+
+    def remove_path(self, path: str) -> bool:
+        """
+        Удаляет файл изображения из индекса.
+
+        Args:
+            path (str): Путь к файлу
+
+        Returns:
+            bool: True, если индекс изменился
+        """
+        normalized_name = image_utils.normalize_article(os.path.splitext(os.path.basename(path))[0], for_excel=False)
+        with self._lock:
+            candidates = self._entries.get(normalized_name)
+            if not candidates:
+                return False
+            remaining = [candidate for candidate in candidates if candidate[1] != path]
+            if len(remaining) == len(candidates):
+                return False
+            if remaining:
+                self._entries[normalized_name] = remaining
+            else:
+                del self._entries[normalized_name]
+                if self._fuzzy is not None:
+                    self._fuzzy.discard(normalized_name)
+            self.stats["files_indexed"] -= 1
+            self.stats["events_applied"] += 1
+        return True
+
+    def add_tree(self, dir_path: str) -> int:
+        """
+        Добавляет в индекс все изображения папки (например, после ее создания или переноса).
+
+        Args:
+            dir_path (str): Путь к папке
+
+        Returns:
+            int: Количество добавленных файлов
+        """
+        added = 0
+        for _, path in self._scan_folder(dir_path):
+            if self.add_path(path):
+                added += 1
+        return added
+
+    def remove_tree(self, dir_path: str) -> int:
+        """
+        Удаляет из индекса все изображения внутри папки.
+
+        Args:
+            dir_path (str): Путь к папке
+
+        Returns:
+            int: Количество удаленных файлов
+        """
+        prefix = os.path.join(dir_path, '')
+        removed = 0
+        with self._lock:
+            for normalized_name in list(self._entries):
+                candidates = self._entries[normalized_name]
+                remaining = [candidate for candidate in candidates if not candidate[1].startswith(prefix)]
+                if len(remaining) != len(candidates):
+                    removed += len(candidates) - len(remaining)
+                    if remaining:
+                        self._entries[normalized_name] = remaining
+                    else:
+                        del self._entries[normalized_name]
+                        if self._fuzzy is not None:
+                            self._fuzzy.discard(normalized_name)
+            self.stats["files_indexed"] -= removed
+            self.stats["events_applied"] += removed
+        return removed
+
+    def refresh_tier(self, tier: int) -> int:
+        """
+        Перечитывает одну папку (через каталог, если он задан) и заменяет ее записи в индексе.
+
+        Args:
+            tier (int): Уровень папки
+
+        Returns:
+            int: Количество добавленных и удаленных путей
+        """
+        scanned = self._collect_tier(tier)
+        if scanned is None:
+            return 0
+        new_paths = {path: normalized_name for normalized_name, path in scanned}
+
+        with self._lock:
+            old_paths = {}
+            for normalized_name, candidates in self._entries.items():
+                for candidate_tier, path in candidates:
+                    if candidate_tier == tier:
+                        old_paths[path] = normalized_name
+
+            removed = [path for path in old_paths if path not in new_paths]
+            added = [path for path in new_paths if path not in old_paths]
+            if not removed and not added:
+                return 0
+
+            for path in removed:
+                normalized_name = old_paths[path]
+                remaining = [candidate for candidate in self._entries[normalized_name] if candidate != (tier, path)]
+                if remaining:
+                    self._entries[normalized_name] = remaining
+                else:
+                    del self._entries[normalized_name]
+                    if self._fuzzy is not None:
+                        self._fuzzy.discard(normalized_name)
+            for path in added:
+                candidates = self._entries.setdefault(new_paths[path], [])
+                if not candidates and self._fuzzy is not None:
+                    self._fuzzy.add(new_paths[path])
+                position = bisect.bisect_right([candidate_tier for candidate_tier, _ in candidates], tier)
+                candidates.insert(position, (tier, path))
+
+            changes = len(removed) + len(added)
+            self.stats["files_indexed"] += len(added) - len(removed)
+            self.stats["events_applied"] += changes
+        return changes
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику построения индекса и поиска.
+
+        Returns:
+            Dict[str, Any]: Копия словаря статистики
+        """
+        return dict(self.stats)
+
+    def format_stats(self, baseline: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Возвращает статистику индекса в виде строки для лога.
+
+        Args:
+            baseline (Optional[Dict[str, Any]]): Ранее снятая статистика (get_stats()). Если указана,
+                счетчики запросов выводятся как разница с ней (статистика одного запуска для общего индекса)
+
+        Returns:
+            str: Строка со статистикой
+        """
+        baseline = baseline or {}
+        lookups = self.stats['lookups'] - baseline.get('lookups', 0)
+        hits = self.stats['hits'] - baseline.get('hits', 0)
+        misses = self.stats['misses'] - baseline.get('misses', 0)
+        return (f"построение {self.stats['build_time_sec']:.2f} сек, файлов {self.stats['files_indexed']}, "
+                f"запросов {lookups}, найдено {hits}, не найдено {misses}, "
+                f"применено изменений {self.stats['events_applied']}")
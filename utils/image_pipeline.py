@@ -0,0 +1,222 @@
+"""
+Конвейер подготовки изображений: оптимизация изображений следующих строк в пуле процессов,
+пока текущая строка выводится в PDF
+"""
+import os
+import logging
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Iterable, Iterator, Sequence
+
+from . import image_utils
+from . import image_cache
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество процессов при автоматическом выборе (0 в настройках)
+MAX_AUTO_WORKERS = 8
+
+# Окно опережения по умолчанию - столько строк на каждый процесс
+DEFAULT_LOOKAHEAD_PER_WORKER = 2
+
+
+def get_configured_workers() -> int:
+    """
+    Возвращает количество процессов оптимизации из настройки "image_settings.pipeline_workers".
+    0 - по количеству ядер без одного (ядро остается для вывода PDF), но не больше MAX_AUTO_WORKERS.
+
+    Returns:
+        int: Количество процессов; 1 - оптимизация в текущем процессе
+    """
+    from . import config_manager
+
+    workers = config_manager.get_non_negative_int_setting("image_settings.pipeline_workers", 0)
+    if workers:
+        return workers
+    return max(1, min(MAX_AUTO_WORKERS, (os.cpu_count() or 1) - 1))
+
+
+def get_configured_lookahead(workers: int) -> int:
+    """
+    Возвращает окно опережения в строках из настройки "image_settings.pipeline_lookahead".
+    0 - DEFAULT_LOOKAHEAD_PER_WORKER строк на процесс.
+    """
+    from . import config_manager
+
+    return (config_manager.get_non_negative_int_setting("image_settings.pipeline_lookahead", 0)
+            or workers * DEFAULT_LOOKAHEAD_PER_WORKER)
+
+
+# Копия оптимизатора запуска в процессе пула (см. _init_worker)
+_worker_optimizer: Optional[image_utils.ImageOptimizer] = None
+
+
+def _init_worker(optimizer: image_utils.ImageOptimizer) -> None:
+    """
+    Инициализация процесса пула: копия оптимизатора передается один раз и далее
+    ведет собственное состояние подбора качества.
+    """
+    global _worker_optimizer
+    _worker_optimizer = optimizer
+
+
+def _optimize_image_bytes(image_path: str, target_size_kb: float, max_width: Optional[int],
+                          max_height: Optional[int]) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Задание для процесса пула: оптимизирует изображение и возвращает байты JPEG
+    и статистику вызова для оптимизатора основного процесса.
+    """
+    optimizer = _worker_optimizer or image_utils.ImageOptimizer()
+    buffer, call_stats = optimizer.encode(image_path, target_size_kb=target_size_kb,
+                                          max_width=max_width, max_height=max_height)
+    return buffer.getvalue(), call_stats
+
+
+def _completed_future(data: bytes) -> Future:
+    future = Future()
+    future.set_result(data)
+    return future
+
+
+def _forward_result(result: Future, optimizer: image_utils.ImageOptimizer,
+                    cache: Optional[image_cache.ImageCache], key: Optional[str]):
+    """
+    Возвращает обработчик завершения задания пула: статистика добавляется в оптимизатор,
+    результат сохраняется в кэш и передается в result в виде байтов JPEG.
+    """
+    def callback(job: Future) -> None:
+        if not result.set_running_or_notify_cancel():
+            return
+        try:
+            data, call_stats = job.result()
+        except BaseException as e:
+            result.set_exception(e)
+            return
+        optimizer.record(call_stats)
+        # Исходные JPEG, переданные без перекодирования, в кэш не копируются
+        if cache is not None and key is not None and not call_stats.get("passthrough"):
+            cache.put(key, data)
+        result.set_result(data)
+    return callback
+
+
+def prepare_images_ahead(rows: Iterable[Sequence[Optional[str]]], target_size_kb: float,
+                         max_width: Optional[int] = None, max_height: Optional[int] = None,
+                         cache: Optional[image_cache.ImageCache] = None,
+                         targets_kb: Optional[Dict[str, float]] = None,
+                         optimizer: Optional[image_utils.ImageOptimizer] = None,
+                         workers: Optional[int] = None,
+                         lookahead: Optional[int] = None,
+                         renditions=None) -> Iterator[List[Optional[Future]]]:
+    """
+    Оптимизирует изображения строк с опережением и выдает результаты в порядке строк.
+
+    Задания для следующих lookahead строк отправляются в ProcessPoolExecutor заранее, поэтому
+    декодирование, уменьшение и кодирование JPEG идут на всех ядрах, пока вызывающий код выводит
+    текущую строку. В памяти одновременно находятся результаты не более чем lookahead строк.
+    Изображения из дискового кэша и готовые копии (см. renditions) не отправляются в пул,
+    результаты пула сохраняются в кэш.
+
+    Пул закрывается, когда генератор исчерпан или закрыт (close()).
+
+    Args:
+        rows (Iterable[Sequence[Optional[str]]]): Пути к изображениям каждой строки (None - изображения нет)
+        target_size_kb (float): Целевой размер одного изображения в КБ
+        max_width (Optional[int]): Максимальная ширина в пикселях
+        max_height (Optional[int]): Максимальная высота в пикселях
+        cache (Optional[ImageCache]): Дисковый кэш оптимизированных изображений
+        targets_kb (Optional[Dict[str, float]]): Целевые размеры отдельных изображений (путь -> КБ),
+            например из плана размера PDF (см. budget_planner); для остальных - target_size_kb
+        optimizer (Optional[ImageOptimizer]): Оптимизатор запуска. Процессы пула получают его копию
+            при запуске, статистика их заданий добавляется в него. None - новый оптимизатор
+        workers (Optional[int]): Количество процессов. None - из настроек (см. get_configured_workers);
+            1 - оптимизация в текущем процессе при получении строки
+        lookahead (Optional[int]): Окно опережения в строках. None - из настроек
+        renditions (Optional[RenditionStore]): Заранее рассчитанные копии изображений
+            (см. renditions.precompute_renditions); используется ступень, не превышающая целевой размер
+
+    Yields:
+        List[Optional[Future]]: Для каждого пути строки - Future с байтами JPEG (result() возбуждает
+            исключение, если оптимизация не удалась) или None, если пути нет
+    """
+    optimizer = optimizer or image_utils.ImageOptimizer()
+    workers = workers if workers is not None else get_configured_workers()
+    lookahead = max(1, lookahead if lookahead is not None else get_configured_lookahead(workers))
+
+    executor = None
+    if workers > 1:
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(optimizer,))
+        except (OSError, NotImplementedError, ValueError) as e:
+            logger.warning(f"Не удалось запустить пул процессов для изображений: {e}. Оптимизация в текущем процессе")
+
+    def submit(image_path: Optional[str]) -> Optional[Future]:
+        if not image_path:
+            return None
+        image_target_kb = targets_kb.get(image_path, target_size_kb) if targets_kb else target_size_kb
+        if renditions is not None:
+            data = renditions.lookup(image_path, image_target_kb)
+            if data is not None:
+                return _completed_future(data)
+        key = None
+        if cache is not None:
+            key = image_cache.make_optimize_key(cache, image_path, image_target_kb, max_width, max_height, optimizer)
+            data = cache.get(key) if key is not None else None
+            if data is not None:
+                return _completed_future(data)
+        if executor is None:
+            # Без пула изображение оптимизируется при получении строки (окно не заполняется заранее)
+            return _LazyFuture(image_path, image_target_kb, max_width, max_height, optimizer, cache, key)
+        job = executor.submit(_optimize_image_bytes, image_path, image_target_kb, max_width, max_height)
+        future = Future()
+        job.add_done_callback(_forward_result(future, optimizer, cache, key))
+        return future
+
+    pending = deque()
+    rows_iter = iter(rows)
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < (lookahead if executor is not None else 1):
+                row = next(rows_iter, None)
+                if row is None:
+                    exhausted = True
+                    break
+                pending.append([submit(image_path) for image_path in row])
+            if not pending:
+                break
+            yield pending.popleft()
+    finally:
+        for futures in pending:
+            for future in futures:
+                if future is not None:
+                    future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _LazyFuture:
+    """
+    Результат оптимизации в текущем процессе: изображение обрабатывается при первом вызове result().
+    """
+
+    def __init__(self, image_path: str, target_size_kb: float, max_width: Optional[int],
+                 max_height: Optional[int], optimizer: image_utils.ImageOptimizer,
+                 cache: Optional[image_cache.ImageCache], key: Optional[str]):
+        self._args = (image_path, target_size_kb, max_width, max_height)
+        self._optimizer = optimizer
+        self._cache = cache
+        self._key = key
+        self._result: Optional[bytes] = None
+
+    def result(self) -> bytes:
+        if self._result is None:
+            buffer, call_stats = self._optimizer.encode(*self._args)
+            self._optimizer.record(call_stats)
+            self._result = buffer.getvalue()
+            if self._cache is not None and self._key is not None and not call_stats.get("passthrough"):
+                self._cache.put(self._key, self._result)
+        return self._result
+
+    def cancel(self) -> bool:
+        return True
@@ -6,17 +6,128 @@ import re
 import io
 import logging
 import math
+import time
+import threading
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple, Any, Union, Set
+from typing import List, Dict, Optional, Tuple, Any, Union, Set, Iterable, Iterator
 import sys
 import tempfile
 
+import numpy as np
+import pandas as pd
 from PIL import Image as PILImage
 
 logger = logging.getLogger(__name__)
 
-# Глобальный кэш для хранения оптимального качества сжатия
-cached_quality = None
+# Подбор качества JPEG (см. ImageOptimizer)
+MAX_JPEG_QUALITY = 100
+MIN_JPEG_QUALITY = 1
+MAX_QUALITY_SEARCH_ENCODES = 7   # Максимальное количество кодирований полного изображения
+QUALITY_SEARCH_SIZE_TOLERANCE = 0.05  # Результат не дальше 5% от целевого размера не уточняется
+PROBE_MAX_SIDE = 256             # Длинная сторона уменьшенной копии для предсказания качества
+PROBE_QUALITY_LOW = 40           # Качества кодирования уменьшенной копии
+PROBE_QUALITY_HIGH = 85
+SAMPLE_GRID = 8                  # Мозаика фрагментов для формы кривой размера (см. ImageOptimizer.measure)
+SAMPLE_TILE_SIZE = 32            # Сторона фрагмента мозаики, кратная блоку JPEG 16x16
+
+# Уменьшение изображений до размера, в котором они будут показаны или напечатаны
+MM_PER_INCH = 25.4
+DEFAULT_PRINT_DPI = 300          # Разрешение печати карточек PDF по умолчанию
+RESIZE_REDUCING_GAP = 2.0        # Сначала Image.reduce в целое число раз, затем точное уменьшение LANCZOS
+DEFAULT_MAX_DECODE_PIXELS = 150_000_000  # Лимит пикселей изображения, декодируемого целиком (около 450 МБ в RGB)
+BAND_DECODE_BYTES = 8 * 1024 * 1024      # Размер полосы строк при декодировании несжатого TIFF полосами
+
+# Выбор кодирования по содержимому (см. classify_image_content)
+CONTENT_PHOTO = "photo"              # JPEG RGB
+CONTENT_GRAYSCALE = "grayscale"      # JPEG в оттенках серого
+CONTENT_LINE_ART = "line_art"        # PNG с палитрой (в PDF - Indexed/FlateDecode)
+CONTENT_CLASSES = (CONTENT_PHOTO, CONTENT_GRAYSCALE, CONTENT_LINE_ART)
+PALETTE_MAX_COLORS = 256
+LINE_ART_COLOR_COVERAGE = 0.98       # Доля пикселей, которую покрывают PALETTE_MAX_COLORS самых частых цветов
+LINE_ART_MAX_EDGE_DENSITY = 0.2      # Доля пикселей с перепадом яркости больше CONTENT_EDGE_THRESHOLD
+CONTENT_EDGE_THRESHOLD = 24
+GRAYSCALE_MAX_CHANNEL_DIFF = 8       # 99-й процентиль разницы между каналами пикселя
+GRAYSCALE_MIN_CHANNEL_CORRELATION = 0.99
+CLASSIFY_MAX_PIXELS = 512 * 512      # Большие изображения анализируются с прореживанием
+
+# Символы, которые заменяются дефисом при нормализации артикулов.
+# \w в Unicode-режиме совпадает ровно с символами, для которых str.isalnum() истинно, и с '_'
+_EXCEL_SPECIAL_CHARS_PATTERN = re.compile(r'[^\w ]|_')  # Для Excel: все, кроме букв, цифр и пробелов
+_FILE_SPECIAL_CHARS_PATTERN = re.compile(r'[^\w ]')     # Для файлов: дополнительно сохраняется '_'
+
+# Пакетная нормализация склеивает строки через разделитель и обрабатывает их одной операцией
+_BATCH_SEPARATOR = '\x00'
+_EXCEL_SPECIAL_CHARS_BATCH_PATTERN = re.compile(r'[^\w \x00]|_')
+_FILE_SPECIAL_CHARS_BATCH_PATTERN = re.compile(r'[^\w \x00]')
+
+def _build_ascii_table(keep: str) -> bytes:
+    """Таблица bytes.translate для ASCII: замена спецсимволов на '-' и приведение к нижнему регистру"""
+    table = bytearray(256)
+    for code in range(256):
+        char = chr(code)
+        if code < 128 and (char.isalnum() or char in keep):
+            table[code] = ord(char.lower())
+        else:
+            table[code] = ord('-')
+    return bytes(table)
+
+_EXCEL_ASCII_TABLE = _build_ascii_table(' ' + _BATCH_SEPARATOR)
+_FILE_ASCII_TABLE = _build_ascii_table(' _' + _BATCH_SEPARATOR)
+
+def _get_special_chars_pattern(for_excel: bool):
+    """Возвращает регулярное выражение заменяемых символов для выбранного режима нормализации"""
+    return _EXCEL_SPECIAL_CHARS_PATTERN if for_excel else _FILE_SPECIAL_CHARS_PATTERN
+
+def normalize_articles(articles: Iterable[Any], for_excel: bool = False) -> List[str]:
+    """
+    Нормализует набор артикулов или имен файлов за один проход.
+    Правила такие же, как у normalize_article. Значения склеиваются в одну строку и обрабатываются
+    одной операцией: для ASCII - предвычисленной таблицей bytes.translate (замена и нижний регистр
+    сразу), для остальных строк - одним вызовом предкомпилированного регулярного выражения.
+    
+    Args:
+        articles (Iterable[Any]): Артикулы или имена файлов (без расширения)
+        for_excel (bool): Флаг, указывающий что это данные из Excel (True) или имена файлов изображений (False)
+        
+    Returns:
+        List[str]: Нормализованные значения в исходном порядке
+    """
+    stripped = ["" if article is None else (article if type(article) is str else str(article)).strip()
+                for article in articles]
+    if not stripped:
+        return []
+
+    joined = _BATCH_SEPARATOR.join(stripped)
+    if joined.count(_BATCH_SEPARATOR) != len(stripped) - 1:
+        # Разделитель встречается в самих значениях - обрабатываем их по одному
+        substitute = _get_special_chars_pattern(for_excel).sub
+        return [substitute('-', article_str).lower() for article_str in stripped]
+
+    if joined.isascii():
+        table = _EXCEL_ASCII_TABLE if for_excel else _FILE_ASCII_TABLE
+        normalized = joined.encode('ascii').translate(table).decode('ascii')
+    else:
+        pattern = _EXCEL_SPECIAL_CHARS_BATCH_PATTERN if for_excel else _FILE_SPECIAL_CHARS_BATCH_PATTERN
+        normalized = pattern.sub('-', joined).lower()
+    return normalized.split(_BATCH_SEPARATOR)
+
+def normalize_article_series(articles: pd.Series, for_excel: bool = True) -> pd.Series:
+    """
+    Нормализует целый столбец DataFrame за один вызов.
+    
+    Строковые методы pandas (.str.replace) для строк на базе pyarrow используют RE2, где \w
+    совпадает только с ASCII, поэтому замена выполняется тем же регулярным выражением Python,
+    что и в normalize_articles: результат для кириллицы и других алфавитов не меняется.
+    
+    Args:
+        articles (pd.Series): Столбец с артикулами
+        for_excel (bool): Флаг, указывающий что это данные из Excel (True) или имена файлов изображений (False)
+        
+    Returns:
+        pd.Series: Нормализованные артикулы с тем же индексом
+    """
+    return pd.Series(normalize_articles(articles.tolist(), for_excel=for_excel),
+                     index=articles.index, dtype=object)
 
 def normalize_article(article: Any, for_excel: bool = False) -> str:
     """
@@ -26,6 +137,8 @@ def normalize_article(article: Any, for_excel: bool = False) -> str:
     - for_excel=True: Входные данные из Excel - заменяет все спецсимволы, кроме пробелов, на дефисы.
     - for_excel=False: Имена файлов изображений - заменяет все спецсимволы, кроме пробелов и нижнего подчеркивания, на дефисы.
     
+    Для большого количества значений используйте normalize_articles или normalize_article_series.
+    
     Args:
         article (Any): Артикул в любом формате
         for_excel (bool): Флаг, указывающий что это данные из Excel (True) или имя файла изображения (False)
@@ -35,133 +148,913 @@ def normalize_article(article: Any, for_excel: bool = False) -> str:
     """
     if article is None:
         return ""
-        
-    # Преобразуем в строку и удаляем пробелы в начале и конце
-    article_str = str(article).strip()
-    
-    # Если строка пустая, возвращаем пустую строку
-    if not article_str:
-        return ""
-    
-    if for_excel:
-        # Для данных из Excel: заменяем все спецсимволы (кроме пробелов) на дефисы
-        # Сохраняем буквы, цифры и пробелы, остальное заменяем на дефисы
-        normalized = ''
-        for char in article_str:
-            if char.isalnum() or char == ' ':
-                normalized += char
-            else:
-                normalized += '-'
-        # Приводим к нижнему регистру
-        normalized = normalized.lower()
+    # Та же замена по предкомпилированному выражению, что и в normalize_articles
+    return _get_special_chars_pattern(for_excel).sub('-', str(article).strip()).lower()
+
+def mm_to_pixels(size_mm: float, dpi: int = DEFAULT_PRINT_DPI) -> int:
+    """
+    Переводит размер на бумаге в пиксели при заданном разрешении печати.
+    """
+    return max(1, int(math.ceil(size_mm / MM_PER_INCH * dpi)))
+
+def _get_image_setting(key: str, default: Any) -> Any:
+    from . import config_manager
+
+    value = config_manager.get_setting_or_default(f"image_settings.{key}", default)
+    return default if value is None else value
+
+def is_resize_enabled() -> bool:
+    """
+    Проверяет настройку "image_settings.resize_enabled": уменьшать ли изображения перед сжатием.
+    """
+    return bool(_get_image_setting("resize_enabled", True))
+
+def get_configured_print_dpi() -> int:
+    """
+    Возвращает разрешение печати карточек PDF из настройки "image_settings.print_dpi".
+    """
+    try:
+        dpi = int(_get_image_setting("print_dpi", DEFAULT_PRINT_DPI))
+    except (TypeError, ValueError):
+        return DEFAULT_PRINT_DPI
+    return dpi if dpi > 0 else DEFAULT_PRINT_DPI
+
+def get_configured_max_size() -> Tuple[Optional[int], Optional[int]]:
+    """
+    Возвращает максимальные размеры изображений для Excel из настроек
+    "image_settings.target_width" и "image_settings.target_height".
+
+    Returns:
+        Tuple[Optional[int], Optional[int]]: Ширина и высота в пикселях; None - без ограничения
+            (в том числе, если уменьшение отключено настройкой "image_settings.resize_enabled")
+    """
+    if not is_resize_enabled():
+        return None, None
+    limits = []
+    for key in ("target_width", "target_height"):
+        try:
+            value = int(_get_image_setting(key, 0))
+        except (TypeError, ValueError):
+            value = 0
+        limits.append(value if value > 0 else None)
+    return limits[0], limits[1]
+
+def fit_size(size: Tuple[int, int], max_width: Optional[int] = None,
+             max_height: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Вычисляет размер изображения, вписанного в ограничения с сохранением пропорций.
+    Изображение никогда не увеличивается.
+
+    Args:
+        size (Tuple[int, int]): Исходные ширина и высота
+        max_width (Optional[int]): Максимальная ширина (None - без ограничения)
+        max_height (Optional[int]): Максимальная высота (None - без ограничения)
+
+    Returns:
+        Tuple[int, int]: Новые ширина и высота
+    """
+    width, height = size
+    scale = 1.0
+    if max_width and width > max_width:
+        scale = min(scale, max_width / width)
+    if max_height and height > max_height:
+        scale = min(scale, max_height / height)
+    if scale >= 1.0:
+        return size
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def exceeds_size(image_path: str, max_width: Optional[int] = None, max_height: Optional[int] = None) -> bool:
+    """
+    Проверяет по заголовку файла, больше ли изображение заданных размеров.
+    """
+    if not max_width and not max_height:
+        return False
+    with PILImage.open(image_path) as img:
+        return fit_size(img.size, max_width, max_height) != img.size
+
+def get_configured_max_decode_pixels() -> int:
+    """
+    Возвращает лимит пикселей изображения, которое декодируется целиком, из настройки
+    "image_settings.max_decode_pixels" (0 - без ограничения).
+    """
+    from . import config_manager
+
+    return config_manager.get_non_negative_int_setting("image_settings.max_decode_pixels", DEFAULT_MAX_DECODE_PIXELS)
+
+def _bitmap_bytes(img: PILImage.Image) -> int:
+    """
+    Размер растра изображения в памяти (Pillow хранит многоканальные пиксели в 4 байтах).
+    """
+    if img.mode in ('1', 'L', 'P'):
+        pixel_bytes = 1
+    elif img.mode.startswith('I;16'):
+        pixel_bytes = 2
     else:
-        # Для имен файлов: заменяем все спецсимволы (кроме пробелов и нижнего подчеркивания) на дефисы
-        # Сохраняем буквы, цифры, пробелы и нижнее подчеркивание
-        normalized = ''
-        for char in article_str:
-            if char.isalnum() or char == ' ' or char == '_':
-                normalized += char
+        pixel_bytes = 4
+    return img.width * img.height * pixel_bytes
+
+def _reduce_factor(size: Tuple[int, int], target_size: Tuple[int, int]) -> int:
+    """
+    Целый коэффициент Image.reduce, после которого остается не меньше RESIZE_REDUCING_GAP
+    целевого размера для точного уменьшения LANCZOS.
+    """
+    return max(1, int(min(size[0] / target_size[0], size[1] / target_size[1]) / RESIZE_REDUCING_GAP))
+
+def _reduce_image(img: PILImage.Image, factor: int) -> PILImage.Image:
+    """
+    Уменьшает изображение в целое число раз усреднением блоков. Прозрачные изображения
+    усредняются с премультипликацией, чтобы цвет прозрачных пикселей не проступал по краям.
+    """
+    if factor <= 1:
+        return img
+    premultiplied = {'RGBA': 'RGBa', 'LA': 'La'}.get(img.mode)
+    if premultiplied:
+        return img.convert(premultiplied).reduce(factor).convert(img.mode)
+    return img.reduce(factor)
+
+def _raw_tiff_strips(img: PILImage.Image) -> Optional[List[Tuple[int, int, int, int]]]:
+    """
+    Возвращает полосы несжатого TIFF (строка начала, строка конца, смещение в файле, байт на строку),
+    если изображение можно декодировать полосами строк, иначе None.
+
+    Несжатые полосы (strips) TIFF лежат в файле как есть, поэтому любой диапазон их строк читается
+    отдельно. Сжатые TIFF Pillow декодирует через libtiff целиком, а PNG - одним потоком zlib.
+    """
+    if img.format != 'TIFF' or not img.tile or getattr(img, 'use_load_libtiff', False):
+        return None
+    try:
+        byte_counts = img.tag_v2.get(279)
+    except AttributeError:
+        return None
+    if not byte_counts or len(byte_counts) != len(img.tile):
+        return None
+    strips = []
+    for tile, byte_count in zip(img.tile, byte_counts):
+        codec, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        x0, y0, x1, y1 = extents
+        # Только полосы на всю ширину со строками сверху вниз (не плитки tiled TIFF)
+        if codec != 'raw' or x0 != 0 or x1 != img.width or y1 <= y0:
+            return None
+        if not isinstance(args, tuple) or len(args) < 3 or args[2] != 1:
+            return None
+        row_bytes, remainder = divmod(byte_count, y1 - y0)
+        if remainder or not row_bytes:
+            return None
+        strips.append((y0, y1, offset, row_bytes))
+    return strips
+
+def _open_tiff_rows(image_path: str, template: PILImage.Image, row_start: int, row_count: int,
+                    offset: int) -> PILImage.Image:
+    """
+    Декодирует строки несжатого TIFF с row_start по row_start + row_count, начинающиеся в файле с offset.
+
+    Размер и плитка открытого файла подменяются через внутренние атрибуты Pillow (_size, _tile_size),
+    поэтому при несовместимой версии Pillow возможны исключения или полоса неверного размера
+    (ValueError); _load_image_for_jpeg в этом случае декодирует изображение целиком.
+    """
+    # Файл открывается объектом, а не по пути: иначе Pillow отображает в память (mmap) весь файл
+    with open(image_path, 'rb') as f:
+        band = PILImage.open(f)
+        tile = template.tile[0]
+        extents = (0, 0, template.width, row_count)
+        band._size = (template.width, row_count)
+        if hasattr(band, '_tile_size'):
+            band._tile_size = band._size  # Размер растра, который создает TiffImageFile.load_prepare
+        band.tile = [tile._replace(extents=extents, offset=offset) if hasattr(tile, '_replace')
+                     else (tile[0], extents, offset, tile[3])]
+        band.load()
+    if band.size != (template.width, row_count):
+        raise ValueError(f"Полоса TIFF декодирована с размером {band.size} вместо {(template.width, row_count)}")
+    return band
+
+def _band_rows(img: PILImage.Image, factor: int) -> int:
+    """
+    Высота полосы строк (кратная factor), при которой полоса в режиме RGBA не больше BAND_DECODE_BYTES.
+    """
+    return max(factor, BAND_DECODE_BYTES // max(1, img.width * 4) // factor * factor)
+
+def _tiff_bands(image_path: str, img: PILImage.Image, strips: List[Tuple[int, int, int, int]],
+                band_rows: int) -> Iterator[PILImage.Image]:
+    """
+    Декодирует несжатый TIFF полосами строк (см. _raw_tiff_strips).
+    """
+    for y0, y1, offset, row_bytes in strips:
+        for row in range(y0, y1, band_rows):
+            yield _open_tiff_rows(image_path, img, row, min(band_rows, y1 - row), offset + (row - y0) * row_bytes)
+
+def _image_bands(img: PILImage.Image, band_rows: int) -> Iterator[PILImage.Image]:
+    """
+    Делит загруженное изображение на полосы строк (копии полос в исходном режиме).
+    """
+    for row in range(0, img.height, band_rows):
+        yield img.crop((0, row, img.width, min(img.height, row + band_rows)))
+
+def _reduce_bands(bands: Iterable[PILImage.Image], size: Tuple[int, int], factor: int,
+                  work_mode: str) -> Tuple[PILImage.Image, int]:
+    """
+    Приводит полосы строк изображения к work_mode и уменьшает их в factor раз усреднением блоков
+    (Image.reduce), собирая уменьшенное изображение. Полный растр в work_mode не создается.
+    Полосы обрабатываются частями, кратными factor, остаток строк переносится в следующую полосу,
+    поэтому результат совпадает с уменьшением всего изображения.
+
+    Returns:
+        Tuple[PILImage.Image, int]: Уменьшенное изображение и пиковый размер растров полос и результата в байтах
+    """
+    reduced = PILImage.new(work_mode, (math.ceil(size[0] / factor), math.ceil(size[1] / factor)))
+    peak = 0
+    carry = None
+    output_row = 0
+
+    def flush(rows: PILImage.Image, final: bool) -> Optional[PILImage.Image]:
+        nonlocal output_row, peak
+        usable = rows.height if final else rows.height // factor * factor
+        if usable:
+            part = _reduce_image(rows.crop((0, 0, rows.width, usable)) if usable < rows.height else rows, factor)
+            reduced.paste(part, (0, output_row))
+            output_row += part.height
+            # Полоса, ее копия при приведении режима или премультипликации и результат
+            peak = max(peak, _bitmap_bytes(rows) * 2 + _bitmap_bytes(reduced))
+        return rows.crop((0, usable, rows.width, rows.height)) if usable < rows.height else None
+
+    for band in bands:
+        if band.mode != work_mode:
+            band = band.convert(work_mode)
+        if carry is not None:
+            joined = PILImage.new(work_mode, (band.width, carry.height + band.height))
+            joined.paste(carry, (0, 0))
+            joined.paste(band, (0, carry.height))
+            band = joined
+        carry = flush(band, final=False)
+    if carry is not None:
+        flush(carry, final=True)
+    return reduced, peak
+
+def _load_image_for_jpeg(image_path: str, max_width: Optional[int] = None,
+                         max_height: Optional[int] = None,
+                         max_decode_pixels: int = DEFAULT_MAX_DECODE_PIXELS) -> Tuple[PILImage.Image, int]:
+    """
+    Открывает изображение, уменьшает его до заданных размеров и приводит к RGB,
+    заменяя прозрачность белым фоном, с ограничением памяти.
+
+    - JPEG сразу декодируется в уменьшенном в 2, 4 или 8 раз виде (Image.draft), поэтому
+      полноразмерный снимок с камеры не распаковывается целиком.
+    - Несжатый TIFF декодируется полосами строк (см. _raw_tiff_strips): в памяти одна полоса.
+      Если декодировать полосами не удалось (см. _open_tiff_rows), изображение декодируется целиком.
+    - Остальные изображения декодируются целиком в исходном режиме, если число пикселей
+      не больше max_decode_pixels (иначе ValueError, 0 - без ограничения).
+    Приведение к RGB и уменьшение в целое число раз выполняются по полосам строк (см. _reduce_bands),
+    поэтому полноразмерные копии в другом режиме не создаются. Оставшееся уменьшение выполняется
+    фильтром LANCZOS, прозрачность заменяется белым фоном уже после уменьшения.
+
+    Returns:
+        Tuple[PILImage.Image, int]: Изображение в режиме RGB и пиковый размер растров в памяти в байтах
+    """
+    img = PILImage.open(image_path)
+    original_size = img.size
+    target_size = fit_size(img.size, max_width, max_height)
+    if target_size != img.size and img.format == 'JPEG':
+        img.draft('L' if img.mode == 'L' else 'RGB', target_size)
+
+    has_transparency = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+    work_mode = 'RGBA' if has_transparency else 'RGB'
+    factor = _reduce_factor(img.size, target_size)
+    band_rows = _band_rows(img, factor)
+    strips = _raw_tiff_strips(img) if target_size != img.size else None
+    if strips is not None:
+        try:
+            reduced, peak = _reduce_bands(_tiff_bands(image_path, img, strips, band_rows), img.size, factor, work_mode)
+        except (AttributeError, TypeError, ValueError, OSError) as e:
+            logger.warning(f"Не удалось декодировать TIFF {image_path} полосами, декодируется целиком: {e}")
+            strips = None
+        else:
+            img = reduced
+    if strips is None:
+        if max_decode_pixels and img.width * img.height > max_decode_pixels:
+            raise ValueError(f"Изображение {img.width}x{img.height} больше лимита декодирования "
+                             f"{max_decode_pixels} пикселей (image_settings.max_decode_pixels)")
+        img.load()
+        peak = _bitmap_bytes(img)
+        if factor > 1 or img.mode != work_mode:
+            reduced, bands_peak = _reduce_bands(_image_bands(img, band_rows), img.size, factor, work_mode)
+            peak += bands_peak
+            img = reduced
+
+    if img.size != target_size:
+        img = img.resize(target_size, PILImage.LANCZOS)
+    if original_size != target_size:
+        print(f"  [optimize_excel] Изображение уменьшено с {original_size[0]}x{original_size[1]} "
+              f"до {target_size[0]}x{target_size[1]}{' полосами' if strips is not None else ''}, "
+              f"пиковая память растра {peak / 1024 / 1024:.1f} МБ", file=sys.stderr)
+
+    if has_transparency:
+        print("  [optimize_excel] Обнаружена прозрачность, заменяем на белый фон.", file=sys.stderr)
+        background = PILImage.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        return background, peak
+    return img, peak
+
+def _prepare_image_for_jpeg(image_path: str, max_width: Optional[int] = None,
+                            max_height: Optional[int] = None,
+                            max_decode_pixels: int = DEFAULT_MAX_DECODE_PIXELS) -> PILImage.Image:
+    """
+    Открывает изображение, уменьшает его до заданных размеров и приводит к RGB,
+    заменяя прозрачность белым фоном (см. _load_image_for_jpeg).
+    """
+    return _load_image_for_jpeg(image_path, max_width, max_height, max_decode_pixels)[0]
+
+def _encode_jpeg(img: PILImage.Image, quality: int) -> io.BytesIO:
+    """
+    Сохраняет изображение в JPEG с указанным качеством в буфер.
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer
+
+def _encode_indexed_png(img: PILImage.Image) -> io.BytesIO:
+    """
+    Сохраняет изображение в PNG с палитрой из PALETTE_MAX_COLORS цветов (без дизеринга) в буфер.
+    """
+    buffer = io.BytesIO()
+    img.quantize(colors=PALETTE_MAX_COLORS, dither=0).save(buffer, format='PNG', compress_level=9)
+    return buffer
+
+def _sample_pixels(img: PILImage.Image) -> np.ndarray:
+    """
+    Возвращает пиксели RGB изображения (int32, прореживание до CLASSIFY_MAX_PIXELS) для статистик.
+    """
+    pixels = np.asarray(img.convert('RGB') if img.mode != 'RGB' else img)
+    step = max(1, math.ceil(math.sqrt(pixels.shape[0] * pixels.shape[1] / CLASSIFY_MAX_PIXELS)))
+    return pixels[::step, ::step].astype(np.int32)
+
+def _is_grayscale_pixels(pixels: np.ndarray) -> bool:
+    channel_diff = np.max(np.abs(pixels - np.roll(pixels, 1, axis=2)), axis=2)
+    if np.percentile(channel_diff, 99) > GRAYSCALE_MAX_CHANNEL_DIFF:
+        return False
+    channels = pixels.reshape(-1, 3).T
+    if channels.std(axis=1).min() == 0:
+        return True
+    return bool(np.corrcoef(channels).min() >= GRAYSCALE_MIN_CHANNEL_CORRELATION)
+
+def is_grayscale_image(img: PILImage.Image) -> bool:
+    """
+    Проверяет, что изображение в оттенках серого: каналы пикселей почти совпадают
+    и сильно коррелируют между собой.
+    """
+    return _is_grayscale_pixels(_sample_pixels(img))
+
+def classify_image_content(img: PILImage.Image) -> str:
+    """
+    Определяет вид содержимого изображения для выбора кодирования по статистикам NumPy.
+
+    - Графика (логотипы, упаковки с заливкой, чертежи): почти все пиксели покрываются палитрой
+      из PALETTE_MAX_COLORS цветов, а перепады яркости редки (большие однородные области).
+      Такие изображения компактнее и четче в PNG с палитрой, чем в JPEG.
+    - Оттенки серого: каналы пикселей почти совпадают и сильно коррелируют между собой.
+      JPEG с одним каналом меньше трехканального при том же качестве.
+    - Фото: все остальное, JPEG RGB.
+
+    Args:
+        img (PILImage.Image): Изображение в режиме RGB (после _prepare_image_for_jpeg)
+
+    Returns:
+        str: CONTENT_LINE_ART, CONTENT_GRAYSCALE или CONTENT_PHOTO
+    """
+    pixels = _sample_pixels(img)
+    if pixels.shape[0] < 2 or pixels.shape[1] < 2:
+        return CONTENT_PHOTO
+
+    # Плотность перепадов яркости между соседними пикселями
+    luma = pixels @ np.array([299, 587, 114], dtype=np.int32) // 1000
+    edges = ((np.abs(np.diff(luma, axis=1))[:-1, :] > CONTENT_EDGE_THRESHOLD) |
+             (np.abs(np.diff(luma, axis=0))[:, :-1] > CONTENT_EDGE_THRESHOLD))
+    edge_density = edges.mean()
+
+    # Доля пикселей, покрытых самыми частыми цветами
+    packed = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+    _, counts = np.unique(packed, return_counts=True)
+    color_coverage = np.sort(counts)[-PALETTE_MAX_COLORS:].sum() / packed.size
+    if color_coverage >= LINE_ART_COLOR_COVERAGE and edge_density <= LINE_ART_MAX_EDGE_DENSITY:
+        return CONTENT_LINE_ART
+
+    return CONTENT_GRAYSCALE if _is_grayscale_pixels(pixels) else CONTENT_PHOTO
+
+def _probe_copy(img: PILImage.Image) -> PILImage.Image:
+    """
+    Уменьшенная копия для оценок размера JPEG (само изображение, если оно не больше PROBE_MAX_SIDE).
+    """
+    scale = PROBE_MAX_SIDE / max(img.size)
+    if scale >= 1:
+        return img
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), PILImage.BILINEAR)
+
+
+def _sample_tiles(img: PILImage.Image) -> PILImage.Image:
+    """
+    Мозаика SAMPLE_GRID x SAMPLE_GRID фрагментов, взятых равномерно по изображению без уменьшения
+    (само изображение, если оно не больше мозаики). В отличие от уменьшенной копии фрагменты
+    сохраняют мелкие детали, от которых зависит рост размера JPEG с качеством.
+    """
+    side = SAMPLE_GRID * SAMPLE_TILE_SIZE
+    if img.width <= side and img.height <= side:
+        return img
+    tile = min(SAMPLE_TILE_SIZE, img.width, img.height)
+    sample = PILImage.new(img.mode, (SAMPLE_GRID * tile, SAMPLE_GRID * tile))
+    for column in range(SAMPLE_GRID):
+        # Начала фрагментов выравниваются по блокам 16x16, как при кодировании полного изображения
+        x = (img.width - tile) * column // (SAMPLE_GRID - 1) // 16 * 16
+        for row in range(SAMPLE_GRID):
+            y = (img.height - tile) * row // (SAMPLE_GRID - 1) // 16 * 16
+            sample.paste(img.crop((x, y, x + tile, y + tile)), (column * tile, row * tile))
+    return sample
+
+
+def estimate_grayscale_saving(img: PILImage.Image, quality: int) -> int:
+    """
+    Оценивает экономию одноканального JPEG относительно JPEG RGB с тем же качеством без полного
+    кодирования в RGB.
+
+    У изображения в оттенках серого каналы цветности пусты, поэтому разница размеров складывается
+    из постоянной части (заголовок, таблицы) и почти одинаковой стоимости каждого блока 16x16.
+    Постоянная часть измеряется на одном блоке, стоимость блоков - на уменьшенной копии
+    и пересчитывается на площадь полного изображения.
+
+    Args:
+        img (PILImage.Image): Изображение в режиме RGB
+        quality (int): Качество JPEG
+
+    Returns:
+        int: Оценка экономии в байтах
+    """
+    def difference(part: PILImage.Image) -> int:
+        return _encode_jpeg(part, quality).tell() - _encode_jpeg(part.convert('L'), quality).tell()
+
+    probe = _probe_copy(img)
+    header = difference(probe.crop((0, 0, min(16, probe.width), min(16, probe.height))))
+    blocks = (difference(probe) - header) * (img.width * img.height) / (probe.width * probe.height)
+    return max(0, round(header + blocks))
+
+
+def estimate_jpeg_size_slope(img: PILImage.Image) -> Optional[float]:
+    """
+    Оценивает, насколько быстро растет размер JPEG изображения с ростом качества,
+    по двум кодированиям уменьшенной копии.
+
+    Логарифм размера JPEG близок к линейной функции качества в рабочей части шкалы,
+    а наклон этой прямой определяется содержимым изображения и мало зависит от разрешения.
+
+    Args:
+        img (PILImage.Image): Изображение в режиме RGB
+
+    Returns:
+        Optional[float]: Приращение натурального логарифма размера на единицу качества
+            или None, если изображение слишком маленькое для пробы
+    """
+    probe = _probe_copy(img)
+    if probe is img:
+        return None
+    size_low = _encode_jpeg(probe, PROBE_QUALITY_LOW).tell()
+    size_high = _encode_jpeg(probe, PROBE_QUALITY_HIGH).tell()
+    if size_high <= size_low:
+        return None
+    return (math.log(size_high) - math.log(size_low)) / (PROBE_QUALITY_HIGH - PROBE_QUALITY_LOW)
+
+class ImageOptimizer:
+    """
+    Подбор качества JPEG для изображений одного запуска обработки.
+
+    Хранит настройки кодирования, состояние запуска (качество последнего изображения - первая
+    проба для следующего) и статистику. Каждая обработка файла создает собственный экземпляр,
+    поэтому одновременные запуски в разных сессиях не влияют друг на друга. Экземпляр можно
+    использовать из нескольких потоков и передавать в процессы пула (pickle): копия в процессе
+    ведет собственное состояние, а статистику ее вызовов можно добавить к исходному экземпляру
+    через record().
+    """
+
+    def __init__(self, min_quality: int = MIN_JPEG_QUALITY, max_quality: int = MAX_JPEG_QUALITY,
+                 max_encodes: int = MAX_QUALITY_SEARCH_ENCODES,
+                 size_tolerance: float = QUALITY_SEARCH_SIZE_TOLERANCE,
+                 use_probe: bool = True,
+                 passthrough_jpeg: bool = True,
+                 choose_encoding: bool = True,
+                 max_decode_pixels: Optional[int] = None):
+        """
+        Args:
+            min_quality (int): Минимальное качество JPEG
+            max_quality (int): Максимальное качество JPEG
+            max_encodes (int): Максимальное количество кодирований полного изображения
+            size_tolerance (float): Результат не дальше этой доли от целевого размера не уточняется
+            use_probe (bool): Оценивать наклон модели размера по уменьшенной копии
+            passthrough_jpeg (bool): Возвращать без изменений исходные JPEG, которые уже
+                укладываются в размер и не больше max_width x max_height
+            choose_encoding (bool): Выбирать кодирование по содержимому (см. classify_image_content):
+                графику сохранять в PNG с палитрой, изображения в оттенках серого - в одноканальный JPEG
+            max_decode_pixels (Optional[int]): Лимит пикселей изображения, декодируемого целиком
+                (0 - без ограничения, None - из настроек, см. get_configured_max_decode_pixels).
+                Читается при создании, поэтому копии экземпляра в процессах пула используют то же значение
+        """
+        self.min_quality = max(1, min(MAX_JPEG_QUALITY, int(min_quality)))
+        self.max_quality = max(self.min_quality, min(MAX_JPEG_QUALITY, int(max_quality)))
+        self.max_encodes = max(1, int(max_encodes))
+        self.size_tolerance = size_tolerance
+        self.use_probe = use_probe
+        self.passthrough_jpeg = passthrough_jpeg
+        self.choose_encoding = choose_encoding
+        self.max_decode_pixels = (get_configured_max_decode_pixels() if max_decode_pixels is None
+                                  else max(0, int(max_decode_pixels)))
+        self.last_quality: Optional[int] = None
+        self.stats = self._empty_stats()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        return {
+            "images": 0,
+            "passthrough": 0,
+            "encodes": 0,
+            "over_budget": 0,
+            "source_bytes": 0,
+            "output_bytes": 0,
+            "peak_bitmap_bytes": 0,  # Наибольший пиковый размер растров при подготовке одного изображения
+            "time_sec": 0.0,
+            # По видам содержимого: количество изображений и экономия относительно JPEG RGB
+            # (для оттенков серого - оценка по уменьшенной копии, см. estimate_grayscale_saving)
+            **{f"images_{content}": 0 for content in CONTENT_CLASSES},
+            **{f"saved_bytes_{content}": 0 for content in CONTENT_CLASSES},
+        }
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get_settings(self) -> Dict[str, Any]:
+        """
+        Возвращает настройки кодирования, влияющие на результат (например, для ключа кэша).
+        """
+        return {
+            "min_quality": self.min_quality,
+            "max_quality": self.max_quality,
+            "max_encodes": self.max_encodes,
+            "size_tolerance": self.size_tolerance,
+            "use_probe": self.use_probe,
+            "passthrough_jpeg": self.passthrough_jpeg,
+            "choose_encoding": self.choose_encoding,
+            "max_decode_pixels": self.max_decode_pixels,
+        }
+
+    def passthrough_size(self, image_path: str, target_bytes: float, max_width: Optional[int],
+                         max_height: Optional[int]) -> Optional[int]:
+        """
+        Возвращает размер исходного файла, если это JPEG, который уже укладывается в размер
+        и не требует уменьшения. Проверяются только размер файла и заголовок, без декодирования.
+        Такой файл encode() возвращает без перекодирования, поэтому готовить изображение (prepare()) не нужно.
+
+        Args:
+            image_path (str): Путь к изображению
+            target_bytes (float): Целевой размер в байтах
+            max_width (Optional[int]): Максимальная ширина в пикселях
+            max_height (Optional[int]): Максимальная высота в пикселях
+
+        Returns:
+            Optional[int]: Размер файла в байтах или None, если изображение нужно перекодировать
+        """
+        if not self.passthrough_jpeg:
+            return None
+        try:
+            file_size = os.path.getsize(image_path)
+            if file_size > target_bytes:
+                return None
+            with PILImage.open(image_path) as img:
+                if img.format != 'JPEG' or img.mode not in ('RGB', 'L'):
+                    return None
+                if fit_size(img.size, max_width, max_height) != img.size:
+                    return None
+        except (OSError, SyntaxError, ValueError):
+            return None
+        return file_size
+
+    def prepare(self, image_path: str, max_width: Optional[int] = None,
+                max_height: Optional[int] = None) -> PILImage.Image:
+        """
+        Открывает и подготавливает изображение к кодированию так же, как encode(): уменьшение
+        и замена прозрачности белым фоном. Позволяет закодировать одно изображение под несколько
+        целевых размеров с одним декодированием (параметр prepared в encode()).
+        """
+        return _prepare_image_for_jpeg(image_path, max_width, max_height, self.max_decode_pixels)
+
+    def encode(self, image_path: str, target_size_kb: float = 100,
+               max_width: Optional[int] = None,
+               max_height: Optional[int] = None,
+               prepared: Optional[PILImage.Image] = None) -> Tuple[io.BytesIO, Dict[str, Any]]:
+        """
+        Оптимизирует изображение, не добавляя вызов в статистику экземпляра.
+
+        Для каждого изображения подбирается собственное качество JPEG: наибольшее, при котором
+        размер не превышает target_size_kb. Размер JPEG растет вместе с качеством, поэтому поиск
+        ведется на отрезке между известными границами: следующее качество предсказывается по модели
+        "логарифм размера линеен по качеству" (наклон оценивается по уменьшенной копии, см.
+        estimate_jpeg_size_slope, затем по полным кодированиям), а если предсказание не сокращает
+        отрезок хотя бы вдвое, отрезок делится пополам. Поиск останавливается, когда размер не дальше
+        size_tolerance от цели, и занимает не более max_encodes кодирований.
+        Качество предыдущего изображения этого экземпляра используется только как первая проба.
+        Перед сжатием изображение уменьшается до max_width x max_height (см. _prepare_image_for_jpeg):
+        пиксели сверх размера, в котором изображение будет показано, только увеличивают файл.
+        Если изображение не укладывается в размер даже с минимальным качеством, возвращается
+        результат с минимальным качеством. Исходный JPEG, который уже укладывается в размер и не
+        требует уменьшения, возвращается без декодирования (см. passthrough_jpeg).
+        Графика сохраняется в PNG с палитрой, если он укладывается в размер и меньше JPEG RGB
+        с максимальным качеством, а изображение в оттенках серого кодируется в одноканальный JPEG
+        (см. choose_encoding и classify_image_content).
+
+        Args:
+            image_path (str): Путь к изображению
+            target_size_kb (float): Целевой размер файла в КБ
+            max_width (Optional[int]): Максимальная ширина в пикселях (None - без уменьшения)
+            max_height (Optional[int]): Максимальная высота в пикселях (None - без уменьшения)
+            prepared (Optional[PILImage.Image]): Изображение, уже подготовленное prepare() с теми же
+                max_width и max_height
+
+        Returns:
+            Tuple[io.BytesIO, Dict[str, Any]]: Буфер с оптимизированным изображением и статистика
+                вызова (для record())
+        """
+        start_time = time.perf_counter()
+        target_bytes = target_size_kb * 1024
+
+        data = None
+        if self.passthrough_size(image_path, target_bytes, max_width, max_height) is not None:
+            try:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = None
+        if data is not None:
+            print(f"  [optimize_excel] {os.path.basename(image_path)}: исходный JPEG {len(data) / 1024:.1f} КБ "
+                  f"укладывается в {target_size_kb:.1f} КБ, используется без перекодирования", file=sys.stderr)
+            call_stats = dict(self._empty_stats(), images=1, passthrough=1, source_bytes=len(data),
+                              output_bytes=len(data), time_sec=time.perf_counter() - start_time)
+            return io.BytesIO(data), call_stats
+
+        if prepared is not None:
+            img, peak_bitmap_bytes = prepared, 0
+        else:
+            img, peak_bitmap_bytes = _load_image_for_jpeg(image_path, max_width, max_height,
+                                                          self.max_decode_pixels)
+        try:
+            source_bytes = os.path.getsize(image_path)
+        except OSError:
+            source_bytes = 0
+
+        content = classify_image_content(img) if self.choose_encoding else CONTENT_PHOTO
+        # Полные кодирования при выборе кодирования графики (учитываются в статистике encodes)
+        choice_encodes = 0
+        if content == CONTENT_LINE_ART:
+            png_buffer = _encode_indexed_png(img)
+            choice_encodes += 1
+            # JPEG RGB для сравнения кодируется, только если PNG укладывается в размер
+            rgb_bytes = None
+            if png_buffer.tell() <= target_bytes:
+                rgb_bytes = _encode_jpeg(img, self.max_quality).tell()
+                choice_encodes += 1
+            if rgb_bytes is not None and png_buffer.tell() < rgb_bytes:
+                print(f"  [optimize_excel] {os.path.basename(image_path)}: графика, PNG с палитрой "
+                      f"{png_buffer.tell() / 1024:.1f} КБ (цель {target_size_kb:.1f} КБ, "
+                      f"JPEG {rgb_bytes / 1024:.1f} КБ)", file=sys.stderr)
+                call_stats = dict(self._empty_stats(), images=1, images_line_art=1, encodes=choice_encodes,
+                                  saved_bytes_line_art=rgb_bytes - png_buffer.tell(),
+                                  source_bytes=source_bytes, output_bytes=png_buffer.tell(),
+                                  peak_bitmap_bytes=peak_bitmap_bytes, time_sec=time.perf_counter() - start_time)
+                png_buffer.seek(0)
+                return png_buffer, call_stats
+            # PNG с палитрой не выгоднее JPEG: плавные переходы при небольшом числе цветов
+            content = CONTENT_GRAYSCALE if is_grayscale_image(img) else CONTENT_PHOTO
+        rgb_img = img
+        if content == CONTENT_GRAYSCALE:
+            img = img.convert('L')
+        min_quality, max_quality = self.min_quality, self.max_quality
+
+        # lo - наибольшее качество, которое укладывается в размер; hi - наименьшее, которое не укладывается.
+        # Буфер hi хранится для результата с минимальным качеством, если в размер не уложилось ничего
+        lo, lo_buffer = None, None
+        hi, hi_buffer = max_quality + 1, None
+        measurements = []  # (качество, логарифм размера) полных кодирований
+
+        def try_quality(q: int) -> None:
+            nonlocal lo, lo_buffer, hi, hi_buffer
+            buffer = _encode_jpeg(img, q)
+            measurements.append((q, math.log(max(1, buffer.tell()))))
+            if buffer.tell() <= target_bytes:
+                lo, lo_buffer = q, buffer
             else:
-                normalized += '-'
-        # Приводим к нижнему регистру
-        normalized = normalized.lower()
-    
-    return normalized
+                hi, hi_buffer = q, buffer
+
+        # Модель размера: логарифм размера линеен по качеству. Наклон берется по уменьшенной копии,
+        # после двух полных кодирований - по ним; сдвиг - по последнему полному кодированию
+        slope = estimate_jpeg_size_slope(img) if self.use_probe else None
+
+        def predict_quality() -> Optional[int]:
+            model_slope = slope
+            if len(measurements) >= 2:
+                (q1, size1), (q2, size2) = measurements[-2:]
+                if q1 != q2 and (size2 - size1) / (q2 - q1) > 0:
+                    model_slope = (size2 - size1) / (q2 - q1)
+            if not model_slope or not measurements:
+                return None
+            last_quality, last_log_size = measurements[-1]
+            return math.floor(last_quality + (math.log(target_bytes) - last_log_size) / model_slope)
+
+        # Первое кодирование: качество предыдущего изображения или середина шкалы
+        with self._lock:
+            first_quality = self.last_quality
+        if first_quality is None:
+            first_quality = (min_quality + max_quality) // 2
+        try_quality(max(min_quality, min(max_quality, first_quality)))
+
+        # Поиск по модели с делением отрезка пополам, если модель не сокращает отрезок хотя бы вдвое
+        use_model = True
+        while len(measurements) < self.max_encodes:
+            low_bound = lo if lo is not None else min_quality - 1
+            if hi - low_bound <= 1:
+                break
+            if lo is not None and lo_buffer.tell() >= target_bytes * (1 - self.size_tolerance):
+                break
+            predicted = predict_quality() if use_model else None
+            model_step = predicted is not None
+            if model_step:
+                # Предсказание за пределами отрезка означает проверку его крайней точки
+                q = max(low_bound + 1, min(hi - 1, predicted))
+            else:
+                q = (low_bound + hi) // 2
+            previous_width = hi - low_bound
+            try_quality(q)
+            new_width = hi - (lo if lo is not None else min_quality - 1)
+            use_model = not model_step or new_width * 2 <= previous_width
+
+        over_budget = lo is None
+        if lo is None:
+            if hi > min_quality:
+                # Лимит кодирований исчерпан раньше, чем проверено минимальное качество
+                try_quality(min_quality)
+            if lo is None:
+                print(f"  [optimize_excel] {os.path.basename(image_path)}: не укладывается в {target_size_kb:.1f} КБ, "
+                      f"используем минимальное качество ({min_quality}%)", file=sys.stderr)
+                # Минимальное качество уже закодировано (hi == min_quality), повторное кодирование не нужно
+                lo, lo_buffer = min_quality, hi_buffer
+            else:
+                over_budget = False
+
+        with self._lock:
+            self.last_quality = lo
+        print(f"  [optimize_excel] {os.path.basename(image_path)}: качество {lo}%, "
+              f"размер {lo_buffer.tell() / 1024:.1f} КБ (цель {target_size_kb:.1f} КБ), "
+              f"кодирований {len(measurements)}"
+              f"{', оттенки серого' if content == CONTENT_GRAYSCALE else ''}", file=sys.stderr)
+
+        saved_bytes = (estimate_grayscale_saving(rgb_img, lo)
+                       if content == CONTENT_GRAYSCALE else 0)
+        call_stats = {
+            "images": 1,
+            "encodes": len(measurements) + choice_encodes,
+            "over_budget": int(over_budget),
+            "source_bytes": source_bytes,
+            "output_bytes": lo_buffer.tell(),
+            "peak_bitmap_bytes": peak_bitmap_bytes,
+            "time_sec": time.perf_counter() - start_time,
+            f"images_{content}": 1,
+            f"saved_bytes_{content}": saved_bytes,
+        }
+        lo_buffer.seek(0)
+        return lo_buffer, call_stats
+
+    def measure(self, image_path: str, qualities: Iterable[int],
+                max_width: Optional[int] = None, max_height: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Измеряет размер JPEG изображения, подготовленного так же, как в encode(), при нескольких
+        качествах. Используется для планирования размера до основной оптимизации.
+
+        Полное изображение кодируется один раз, со средним из качеств. Размеры при остальных качествах
+        получаются из него по отношению размеров мозаики фрагментов (см. _sample_tiles) при этих качествах.
+
+        Args:
+            image_path (str): Путь к изображению
+            qualities (Iterable[int]): Качества JPEG для измерения
+            max_width (Optional[int]): Максимальная ширина в пикселях
+            max_height (Optional[int]): Максимальная высота в пикселях
+
+        Returns:
+            Dict[str, Any]: sizes - список пар (качество, размер в байтах); passthrough_bytes - размер
+                исходного JPEG, если его можно использовать без перекодирования (см. passthrough_jpeg), иначе None;
+                lossless_bytes - размер PNG с палитрой, который encode() выберет для графики, иначе None
+        """
+        passthrough_bytes = self.passthrough_size(image_path, float('inf'), max_width, max_height)
+        img = _prepare_image_for_jpeg(image_path, max_width, max_height, self.max_decode_pixels)
+        lossless_bytes = None
+        content = classify_image_content(img) if self.choose_encoding else CONTENT_PHOTO
+        if content == CONTENT_LINE_ART:
+            png_bytes = _encode_indexed_png(img).tell()
+            if png_bytes < _encode_jpeg(img, self.max_quality).tell():
+                lossless_bytes = png_bytes
+            elif is_grayscale_image(img):
+                content = CONTENT_GRAYSCALE
+        if content == CONTENT_GRAYSCALE:
+            img = img.convert('L')
+        qualities = sorted(set(int(q) for q in qualities))
+        anchor = qualities[len(qualities) // 2]
+        anchor_bytes = _encode_jpeg(img, anchor).tell()
+        sample = _sample_tiles(img)
+        if sample is img:
+            sizes = [(q, anchor_bytes if q == anchor else _encode_jpeg(img, q).tell()) for q in qualities]
+        else:
+            sample_sizes = {q: _encode_jpeg(sample, q).tell() for q in qualities}
+            sizes = [(q, round(anchor_bytes * sample_sizes[q] / sample_sizes[anchor])) for q in qualities]
+        return {"sizes": sizes, "passthrough_bytes": passthrough_bytes, "lossless_bytes": lossless_bytes}
+
+    def optimize(self, image_path: str, target_size_kb: float = 100,
+                 max_width: Optional[int] = None, max_height: Optional[int] = None) -> io.BytesIO:
+        """
+        Оптимизирует изображение (см. encode()) и добавляет вызов в статистику.
+
+        Returns:
+            io.BytesIO: Буфер с оптимизированным изображением
+        """
+        buffer, call_stats = self.encode(image_path, target_size_kb, max_width, max_height)
+        self.record(call_stats)
+        return buffer
+
+    def record(self, call_stats: Dict[str, Any]) -> None:
+        """
+        Добавляет статистику вызова encode() (в том числе выполненного копией экземпляра в другом процессе).
+        Пиковые значения (peak_*) не суммируются, а заменяются наибольшим.
+        """
+        with self._lock:
+            for key, value in call_stats.items():
+                if key.startswith("peak_"):
+                    self.stats[key] = max(self.stats.get(key, 0), value)
+                else:
+                    self.stats[key] = self.stats.get(key, 0) + value
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику оптимизации.
+
+        Returns:
+            Dict[str, Any]: Копия словаря статистики
+        """
+        with self._lock:
+            return dict(self.stats)
+
+    def format_stats(self) -> str:
+        """
+        Возвращает статистику оптимизации в виде строки для лога.
+
+        Returns:
+            str: Строка со статистикой
+        """
+        stats = self.get_stats()
+        images = stats["images"]
+        average_encodes = stats["encodes"] / images if images else 0.0
+        content_names = {CONTENT_PHOTO: "фото", CONTENT_GRAYSCALE: "оттенки серого", CONTENT_LINE_ART: "графика"}
+        by_content = ", ".join(
+            f"{content_names[content]} {stats.get(f'images_{content}', 0)}"
+            + (f" (-{stats.get(f'saved_bytes_{content}', 0) / 1024:.1f} КБ)" if content != CONTENT_PHOTO else "")
+            for content in CONTENT_CLASSES)
+        return (f"изображений {images} (без перекодирования {stats['passthrough']}), кодирований {stats['encodes']} ({average_encodes:.1f} на изображение), "
+                f"не уложились в лимит {stats['over_budget']}, "
+                f"исходные {stats['source_bytes'] / 1024 / 1024:.1f} МБ -> {stats['output_bytes'] / 1024 / 1024:.1f} МБ, "
+                f"по содержимому: {by_content}, "
+                f"пиковая память растра {stats['peak_bitmap_bytes'] / 1024 / 1024:.1f} МБ, "
+                f"время {stats['time_sec']:.2f} сек")
 
 def optimize_image_for_excel(image_path: str, target_size_kb: int = 100, 
                           quality: int = 90, min_quality: int = 1,
-                          output_folder: Optional[str] = None) -> io.BytesIO:
+                          output_folder: Optional[str] = None,
+                          use_probe: bool = True,
+                          max_width: Optional[int] = None,
+                          max_height: Optional[int] = None) -> io.BytesIO:
     """
     Оптимизирует изображение до заданного размера в КБ для вставки в Excel.
-    Для первого изображения использует двухэтапную оптимизацию качества:
-      1. От 100% до 5% с шагом 5%
-      2. От 4% до 1% с шагом 1%
-    Для последующих изображений использует кешированное качество.
-    Всегда сохраняет изображение с качеством 1%, даже если размер превышает лимит.
+    
+    Вызов не хранит состояния между изображениями: для обработки набора изображений
+    создайте ImageOptimizer, чтобы качество предыдущего изображения ускоряло подбор следующего.
     
     Args:
         image_path (str): Путь к изображению
         target_size_kb (int): Целевой размер файла в КБ
         quality (int): Не используется (оставлен для совместимости)
         min_quality (int): Не используется (оставлен для совместимости)
-        output_folder (Optional[str]): Папка для сохранения
+        output_folder (Optional[str]): Не используется (оставлен для совместимости)
+        use_probe (bool): Оценивать наклон модели размера по уменьшенной копии
+        max_width (Optional[int]): Максимальная ширина в пикселях (None - без уменьшения)
+        max_height (Optional[int]): Максимальная высота в пикселях (None - без уменьшения)
         
     Returns:
         io.BytesIO: Буфер с оптимизированным изображением
     """
-    global cached_quality
-    
-    # Если качество кешировано - используем его
-    if cached_quality is not None:
-        print(f"  [optimize_excel] Используем кешированное качество: {cached_quality}%", file=sys.stderr)
-        img = PILImage.open(image_path)
-        if img.mode == 'RGBA' or 'transparency' in img.info:
-            background = PILImage.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-            
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=cached_quality)
-        buffer.seek(0)
-        return buffer
-
-    print(f"  [optimize_excel] Оптимизация первого изображения: {image_path}", file=sys.stderr)
-    print(f"  [optimize_excel] Цель: < {target_size_kb} КБ", file=sys.stderr)
-
-    img = PILImage.open(image_path)
-    if img.mode == 'RGBA' or 'transparency' in img.info:
-        print("  [optimize_excel] Обнаружена прозрачность, заменяем на белый фон.", file=sys.stderr)
-        background = PILImage.new('RGB', img.size, (255, 255, 255))
-        background.paste(img, mask=img.split()[3])
-        img = background
-    elif img.mode != 'RGB':
-        print(f"  [optimize_excel] Конвертируем изображение из {img.mode} в RGB.", file=sys.stderr)
-        img = img.convert('RGB')
-
-    best_buffer = None
-    best_quality = None
-
-    # Этап 1: от 100 до 5 с шагом 5
-    for q in range(100, 4, -5):
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=q)
-        size_kb = buffer.tell() / 1024
-        print(f"    Этап 1: качество {q}% - размер {size_kb:.1f} КБ", file=sys.stderr)
-        
-        if size_kb <= target_size_kb:
-            best_buffer = buffer
-            best_quality = q
-            print(f"  [optimize_excel] Найдено подходящее качество: {q}%", file=sys.stderr)
-            break
-
-    # Этап 2: от 4 до 1 с шагом 1 (если не нашли в этапе 1)
-    if best_buffer is None:
-        for q in range(4, 0, -1):
-            buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=q)
-            size_kb = buffer.tell() / 1024
-            print(f"    Этап 2: качество {q}% - размер {size_kb:.1f} КБ", file=sys.stderr)
-            
-            if size_kb <= target_size_kb:
-                best_buffer = buffer
-                best_quality = q
-                print(f"  [optimize_excel] Найдено подходящее качество: {q}%", file=sys.stderr)
-                break
-
-    # Если не нашли подходящего качества, используем 1%
-    if best_buffer is None:
-        print(f"  [optimize_excel] Используем минимальное качество (1%)", file=sys.stderr)
-        best_buffer = io.BytesIO()
-        img.save(best_buffer, format='JPEG', quality=1)
-        best_quality = 1
-
-    # Кешируем найденное качество для следующих изображений
-    cached_quality = best_quality
-    print(f"  [optimize_excel] Итоговое качество: {best_quality}% (кешировано)", file=sys.stderr)
-    best_buffer.seek(0)
-    return best_buffer
+    return ImageOptimizer(use_probe=use_probe).optimize(image_path, target_size_kb, max_width, max_height)
 
 # Остальные функции остаются без изменений
 # ...
@@ -0,0 +1,323 @@
+"""
+Поддержание индекса изображений в актуальном состоянии по событиям файловой системы (watchdog)
+"""
+import os
+import sys
+import logging
+import threading
+from concurrent.futures import Future
+from typing import List, Dict, Optional, Tuple, Any
+
+from .image_index import ImageIndex
+
+logger = logging.getLogger(__name__)
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+    logger.warning("Библиотека watchdog недоступна, индекс изображений будет обновляться опросом папок")
+
+# Интервал опроса папок, для которых события файловой системы не приходят (сетевые папки)
+DEFAULT_POLL_INTERVAL_SEC = 60.0
+
+# Тип диска Windows для сетевых дисков (GetDriveTypeW)
+DRIVE_REMOTE = 4
+
+
+def _is_remote_drive(path: str) -> bool:
+    """
+    Проверяет, находится ли путь на подключенном сетевом диске Windows (например, Z:).
+    """
+    if sys.platform != 'win32':
+        return False
+    drive = os.path.splitdrive(os.path.abspath(path))[0]
+    if not drive or drive.startswith(('\\\\', '//')):
+        return False
+    try:
+        import ctypes
+        return ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == DRIVE_REMOTE
+    except (ImportError, AttributeError, OSError):
+        return False
+
+
+def is_network_path(path: str) -> bool:
+    """
+    Проверяет, является ли путь сетевым, для которого события файловой системы ненадежны.
+
+    Args:
+        path (str): Путь к папке
+
+    Returns:
+        bool: True для путей вида \\\\server\\share или //server/share и для папок
+            на подключенных сетевых дисках Windows
+    """
+    return path.startswith('\\\\') or path.startswith('//') or _is_remote_drive(path)
+
+
+class _IndexEventHandler(FileSystemEventHandler):
+    """
+    Обработчик событий watchdog, применяющий создание, удаление и переименование файлов к индексу.
+    """
+
+    def __init__(self, index: ImageIndex):
+        super().__init__()
+        self.index = index
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.index.add_tree(event.src_path)
+        else:
+            self.index.add_path(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.index.remove_tree(event.src_path)
+        else:
+            # Для удаленной папки watchdog может не знать, что это была папка
+            if not self.index.remove_path(event.src_path):
+                self.index.remove_tree(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.index.remove_tree(event.src_path)
+            self.index.add_tree(event.dest_path)
+        else:
+            self.index.remove_path(event.src_path)
+            self.index.add_path(event.dest_path)
+
+
+class ImageFolderWatcher:
+    """
+    Фоновое наблюдение за папками индекса.
+
+    Локальные папки отслеживаются через watchdog, сетевые папки (и все папки, если watchdog
+    недоступен) - периодическим опросом: папка перечитывается через каталог изображений,
+    который обновляет только подпапки с изменившимся mtime.
+    """
+
+    def __init__(self, index: ImageIndex, poll_interval: float = DEFAULT_POLL_INTERVAL_SEC,
+                 force_polling: bool = False):
+        """
+        Args:
+            index (ImageIndex): Индекс, который нужно поддерживать в актуальном состоянии
+            poll_interval (float): Интервал опроса в секундах
+            force_polling (bool): Опрашивать все папки, не используя события файловой системы
+        """
+        self.index = index
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self._observer = None
+        self._poll_thread = None
+        self._stop_event = threading.Event()
+        self.watched_tiers: List[int] = []
+        self.polled_tiers: List[int] = []
+        self.poll_cycles = 0
+
+    def start(self) -> 'ImageFolderWatcher':
+        """
+        Запускает наблюдение за папками индекса.
+
+        Returns:
+            ImageFolderWatcher: Этот же объект
+        """
+        handler = _IndexEventHandler(self.index)
+        for tier, folder in enumerate(self.index.folders):
+            if not folder or not os.path.isdir(folder):
+                continue
+            if self.force_polling or not WATCHDOG_AVAILABLE or is_network_path(folder):
+                self.polled_tiers.append(tier)
+                continue
+            try:
+                if self._observer is None:
+                    self._observer = Observer()
+                    self._observer.daemon = True
+                self._observer.schedule(handler, folder, recursive=self.index.recursive)
+                self.watched_tiers.append(tier)
+            except Exception as e:
+                logger.warning(f"Не удалось подписаться на события папки {folder}: {e}. Используется опрос")
+                self.polled_tiers.append(tier)
+
+        if self._observer is not None and self.watched_tiers:
+            self._observer.start()
+        if self.polled_tiers:
+            self._poll_thread = threading.Thread(target=self._poll_loop, name="image-index-poller", daemon=True)
+            self._poll_thread.start()
+
+        logger.info(f"Наблюдение за папками изображений запущено: события - {len(self.watched_tiers)}, "
+                    f"опрос каждые {self.poll_interval:.0f} сек - {len(self.polled_tiers)}")
+        return self
+
+    def _poll_loop(self) -> None:
+        """
+        Периодически перечитывает опрашиваемые папки до остановки наблюдения.
+        """
+        while not self._stop_event.wait(self.poll_interval):
+            for tier in self.polled_tiers:
+                try:
+                    changes = self.index.refresh_tier(tier)
+                    if changes:
+                        logger.info(f"Опрос папки {self.index.folders[tier]}: применено изменений {changes}")
+                except Exception as e:
+                    logger.warning(f"Ошибка при опросе папки {self.index.folders[tier]}: {e}")
+            self.poll_cycles += 1
+
+    def stop(self) -> None:
+        """
+        Останавливает наблюдение.
+        """
+        self._stop_event.set()
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+                self._observer.join(timeout=5)
+            except Exception as e:
+                logger.warning(f"Ошибка при остановке наблюдения за папками: {e}")
+        if self._poll_thread is not None:
+            self._poll_thread.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику наблюдения.
+
+        Returns:
+            Dict[str, Any]: Количество папок по способу наблюдения, циклов опроса и примененных событий
+        """
+        return {
+            "watched_folders": len(self.watched_tiers),
+            "polled_folders": len(self.polled_tiers),
+            "poll_cycles": self.poll_cycles,
+            "events_applied": self.index.stats["events_applied"],
+        }
+
+
+# Живые индексы процесса: (тип папок, папки) -> (индекс, наблюдатель)
+_live_indexes: Dict[Tuple[Optional[str], Tuple[str, ...]], Tuple[ImageIndex, ImageFolderWatcher]] = {}
+_live_indexes_lock = threading.Lock()
+# Индексы, которые строятся сейчас: ключ -> Future с индексом для одновременных запросов того же ключа
+_building_indexes: Dict[Tuple[Optional[str], Tuple[str, ...]], Future] = {}
+
+
+def get_live_index(folders: List[Optional[str]], kind: Optional[str] = None,
+                   catalog: Optional[Any] = None,
+                   poll_interval: float = DEFAULT_POLL_INTERVAL_SEC) -> ImageIndex:
+    """
+    Возвращает индекс изображений, который поддерживается в актуальном состоянии фоновым наблюдением.
+
+    Индекс строится и наблюдение запускается один раз на процесс для каждого набора папок.
+    Построение выполняется без блокировки живых индексов: запросы других наборов папок не ждут
+    обхода, а одновременные запросы того же набора ждут результат первого. Если для того же типа
+    папок набор изменился (например, в настройках), прежнее наблюдение останавливается.
+
+    Args:
+        folders (List[Optional[str]]): Папки в порядке приоритета
+        kind (Optional[str]): Тип папок ("product" или "package")
+        catalog (Optional[ImageCatalog]): Каталог изображений для построения индекса
+        poll_interval (float): Интервал опроса сетевых папок в секундах
+
+    Returns:
+        ImageIndex: Живой индекс
+    """
+    key = (kind, tuple(folder or "" for folder in folders))
+    with _live_indexes_lock:
+        if key in _live_indexes:
+            return _live_indexes[key][0]
+        future = _building_indexes.get(key)
+        building = future is None
+        if building:
+            future = Future()
+            _building_indexes[key] = future
+            old_watchers = [_live_indexes.pop(other)[1] for other in list(_live_indexes) if other[0] == kind]
+            # Построение прежнего набора папок того же типа не будет зарегистрировано
+            for other in [other for other in _building_indexes if other[0] == kind and other != key]:
+                del _building_indexes[other]
+    if not building:
+        return future.result()
+
+    for old_watcher in old_watchers:
+        old_watcher.stop()
+    try:
+        index = ImageIndex(folders, catalog=catalog, kind=kind).build()
+        watcher = ImageFolderWatcher(index, poll_interval=poll_interval).start()
+    except BaseException as e:
+        with _live_indexes_lock:
+            if _building_indexes.get(key) is future:
+                del _building_indexes[key]
+        future.set_exception(e)
+        raise
+
+    with _live_indexes_lock:
+        current = _building_indexes.get(key) is future
+        if current:
+            del _building_indexes[key]
+            _live_indexes[key] = (index, watcher)
+    if not current:
+        # Набор папок сменился или наблюдения остановлены во время построения
+        watcher.stop()
+    future.set_result(index)
+    return index
+
+
+def get_live_watcher_stats() -> List[Dict[str, Any]]:
+    """
+    Возвращает статистику всех запущенных наблюдений процесса.
+
+    Returns:
+        List[Dict[str, Any]]: Статистика по каждому живому индексу
+    """
+    with _live_indexes_lock:
+        result = []
+        for (kind, folders), (_, watcher) in _live_indexes.items():
+            stats = watcher.get_stats()
+            stats["kind"] = kind
+            stats["folders"] = list(folders)
+            result.append(stats)
+        return result
+
+
+def stop_all_watchers() -> None:
+    """
+    Останавливает все наблюдения процесса и забывает живые индексы.
+    """
+    with _live_indexes_lock:
+        for _, watcher in _live_indexes.values():
+            watcher.stop()
+        _live_indexes.clear()
+        _building_indexes.clear()
+
+
+def warm_up_configured_indexes(catalog: Optional[Any] = None) -> threading.Thread:
+    """
+    В фоновом потоке строит живые индексы для папок изображений из настроек,
+    чтобы первый запуск обработки не ждал обхода папок и построения индекса подсказок. Если в настройках задан снимок
+    индекса ("scan_settings.snapshot_path"), каталог сначала загружается из него, и
+    построение индексов сводится к проверке mtime папок.
+
+    Args:
+        catalog (Optional[ImageCatalog]): Каталог изображений для построения индексов
+
+    Returns:
+        threading.Thread: Запущенный поток
+    """
+    from .image_catalog import get_configured_folders
+    from .index_snapshot import import_configured_snapshot
+
+    def warm_up():
+        try:
+            if catalog is not None:
+                import_configured_snapshot(catalog)
+            for kind, folders in get_configured_folders().items():
+                get_live_index(folders, kind=kind, catalog=catalog)
+            # Индексы нечеткого поиска нужны только для подсказок, поэтому строятся после основных
+            for kind, folders in get_configured_folders().items():
+                get_live_index(folders, kind=kind, catalog=catalog).get_fuzzy_index()
+        except Exception as e:
+            logger.warning(f"Не удалось подготовить индексы изображений: {e}")
+
+    thread = threading.Thread(target=warm_up, name="image-index-warmup", daemon=True)
+    thread.start()
+    return thread
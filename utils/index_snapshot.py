@@ -0,0 +1,318 @@
+"""
+Снимки каталога изображений: экспорт на одной рабочей станции и импорт на других без обхода сетевых папок
+"""
+import os
+import io
+import json
+import time
+import zlib
+import struct
+import logging
+import platform
+from typing import List, Dict, Optional, Tuple, Any
+
+from . import image_catalog
+
+logger = logging.getLogger(__name__)
+
+# Сигнатура и версия формата снимка
+SNAPSHOT_MAGIC = b"ETPIDX\x00"
+SNAPSHOT_VERSION = 1
+
+# Заголовок файла: сигнатура, версия формата, длина JSON-заголовка
+_PREAMBLE = struct.Struct("<7sHI")
+_DOUBLE = struct.Struct("<d")
+
+# Расширение файлов снимков по умолчанию
+SNAPSHOT_EXTENSION = ".etpidx"
+
+
+def _write_varint(buffer: io.BytesIO, value: int) -> None:
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            buffer.write(bytes((byte | 0x80,)))
+        else:
+            buffer.write(bytes((byte,)))
+            return
+
+
+def _read_varint(data: memoryview, offset: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, offset
+        shift += 7
+
+
+def _write_front_coded(buffer: io.BytesIO, previous: bytes, current: bytes) -> None:
+    """
+    Записывает строку как длину общего префикса с предыдущей строкой и оставшийся суффикс.
+    На отсортированных путях это сжимает повторяющиеся названия папок.
+    """
+    shared = 0
+    limit = min(len(previous), len(current))
+    while shared < limit and previous[shared] == current[shared]:
+        shared += 1
+    _write_varint(buffer, shared)
+    _write_varint(buffer, len(current) - shared)
+    buffer.write(current[shared:])
+
+
+def _read_front_coded(data: memoryview, offset: int, previous: bytes) -> Tuple[bytes, int]:
+    shared, offset = _read_varint(data, offset)
+    suffix_length, offset = _read_varint(data, offset)
+    current = previous[:shared] + bytes(data[offset:offset + suffix_length])
+    return current, offset + suffix_length
+
+
+def _encode_path(root: str, path: str) -> bytes:
+    return path[len(root):].encode('utf-8', 'surrogateescape')
+
+
+def _decode_path(root: str, relative: bytes) -> str:
+    return root + relative.decode('utf-8', 'surrogateescape')
+
+
+def _encode_root(buffer: io.BytesIO, root: str, exported: Dict[str, Any]) -> None:
+    """
+    Записывает папки и файлы одной корневой папки. Пути хранятся относительно корня,
+    ссылки на папки - номерами в отсортированном списке папок.
+    """
+    dirs = exported["dirs"]
+    dir_numbers = {path: number for number, (path, _, _) in enumerate(dirs)}
+
+    previous = b""
+    for path, parent, mtime in dirs:
+        current = _encode_path(root, path)
+        _write_front_coded(buffer, previous, current)
+        _write_varint(buffer, dir_numbers[parent] + 1 if parent in dir_numbers else 0)
+        buffer.write(_DOUBLE.pack(mtime or 0.0))
+        previous = current
+
+    previous = b""
+    for path, dir_path, size, mtime in exported["files"]:
+        current = _encode_path(root, path)
+        _write_front_coded(buffer, previous, current)
+        _write_varint(buffer, dir_numbers.get(dir_path, -1) + 1)
+        _write_varint(buffer, size or 0)
+        buffer.write(_DOUBLE.pack(mtime or 0.0))
+        previous = current
+
+
+def _decode_root(data: memoryview, offset: int, root: str, dir_count: int,
+                 file_count: int) -> Tuple[List[Tuple[str, Optional[str], float]], List[Tuple[str, str, int, float]], int]:
+    dir_rows = []
+    previous = b""
+    for _ in range(dir_count):
+        previous, offset = _read_front_coded(data, offset, previous)
+        parent_number, offset = _read_varint(data, offset)
+        (mtime,) = _DOUBLE.unpack_from(data, offset)
+        offset += _DOUBLE.size
+        dir_rows.append((_decode_path(root, previous), parent_number, mtime))
+    dirs = [(path, dir_rows[parent_number - 1][0] if parent_number else None, mtime)
+            for path, parent_number, mtime in dir_rows]
+
+    files = []
+    previous = b""
+    for _ in range(file_count):
+        previous, offset = _read_front_coded(data, offset, previous)
+        dir_number, offset = _read_varint(data, offset)
+        size, offset = _read_varint(data, offset)
+        (mtime,) = _DOUBLE.unpack_from(data, offset)
+        offset += _DOUBLE.size
+        path = _decode_path(root, previous)
+        dir_path = dirs[dir_number - 1][0] if dir_number else os.path.dirname(path)
+        files.append((path, dir_path, size, mtime))
+    return dirs, files, offset
+
+
+def export_snapshot(snapshot_path: str,
+                    catalog: Optional[image_catalog.ImageCatalog] = None,
+                    folders: Optional[Dict[str, List[str]]] = None,
+                    refresh: bool = True) -> Dict[str, Any]:
+    """
+    Сохраняет снимок каталога изображений для указанных папок.
+
+    Формат: сигнатура, версия, JSON-заголовок (корневые папки, их mtime, количество записей)
+    и сжатое zlib тело с отсортированными путями в префиксном кодировании. Нормализованные
+    артикулы не сохраняются и вычисляются при импорте, поэтому снимок не зависит от правил
+    нормализации. Файл записывается атомарно.
+
+    Args:
+        snapshot_path (str): Путь к файлу снимка
+        catalog (Optional[ImageCatalog]): Каталог изображений. По умолчанию - общий каталог процесса
+        folders (Optional[Dict[str, List[str]]]): Папки "тип -> список по приоритету".
+            По умолчанию - папки из настроек
+        refresh (bool): Обновить каталог перед экспортом
+
+    Returns:
+        Dict[str, Any]: Заголовок сохраненного снимка
+    """
+    catalog = catalog or image_catalog.get_image_catalog()
+    folders = folders if folders is not None else image_catalog.get_configured_folders()
+
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "catalog_version": image_catalog.CATALOG_VERSION,
+        "created_at": time.time(),
+        "created_on": platform.node(),
+        "roots": [],
+    }
+    body = io.BytesIO()
+    for kind, kind_folders in folders.items():
+        for tier, root in enumerate(kind_folders):
+            if not root or any(entry["root"] == root for entry in header["roots"]):
+                continue
+            if refresh:
+                catalog.refresh(root, kind, tier)
+            exported = catalog.export_root(root)
+            if exported is None:
+                logger.warning(f"Папка {root} отсутствует в каталоге и не включена в снимок")
+                continue
+            try:
+                root_mtime = os.stat(root).st_mtime
+            except OSError:
+                root_mtime = None
+            header["roots"].append({
+                "root": root,
+                "kind": exported["kind"],
+                "tier": exported["tier"],
+                "refreshed_at": exported["refreshed_at"],
+                "root_mtime": root_mtime,
+                "dirs": len(exported["dirs"]),
+                "files": len(exported["files"]),
+            })
+            _encode_root(body, root, exported)
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    snapshot_dir = os.path.dirname(os.path.abspath(snapshot_path))
+    os.makedirs(snapshot_dir, exist_ok=True)
+    temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            f.write(zlib.compress(body.getvalue(), 6))
+        os.replace(temp_path, snapshot_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    total_files = sum(entry["files"] for entry in header["roots"])
+    logger.info(f"Снимок индекса изображений сохранен в {snapshot_path}: папок {len(header['roots'])}, "
+                f"файлов {total_files}, размер {os.path.getsize(snapshot_path) / 1024:.1f} КБ")
+    return header
+
+
+def _read_preamble(f) -> Dict[str, Any]:
+    preamble = f.read(_PREAMBLE.size)
+    if len(preamble) != _PREAMBLE.size:
+        raise ValueError("Файл снимка индекса поврежден")
+    magic, version, header_length = _PREAMBLE.unpack(preamble)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Файл не является снимком индекса изображений")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия снимка индекса: {version} (ожидается {SNAPSHOT_VERSION})")
+    return json.loads(f.read(header_length).decode('utf-8'))
+
+
+def read_snapshot_header(snapshot_path: str) -> Dict[str, Any]:
+    """
+    Читает заголовок снимка без распаковки содержимого.
+
+    Args:
+        snapshot_path (str): Путь к файлу снимка
+
+    Returns:
+        Dict[str, Any]: Заголовок снимка
+
+    Raises:
+        ValueError: Если файл не является снимком поддерживаемой версии
+    """
+    with open(snapshot_path, 'rb') as f:
+        return _read_preamble(f)
+
+
+def import_snapshot(snapshot_path: str,
+                    catalog: Optional[image_catalog.ImageCatalog] = None,
+                    roots: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Загружает снимок в каталог изображений.
+
+    Папка импортируется, только если снимок новее локальных данных каталога. Актуальность
+    затем проверяется инкрементально: при первом обновлении каталог сравнивает mtime папок
+    и перечитывает только изменившиеся после создания снимка.
+
+    Args:
+        snapshot_path (str): Путь к файлу снимка
+        catalog (Optional[ImageCatalog]): Каталог изображений. По умолчанию - общий каталог процесса
+        roots (Optional[List[str]]): Корневые папки для импорта. По умолчанию - все папки снимка
+
+    Returns:
+        Dict[str, Any]: Статистика импорта (imported, skipped, files, import_time_sec)
+
+    Raises:
+        ValueError: Если файл не является снимком поддерживаемой версии
+    """
+    start_time = time.perf_counter()
+    catalog = catalog or image_catalog.get_image_catalog()
+    with open(snapshot_path, 'rb') as f:
+        header = _read_preamble(f)
+        data = memoryview(zlib.decompress(f.read()))
+
+    stats = {"imported": [], "skipped": [], "files": 0, "import_time_sec": 0.0}
+    offset = 0
+    for entry in header["roots"]:
+        root = entry["root"]
+        dirs, files, offset = _decode_root(data, offset, root, entry["dirs"], entry["files"])
+        if roots is not None and root not in roots:
+            continue
+        if catalog.import_root(root, entry.get("kind"), entry.get("tier"), entry["refreshed_at"], dirs, files):
+            stats["imported"].append(root)
+            stats["files"] += len(files)
+        else:
+            stats["skipped"].append(root)
+
+    stats["import_time_sec"] = time.perf_counter() - start_time
+    logger.info(f"Снимок индекса изображений {snapshot_path} (создан на {header.get('created_on')}) "
+                f"загружен за {stats['import_time_sec']:.2f} сек: импортировано папок {len(stats['imported'])}, "
+                f"файлов {stats['files']}, пропущено как устаревшие {len(stats['skipped'])}")
+    return stats
+
+
+def get_configured_snapshot_path() -> str:
+    """
+    Возвращает путь к снимку индекса из настройки "scan_settings.snapshot_path".
+
+    Returns:
+        str: Путь к снимку или пустая строка, если снимок не настроен
+    """
+    from . import config_manager
+
+    return config_manager.get_setting_or_default("scan_settings.snapshot_path", "") or ""
+
+
+def import_configured_snapshot(catalog: Optional[image_catalog.ImageCatalog] = None) -> Optional[Dict[str, Any]]:
+    """
+    Загружает снимок индекса из настроек, если он задан и доступен. Ошибки только записываются в лог.
+
+    Args:
+        catalog (Optional[ImageCatalog]): Каталог изображений. По умолчанию - общий каталог процесса
+
+    Returns:
+        Optional[Dict[str, Any]]: Статистика импорта или None
+    """
+    snapshot_path = get_configured_snapshot_path()
+    if not snapshot_path or not os.path.isfile(snapshot_path):
+        return None
+    try:
+        return import_snapshot(snapshot_path, catalog)
+    except (OSError, ValueError, zlib.error) as e:
+        logger.warning(f"Не удалось загрузить снимок индекса изображений {snapshot_path}: {e}")
+        return None
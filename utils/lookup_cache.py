@@ -0,0 +1,149 @@
+"""
+Быстрый отказ при поиске отсутствующих артикулов: фильтр Блума и кэш отрицательных результатов
+"""
+import math
+import hashlib
+import threading
+from typing import Dict, Any, Iterable, Hashable
+
+# Допустимая доля ложноположительных ответов фильтра Блума
+DEFAULT_ERROR_RATE = 0.01
+
+# Максимальное количество записей в кэше отрицательных результатов одного поколения
+DEFAULT_NEGATIVE_CACHE_SIZE = 100_000
+
+
+class BloomFilter:
+    """
+    Фильтр Блума для строковых ключей.
+
+    Ответ "нет" точный, ответ "возможно есть" ошибочен с вероятностью около error_rate.
+    Хэши детерминированы (blake2b), поэтому фильтр можно передавать между процессами.
+    Удаление ключей не поддерживается: после удаления ключ дает ложноположительный ответ,
+    что безопасно, так как за фильтром всегда следует точный поиск.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE):
+        """
+        Args:
+            capacity (int): Ожидаемое количество ключей
+            error_rate (float): Допустимая доля ложноположительных ответов
+        """
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size_bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.size_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        size_bits = self.size_bits
+        return [(h1 + i * h2) % size_bits for i in range(self.hash_count)]
+
+    def add(self, key: str) -> None:
+        """
+        Добавляет ключ в фильтр.
+        """
+        bits = self._bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, keys: Iterable[str]) -> None:
+        """
+        Добавляет несколько ключей в фильтр.
+        """
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def is_overfilled(self) -> bool:
+        """
+        Проверяет, превышено ли расчетное количество ключей (фильтр стоит перестроить).
+        """
+        return self.count > self.capacity
+
+
+class NegativeLookupCache:
+    """
+    Кэш отрицательных результатов поиска, действительный для одного поколения данных.
+
+    Владелец кэша увеличивает номер поколения при каждом изменении данных (перестроение
+    индекса, событие файловой системы, изменение mtime папки). Записи прежнего поколения
+    отбрасываются при первом обращении с новым номером.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_NEGATIVE_CACHE_SIZE):
+        """
+        Args:
+            max_entries (int): Максимальное количество записей. При переполнении кэш очищается
+        """
+        self.max_entries = max_entries
+        self.generation: Any = None
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def _switch_generation(self, generation: Any) -> None:
+        if generation != self.generation:
+            self._keys.clear()
+            self.generation = generation
+
+    def contains(self, key: Hashable, generation: Any) -> bool:
+        """
+        Проверяет, известно ли, что ключ отсутствует в данных указанного поколения.
+        """
+        with self._lock:
+            self._switch_generation(generation)
+            return key in self._keys
+
+    def add(self, key: Hashable, generation: Any) -> None:
+        """
+        Запоминает, что ключ отсутствует в данных указанного поколения.
+        """
+        with self._lock:
+            self._switch_generation(generation)
+            if len(self._keys) >= self.max_entries:
+                self._keys.clear()
+            self._keys.add(key)
+
+    def clear(self) -> None:
+        """
+        Очищает кэш.
+        """
+        with self._lock:
+            self._keys.clear()
+            self.generation = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def format_negative_stats(stats: Dict[str, Any], baseline: Dict[str, Any] = None) -> str:
+    """
+    Возвращает долю промахов, отсеянных без точного поиска, в виде строки для лога.
+
+    Args:
+        stats (Dict[str, Any]): Статистика со счетчиками "misses", "bloom_rejects", "negative_cache_hits"
+        baseline (Dict[str, Any], optional): Ранее снятая статистика для вычисления разницы
+
+    Returns:
+        str: Строка со статистикой быстрых отказов
+    """
+    baseline = baseline or {}
+    misses = stats.get('misses', 0) - baseline.get('misses', 0)
+    bloom_rejects = stats.get('bloom_rejects', 0) - baseline.get('bloom_rejects', 0)
+    negative_cache_hits = stats.get('negative_cache_hits', 0) - baseline.get('negative_cache_hits', 0)
+    fast_misses = bloom_rejects + negative_cache_hits
+    rate = fast_misses / misses * 100 if misses else 0.0
+    return (f"быстрых отказов {fast_misses} ({rate:.0f}% промахов: фильтр Блума {bloom_rejects}, "
+            f"кэш отрицательных результатов {negative_cache_hits})")
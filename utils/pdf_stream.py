@@ -0,0 +1,466 @@
+"""
+Потоковая запись PDF: документ собирается из частей (PDF, созданных FPDF для нескольких сотен
+карточек), объекты которых сразу записываются в выходной файл. В памяти остаются только смещения
+объектов и страницы, поэтому расход памяти не зависит от количества карточек
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+from array import array
+from typing import Dict, List, Optional, Tuple, BinaryIO, Union
+
+logger = logging.getLogger(__name__)
+
+# Количество карточек в одной части документа
+DEFAULT_CHUNK_CARDS = 200
+
+# Потоковая запись включается для листов с таким количеством строк и больше (0 - не использовать)
+DEFAULT_STREAM_MIN_ROWS = 2000
+
+# Номера объектов, зарезервированные за корнем дерева страниц и каталогом итогового документа
+PAGES_OBJECT = 1
+CATALOG_OBJECT = 2
+
+_OBJECT_HEADER = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+_REFERENCE = re.compile(rb"(?<![\d.])(\d+)\s+(\d+)\s+R(?![A-Za-z])")
+_STREAM_START = re.compile(rb">>\s*stream(\r\n|\n|\r)")
+_LENGTH = re.compile(rb"/Length\s+(\d+)(\s+(\d+)\s+R)?")
+_TYPE = re.compile(rb"/Type\s*/(\w+)")
+_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+_DICT_REF = rb"/%s\s+(\d+)\s+\d+\s+R"
+
+
+class PdfObject:
+    """
+    Объект разбираемого PDF: текст объекта (словарь или значение) и данные потока (срез memoryview
+    исходного PDF без копирования).
+    """
+    __slots__ = ("head", "stream")
+
+    def __init__(self, head: bytes, stream: Optional[memoryview]):
+        self.head = head
+        self.stream = stream
+
+    def references(self) -> List[int]:
+        """Номера объектов, на которые ссылается объект"""
+        return [int(number) for number, _ in _iter_references(self.head)]
+
+    def dict_ref(self, key: bytes) -> Optional[int]:
+        """Номер объекта по ссылке из словаря объекта"""
+        match = re.search(_DICT_REF % key, self.head)
+        return int(match.group(1)) if match else None
+
+    def type(self) -> Optional[bytes]:
+        match = _TYPE.search(self.head)
+        return match.group(1) if match else None
+
+
+def _string_spans(head: bytes) -> List[Tuple[int, int]]:
+    """
+    Возвращает интервалы строк PDF (литеральных и шестнадцатеричных) в тексте объекта, чтобы
+    ссылки не искались внутри строк.
+    """
+    spans = []
+    i = 0
+    length = len(head)
+    while i < length:
+        char = head[i]
+        if char == 0x28:  # (
+            start = i
+            depth = 0
+            while i < length:
+                char = head[i]
+                if char == 0x5C:  # обратная косая черта экранирует следующий символ
+                    i += 2
+                    continue
+                if char == 0x28:
+                    depth += 1
+                elif char == 0x29:
+                    depth -= 1
+                    if depth == 0:
+                        break
+                i += 1
+            spans.append((start, i + 1))
+        elif char == 0x3C and i + 1 < length and head[i + 1] != 0x3C:  # <...>, но не <<
+            start = i
+            end = head.find(b">", i)
+            i = end if end >= 0 else length
+            spans.append((start, i + 1))
+        elif char == 0x3C:
+            i += 1  # пропускаем второй символ "<<"
+        elif char == 0x25:  # комментарий до конца строки
+            start = i
+            while i < length and head[i] not in (0x0A, 0x0D):
+                i += 1
+            spans.append((start, i))
+        i += 1
+    return spans
+
+
+def _iter_references(head: bytes):
+    """
+    Перебирает ссылки "N G R" вне строк. Возвращает пары (номер, match).
+    """
+    spans = _string_spans(head) if (b"(" in head or b"<" in head or b"%" in head) else []
+    for match in _REFERENCE.finditer(head):
+        if spans and any(start <= match.start() < end for start, end in spans):
+            continue
+        yield match.group(1), match
+
+
+def _rewrite_references(head: bytes, mapping: Dict[int, int]) -> bytes:
+    """
+    Заменяет номера объектов в ссылках по mapping (ссылки на неизвестные объекты заменяются на null).
+    """
+    parts = []
+    position = 0
+    for number, match in _iter_references(head):
+        parts.append(head[position:match.start()])
+        target = mapping.get(int(number))
+        parts.append(b"%d 0 R" % target if target is not None else b"null")
+        position = match.end()
+    if not parts:
+        return head
+    parts.append(head[position:])
+    return b"".join(parts)
+
+
+def parse_pdf(data: Union[bytes, bytearray]) -> Tuple[Dict[int, PdfObject], bytes, bytes]:
+    """
+    Разбирает PDF с таблицей перекрестных ссылок (так сохраняет FPDF) на объекты.
+
+    Args:
+        data: Содержимое PDF (потоки объектов ссылаются на него)
+
+    Returns:
+        Tuple[Dict[int, PdfObject], bytes, bytes]: Объекты по номерам, словарь trailer и версия PDF
+
+    Raises:
+        ValueError: Если структура PDF не распознана
+    """
+    version_match = re.match(rb"%PDF-(\d\.\d)", data)
+    if not version_match:
+        raise ValueError("Нет заголовка PDF")
+    startxref = _STARTXREF.findall(data[-1024:])
+    if not startxref:
+        raise ValueError("Не найден startxref")
+    position = int(startxref[-1])
+    if not data.startswith(b"xref", position):
+        raise ValueError("Поддерживается только таблица перекрестных ссылок (xref)")
+
+    offsets: Dict[int, int] = {}
+    lines = iter(data[position:].splitlines())
+    next(lines)  # xref
+    line = next(lines).strip()
+    while line and not line.startswith(b"trailer"):
+        first, count = (int(value) for value in line.split())
+        for number in range(first, first + count):
+            entry = next(lines).split()
+            if len(entry) >= 3 and entry[2] == b"n":
+                offsets[number] = int(entry[0])
+        line = next(lines).strip()
+    trailer_start = data.index(b"trailer", position)
+    trailer = bytes(data[trailer_start + len(b"trailer"):data.index(b"startxref", trailer_start)])
+
+    view = memoryview(data)
+    objects: Dict[int, PdfObject] = {}
+    lengths_by_ref: List[Tuple[int, int]] = []
+    for number, offset in offsets.items():
+        header = _OBJECT_HEADER.match(data, offset)
+        if not header or int(header.group(1)) != number:
+            raise ValueError(f"Объект {number} не найден по смещению {offset}")
+        body_start = header.end()
+        end = data.index(b"endobj", body_start)
+        stream_match = _STREAM_START.search(data, body_start, end)
+        if stream_match is None:
+            objects[number] = PdfObject(bytes(data[body_start:end].strip()), None)
+            continue
+        head = bytes(data[body_start:stream_match.start() + 2].strip())
+        length_match = _LENGTH.search(head)
+        if length_match is None:
+            raise ValueError(f"Нет длины потока объекта {number}")
+        if length_match.group(2):
+            # Длина потока в отдельном объекте: читается после разбора всех объектов
+            lengths_by_ref.append((number, int(length_match.group(3))))
+            stream_end = data.index(b"endstream", stream_match.end())
+            objects[number] = PdfObject(head, view[stream_match.end():stream_end])
+            continue
+        stream_start = stream_match.end()
+        stream = view[stream_start:stream_start + int(length_match.group(1))]
+        objects[number] = PdfObject(head, stream)
+    for number, length_ref in lengths_by_ref:
+        objects[number].stream = objects[number].stream[:int(bytes(objects[length_ref].head))]
+    return objects, trailer, version_match.group(1)
+
+
+class StreamingPdfWriter:
+    """
+    Записывает PDF по частям. Каждая часть - готовый PDF (например, от FPDF.output()): его страницы
+    дописываются в конец итогового документа, объекты получают новые номера, а одинаковые ресурсы
+    (шрифты, изображения) разных частей записываются один раз. Дерево страниц, каталог, таблица
+    перекрестных ссылок и trailer записываются в close().
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Путь к создаваемому PDF
+        """
+        self.path = path
+        self._file: Optional[BinaryIO] = open(path, "wb")
+        self._version = b"1.3"
+        self._header_written = False
+        # Смещения объектов по номерам (индекс 0 - свободный объект)
+        self._offsets = array("q", [0, 0, 0])
+        self._pages = array("q")
+        self._media_box: Optional[bytes] = None
+        self._catalog: Optional[bytes] = None
+        self._info: Optional[bytes] = None
+        # Хэши общих объектов (ресурсов страниц) -> номер записанного объекта
+        self._shared: Dict[bytes, int] = {}
+        self._id = hashlib.md5(f"{path}{time.time()}".encode("utf-8", "surrogateescape"))
+        self.stats = {"parts": 0, "pages": 0, "objects": 0, "shared_objects": 0, "bytes": 0}
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self.stats["bytes"] += len(data)
+
+    def _allocate(self) -> int:
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+
+    def _write_object(self, number: int, head: bytes, stream: Optional[memoryview] = None) -> None:
+        self._offsets[number] = self._file.tell()
+        self._write(b"%d 0 obj\n" % number)
+        self._write(head)
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+        self.stats["objects"] += 1
+
+    def append_pdf(self, data: Union[bytes, bytearray]) -> int:
+        """
+        Дописывает страницы PDF в итоговый документ.
+
+        Args:
+            data: Содержимое PDF (результат FPDF.output() передается без копирования)
+
+        Returns:
+            int: Количество добавленных страниц
+        """
+        objects, trailer, version = parse_pdf(data)
+        if not self._header_written:
+            self._version = version
+            self._write(b"%PDF-" + version + b"\n%\xe9\xeb\xf1\xbf\n")
+            self._header_written = True
+        elif version > self._version:
+            self._version = version
+
+        root = int(re.search(_DICT_REF % b"Root", trailer).group(1))
+        info_match = re.search(_DICT_REF % b"Info", trailer)
+        info = int(info_match.group(1)) if info_match else None
+        catalog = objects[root]
+        pages_root = catalog.dict_ref(b"Pages")
+
+        # Страницы части в порядке дерева страниц
+        pages: List[int] = []
+        page_trees: Dict[int, Optional[bytes]] = {}
+        stack = [(pages_root, None)]
+        while stack:
+            number, inherited_box = stack.pop()
+            node = objects[number]
+            box_match = re.search(rb"/MediaBox\s*(\[[^\]]*\])", node.head)
+            media_box = box_match.group(1) if box_match else inherited_box
+            if node.type() == b"Pages":
+                page_trees[number] = media_box
+                kids = re.search(rb"/Kids\s*\[([^\]]*)\]", node.head).group(1)
+                children = [int(kid) for kid, _ in _iter_references(kids)]
+                stack.extend((kid, media_box) for kid in reversed(children))
+            else:
+                pages.append(number)
+                page_trees[number] = media_box
+
+        # Корень дерева страниц части заменяется общим корнем; каталог и сведения о документе
+        # берутся из первой части
+        page_set = set(pages)
+        mapping: Dict[int, int] = {number: PAGES_OBJECT for number in page_trees if number not in page_set}
+        # Содержимое страниц уникально и не сравнивается с уже записанными объектами
+        page_contents = set()
+        for number in pages:
+            contents = re.search(rb"/Contents\s*(\[[^\]]*\]|\d+\s+\d+\s+R)", objects[number].head)
+            if contents:
+                page_contents.update(int(ref) for ref, _ in _iter_references(contents.group(1)))
+        skipped = {root} | ({info} if info is not None else set())
+
+        def assign(number: int) -> Optional[int]:
+            # Потомки записываются раньше родителя, поэтому ссылки родителя уже известны. Объекты,
+            # ссылающиеся друг на друга по кругу, получают номер заранее и не объединяются
+            pending = [(number, False)]
+            visiting = set()
+            reserved = set()
+            while pending:
+                current, expanded = pending.pop()
+                if current in skipped or current not in objects:
+                    continue
+                if current in mapping and current not in reserved:
+                    continue
+                if not expanded:
+                    if current in visiting:
+                        continue
+                    visiting.add(current)
+                    pending.append((current, True))
+                    pending.extend((ref, False) for ref in objects[current].references()
+                                   if ref not in mapping and ref not in skipped)
+                    continue
+                obj = objects[current]
+                for ref in obj.references():
+                    if ref in visiting and ref not in mapping:
+                        mapping[ref] = self._allocate()
+                        reserved.add(ref)
+                head = _rewrite_references(obj.head, mapping)
+                if current in reserved:
+                    reserved.discard(current)
+                    self._write_object(mapping[current], head, obj.stream)
+                    continue
+                if current in page_contents:
+                    new_number = self._allocate()
+                    self._write_object(new_number, head, obj.stream)
+                else:
+                    digest = hashlib.blake2b(head + b"\0", digest_size=16)
+                    if obj.stream is not None:
+                        digest.update(obj.stream)
+                    digest = digest.digest()
+                    new_number = self._shared.get(digest)
+                    if new_number is None:
+                        new_number = self._allocate()
+                        self._write_object(new_number, head, obj.stream)
+                        self._shared[digest] = new_number
+                    else:
+                        self.stats["shared_objects"] += 1
+                mapping[current] = new_number
+            return mapping.get(number)
+
+        # Номера страниц выделяются до их ресурсов: ссылки на страницы (ссылки, аннотации)
+        # переводятся сразу
+        for number in pages:
+            mapping[number] = self._allocate()
+        for number in pages:
+            page = objects[number]
+            for ref in page.references():
+                assign(ref)
+            head = _rewrite_references(page.head, mapping)
+            if self._media_box is None:
+                self._media_box = page_trees[number]
+            elif page_trees[number] != self._media_box and b"/MediaBox" not in page.head:
+                head = head.replace(b"/Type /Page", b"/MediaBox " + page_trees[number] + b"\n/Type /Page", 1)
+            self._write_object(mapping[number], head, page.stream)
+            self._pages.append(mapping[number])
+
+        if self._catalog is None:
+            for ref in catalog.references():
+                assign(ref)
+            self._catalog = _rewrite_references(catalog.head, mapping)
+            self._info = objects[info].head if info is not None else None
+
+        self.stats["parts"] += 1
+        self.stats["pages"] += len(pages)
+        return len(pages)
+
+    def close(self) -> None:
+        """
+        Записывает дерево страниц, каталог, таблицу перекрестных ссылок и trailer и закрывает файл.
+        """
+        if self._file is None:
+            return
+        if not self._header_written:
+            self._write(b"%PDF-" + self._version + b"\n%\xe9\xeb\xf1\xbf\n")
+            self._header_written = True
+
+        # Корень дерева страниц: все страницы одним списком, как у FPDF
+        self._offsets[PAGES_OBJECT] = self._file.tell()
+        self._write(b"%d 0 obj\n<<\n/Count %d\n/Kids [" % (PAGES_OBJECT, len(self._pages)))
+        for index in range(0, len(self._pages), 1000):
+            self._write(b"\n".join(b"%d 0 R" % page for page in self._pages[index:index + 1000]))
+            self._write(b"\n")
+        self._write(b"]\n")
+        if self._media_box:
+            self._write(b"/MediaBox " + self._media_box + b"\n")
+        self._write(b"/Type /Pages\n>>\nendobj\n")
+        self.stats["objects"] += 1
+
+        catalog = self._catalog or b"<<\n/Pages %d 0 R\n/Type /Catalog\n>>" % PAGES_OBJECT
+        if self._version > b"1.3" and b"/Version" not in catalog:
+            # Заголовок записан по первой части; более новая версия указывается в каталоге
+            catalog = catalog.replace(b"/Type /Catalog", b"/Type /Catalog\n/Version /" + self._version, 1)
+        self._write_object(CATALOG_OBJECT, catalog)
+        info_number = None
+        if self._info is not None:
+            info_number = self._allocate()
+            self._write_object(info_number, self._info)
+
+        xref_offset = self._file.tell()
+        self._write(b"xref\n0 %d\n" % len(self._offsets))
+        self._write(b"0000000000 65535 f \n")
+        for index in range(1, len(self._offsets), 1000):
+            self._write(b"".join(b"%010d 00000 n \n" % offset for offset in self._offsets[index:index + 1000]))
+        file_id = self._id.hexdigest().upper().encode("ascii")
+        self._write(b"trailer\n<<\n/Size %d\n/Root %d 0 R\n" % (len(self._offsets), CATALOG_OBJECT))
+        if info_number is not None:
+            self._write(b"/Info %d 0 R\n" % info_number)
+        self._write(b"/ID [<" + file_id + b"><" + file_id + b">]\n>>\n")
+        self._write(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+        self._file.close()
+        self._file = None
+
+    def abort(self) -> None:
+        """
+        Закрывает и удаляет недописанный файл.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def format_stats(self) -> str:
+        """
+        Возвращает статистику записи в виде строки для лога.
+        """
+        return (f"частей {self.stats['parts']}, страниц {self.stats['pages']}, объектов {self.stats['objects']}, "
+                f"общих ресурсов использовано повторно {self.stats['shared_objects']}, "
+                f"размер {self.stats['bytes'] / 1024 / 1024:.2f} МБ")
+
+
+def get_configured_chunk_size() -> int:
+    """
+    Возвращает количество карточек в одной части документа из настройки "pdf_settings.stream_chunk_cards".
+    """
+    from . import config_manager
+
+    return config_manager.get_non_negative_int_setting("pdf_settings.stream_chunk_cards",
+                                                       DEFAULT_CHUNK_CARDS) or DEFAULT_CHUNK_CARDS
+
+
+def get_configured_chunk_cards(rows: int) -> int:
+    """
+    Возвращает размер части документа в карточках для потоковой записи PDF по настройкам
+    "pdf_settings.stream_min_rows" и "pdf_settings.stream_chunk_cards".
+
+    Args:
+        rows: Количество карточек
+
+    Returns:
+        int: Количество карточек в части или 0, если документ собирается в памяти целиком
+    """
+    from . import config_manager
+
+    min_rows = config_manager.get_non_negative_int_setting("pdf_settings.stream_min_rows", DEFAULT_STREAM_MIN_ROWS)
+    if not min_rows or rows < min_rows:
+        return 0
+    return get_configured_chunk_size()
@@ -0,0 +1,384 @@
+"""
+Готовые уменьшенные копии изображений для карточек: заранее рассчитываются для всей библиотеки
+фотографий (python start.py --precompute-images) и используются при создании PDF вместо оригиналов
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+from . import card_layout
+from . import image_utils
+from . import image_catalog
+from . import image_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Версия формата хранилища. При изменении хранилище пересчитывается
+RENDITIONS_VERSION = 1
+
+# Папка хранилища по умолчанию (рядом с пресетами настроек)
+DEFAULT_RENDITIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'settings_presets',
+    'renditions'
+)
+
+MANIFEST_NAME = "manifest.sqlite3"
+
+# Ступени размера копий в КБ. При создании PDF выбирается наибольшая ступень, не превышающая
+# целевой размер изображения
+DEFAULT_TIERS_KB = (40, 120, 300)
+
+# Манифест сохраняется после каждых COMMIT_EVERY обработанных изображений, поэтому прерванный
+# расчет продолжается почти с того же места
+COMMIT_EVERY = 200
+
+# Количество заданий в работе на каждый процесс пула
+JOBS_PER_WORKER = 4
+
+
+def _root_label(root: str) -> str:
+    """
+    Имя папки хранилища для корневой папки изображений: имя папки и короткий хэш полного пути.
+    """
+    digest = hashlib.sha1(os.path.normcase(os.path.abspath(root)).encode('utf-8', 'surrogateescape')).hexdigest()[:8]
+    name = os.path.basename(os.path.normpath(root)).strip() or "root"
+    return "".join(char if char.isalnum() or char in "-_." else "_" for char in name) + "_" + digest
+
+
+def _render_job(source_path: str, destinations: Dict[int, str], max_width: Optional[int],
+                max_height: Optional[int], optimizer: image_utils.ImageOptimizer
+                ) -> Tuple[str, Optional[int], Optional[float], Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Задание для процесса пула: декодирует изображение один раз и сохраняет копии всех ступеней.
+
+    Returns:
+        Tuple: (путь, размер исходника, mtime исходника, ступень -> [путь копии, размер], ошибка)
+    """
+    try:
+        stat = os.stat(source_path)
+        prepared = None
+        files = {}
+        for tier_kb, destination in sorted(destinations.items()):
+            if prepared is None and optimizer.passthrough_size(source_path, tier_kb * 1024,
+                                                               max_width, max_height) is None:
+                prepared = optimizer.prepare(source_path, max_width, max_height)
+            buffer, _ = optimizer.encode(source_path, tier_kb, max_width, max_height, prepared=prepared)
+            data = buffer.getvalue()
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            temp_path = f"{destination}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, destination)
+            files[str(tier_kb)] = [destination, len(data)]
+        return source_path, stat.st_size, stat.st_mtime, files, None
+    except Exception as e:
+        return source_path, None, None, None, str(e)
+
+
+class RenditionStore:
+    """
+    Хранилище копий изображений нескольких ступеней размера.
+
+    Копии лежат в дереве, повторяющем исходные папки: <папка>/<ступень>kb/<корень>/<путь>.jpg.
+    Манифест SQLite хранит для каждого исходника размер и mtime, по которым рассчитаны копии:
+    копия используется и пропускается при пересчете, только если исходник не изменился.
+    Параметры расчета (ступени, ширина печати, настройки сжатия) сохраняются в манифесте;
+    при их изменении манифест очищается и копии рассчитываются заново.
+    """
+
+    def __init__(self, root_dir: str = DEFAULT_RENDITIONS_DIR, tiers_kb: Iterable[int] = DEFAULT_TIERS_KB,
+                 max_width: Optional[int] = None, max_height: Optional[int] = None,
+                 optimizer: Optional[image_utils.ImageOptimizer] = None):
+        """
+        Args:
+            root_dir (str): Папка хранилища
+            tiers_kb (Iterable[int]): Ступени размера в КБ
+            max_width (Optional[int]): Максимальная ширина копий в пикселях
+            max_height (Optional[int]): Максимальная высота копий в пикселях
+            optimizer (Optional[ImageOptimizer]): Настройки сжатия
+        """
+        self.root_dir = root_dir
+        self.tiers_kb = sorted(set(int(tier) for tier in tiers_kb if int(tier) > 0))
+        self.max_width = max_width
+        self.max_height = max_height
+        self.optimizer = optimizer or image_utils.ImageOptimizer()
+        self.params = {
+            "version": RENDITIONS_VERSION,
+            "tiers_kb": self.tiers_kb,
+            "max_width": max_width,
+            "max_height": max_height,
+            "optimizer": self.optimizer.get_settings(),
+        }
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root_dir, MANIFEST_NAME), check_same_thread=False)
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        with self._lock, self._conn as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS renditions ("
+                         "source TEXT PRIMARY KEY, size INTEGER, mtime REAL, files TEXT, created_at REAL)")
+            row = conn.execute("SELECT value FROM meta WHERE key='params'").fetchone()
+            params = json.dumps(self.params, sort_keys=True)
+            if row is None or row[0] != params:
+                if row is not None:
+                    logger.info("Параметры копий изображений изменились, манифест очищается")
+                conn.execute("DELETE FROM renditions")
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def destinations(self, root: str, source_path: str) -> Dict[int, str]:
+        """
+        Возвращает пути копий исходного файла для каждой ступени.
+        """
+        relative = os.path.relpath(source_path, root)
+        return {tier_kb: os.path.join(self.root_dir, f"{tier_kb}kb", _root_label(root), relative + ".jpg")
+                for tier_kb in self.tiers_kb}
+
+    def current_sources(self) -> Dict[str, Tuple[int, float]]:
+        """
+        Возвращает исходники, для которых в манифесте есть копии: путь -> (размер, mtime).
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT source, size, mtime FROM renditions").fetchall()
+        return {source: (size, mtime) for source, size, mtime in rows}
+
+    def record(self, source_path: str, size: int, mtime: float, files: Dict[str, Any], commit: bool = False) -> None:
+        """
+        Записывает в манифест копии исходного файла.
+        """
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO renditions (source, size, mtime, files, created_at) "
+                               "VALUES (?, ?, ?, ?, ?)", (source_path, size, mtime, json.dumps(files), time.time()))
+            if commit:
+                self._conn.commit()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def lookup(self, source_path: str, target_size_kb: float) -> Optional[bytes]:
+        """
+        Возвращает копию наибольшей ступени, не превышающей target_size_kb, если исходник не изменился.
+
+        Args:
+            source_path (str): Путь к исходному изображению
+            target_size_kb (float): Целевой размер изображения в КБ
+
+        Returns:
+            Optional[bytes]: Байты JPEG или None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, files FROM renditions WHERE source=?",
+                                     (source_path,)).fetchone()
+        data = None
+        if row is not None:
+            try:
+                stat = os.stat(source_path)
+                if stat.st_size != row[0] or stat.st_mtime != row[1]:
+                    with self._lock:
+                        self.stats["stale"] += 1
+                    row = None
+            except OSError:
+                row = None
+        if row is not None:
+            files = json.loads(row[2])
+            fitting = [int(tier) for tier in files if int(tier) <= target_size_kb]
+            if fitting:
+                path, size = files[str(max(fitting))]
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    data = None
+        with self._lock:
+            self.stats["hits" if data else "misses"] += 1
+        return data or None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+    def format_stats(self, baseline: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Возвращает статистику использования копий в виде строки для лога.
+        """
+        baseline = baseline or {}
+        stats = {key: value - baseline.get(key, 0) for key, value in self.get_stats().items()}
+        return (f"использовано {stats['hits']} из {stats['hits'] + stats['misses']}, "
+                f"устаревших {stats['stale']}")
+
+
+def get_configured_tiers() -> List[int]:
+    """
+    Возвращает ступени размера копий из настройки "image_settings.rendition_tiers_kb".
+    """
+    from . import config_manager
+
+    tiers = config_manager.get_setting_or_default("image_settings.rendition_tiers_kb", list(DEFAULT_TIERS_KB))
+    try:
+        return [int(tier) for tier in tiers if int(tier) > 0] or list(DEFAULT_TIERS_KB)
+    except (TypeError, ValueError):
+        return list(DEFAULT_TIERS_KB)
+
+
+def get_configured_dir() -> str:
+    """
+    Возвращает папку хранилища копий из настройки "image_settings.renditions_dir".
+    """
+    from . import config_manager
+
+    return config_manager.get_setting_or_default("image_settings.renditions_dir", "") or DEFAULT_RENDITIONS_DIR
+
+
+def get_pdf_image_size() -> Optional[int]:
+    """
+    Ширина изображения карточки PDF в пикселях при разрешении печати из настроек
+    (см. card_layout.CARD_PAGE_GEOMETRY).
+    """
+    if not image_utils.is_resize_enabled():
+        return None
+    return image_utils.mm_to_pixels(card_layout.CARD_PAGE_GEOMETRY.image_width,
+                                    image_utils.get_configured_print_dpi())
+
+
+def open_configured_store(max_width: Optional[int], optimizer: Optional[image_utils.ImageOptimizer] = None
+                          ) -> Optional[RenditionStore]:
+    """
+    Открывает хранилище копий для создания PDF, если копии уже рассчитаны с теми же параметрами.
+
+    Args:
+        max_width (Optional[int]): Ширина изображений карточки в пикселях
+        optimizer (Optional[ImageOptimizer]): Оптимизатор запуска (настройки сжатия)
+
+    Returns:
+        Optional[RenditionStore]: Хранилище или None, если копий нет или они рассчитаны для других параметров
+    """
+    root_dir = get_configured_dir()
+    manifest_path = os.path.join(root_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with sqlite3.connect(manifest_path) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key='params'").fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Не удалось открыть манифест копий изображений {manifest_path}: {e}")
+        return None
+    if row is None:
+        return None
+    params = json.loads(row[0])
+    optimizer = optimizer or image_utils.ImageOptimizer()
+    if (params.get("version") != RENDITIONS_VERSION or params.get("max_width") != max_width
+            or params.get("max_height") is not None or params.get("optimizer") != optimizer.get_settings()):
+        logger.info("Копии изображений рассчитаны для других параметров и не используются")
+        return None
+    return RenditionStore(root_dir, params["tiers_kb"], max_width, None, optimizer)
+
+
+def precompute_renditions(folders: Optional[Dict[str, List[str]]] = None,
+                          root_dir: Optional[str] = None,
+                          tiers_kb: Optional[Iterable[int]] = None,
+                          workers: Optional[int] = None,
+                          catalog: Optional[image_catalog.ImageCatalog] = None) -> Dict[str, Any]:
+    """
+    Рассчитывает копии всех изображений папок для карточек PDF.
+
+    Список файлов берется из каталога изображений (с инкрементальным обновлением). Изображения,
+    копии которых уже рассчитаны для текущей версии файла, пропускаются, поэтому повторный запуск
+    после прерывания продолжает работу. Изображения обрабатываются в пуле процессов.
+
+    Args:
+        folders (Optional[Dict[str, List[str]]]): Папки "тип -> список". По умолчанию - папки из настроек
+        root_dir (Optional[str]): Папка хранилища. По умолчанию - из настроек
+        tiers_kb (Optional[Iterable[int]]): Ступени размера в КБ. По умолчанию - из настроек
+        workers (Optional[int]): Количество процессов. По умолчанию - из настроек конвейера изображений
+        catalog (Optional[ImageCatalog]): Каталог изображений. По умолчанию - общий каталог процесса
+
+    Returns:
+        Dict[str, Any]: Статистика (total, skipped, rendered, failed, time_sec)
+    """
+    start_time = time.perf_counter()
+    folders = folders if folders is not None else image_catalog.get_configured_folders()
+    catalog = catalog or image_catalog.get_image_catalog()
+    optimizer = image_utils.ImageOptimizer()
+    store = RenditionStore(root_dir or get_configured_dir(), tiers_kb or get_configured_tiers(),
+                           get_pdf_image_size(), None, optimizer)
+    workers = workers if workers is not None else image_pipeline.get_configured_workers()
+
+    current = store.current_sources()
+    jobs = []
+    stats = {"total": 0, "skipped": 0, "rendered": 0, "failed": 0, "time_sec": 0.0}
+    seen_roots = set()
+    for kind, kind_folders in folders.items():
+        for tier, root in enumerate(kind_folders):
+            if not root or root in seen_roots:
+                continue
+            seen_roots.add(root)
+            catalog.refresh(root, kind, tier)
+            exported = catalog.export_root(root)
+            if exported is None:
+                continue
+            for path, _, _, _ in exported["files"]:
+                stats["total"] += 1
+                # Файл, измененный на месте, не меняет mtime папки, поэтому актуальность копий
+                # проверяется по самому файлу, а не по данным каталога
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if current.get(path) == (stat.st_size, stat.st_mtime):
+                    stats["skipped"] += 1
+                    continue
+                jobs.append((path, store.destinations(root, path)))
+
+    logger.info(f"Копии изображений: файлов {stats['total']}, актуальных {stats['skipped']}, "
+                f"к расчету {len(jobs)}, процессов {workers}")
+
+    def handle(result) -> None:
+        source_path, size, mtime, files, error = result
+        if error is not None:
+            stats["failed"] += 1
+            logger.warning(f"Не удалось рассчитать копии {source_path}: {error}")
+            return
+        stats["rendered"] += 1
+        store.record(source_path, size, mtime, files, commit=stats["rendered"] % COMMIT_EVERY == 0)
+        if stats["rendered"] % COMMIT_EVERY == 0:
+            logger.info(f"Копии изображений: рассчитано {stats['rendered']} из {len(jobs)}")
+
+    try:
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = set()
+                for source_path, destinations in jobs:
+                    if len(in_flight) >= workers * JOBS_PER_WORKER:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            handle(future.result())
+                    in_flight.add(executor.submit(_render_job, source_path, destinations,
+                                                  store.max_width, store.max_height, optimizer))
+                for future in wait(in_flight).done:
+                    handle(future.result())
+        else:
+            for source_path, destinations in jobs:
+                handle(_render_job(source_path, destinations, store.max_width, store.max_height, optimizer))
+    finally:
+        # Рассчитанные копии сохраняются и при прерывании: следующий запуск их пропустит
+        store.commit()
+        store.close()
+
+    stats["time_sec"] = time.perf_counter() - start_time
+    logger.info(f"Копии изображений рассчитаны за {stats['time_sec']:.1f} сек: рассчитано {stats['rendered']}, "
+                f"пропущено {stats['skipped']}, ошибок {stats['failed']}")
+    return stats